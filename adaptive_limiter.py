@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Limite adaptativo de concorrência
+Limita as chamadas simultâneas à API do modelo (messages.create,
+files.upload) com um limite AIMD: sobe um pedido por "janela" enquanto as
+respostas chegam sem degradação e desce multiplicativamente com 429/529,
+timeouts ou latência bem acima da base observada. Evita tanto capacidade
+parada como o colapso de latência por excesso de pedidos.
+
+A degradação compara a média móvel exponencial das latências recentes com a
+mediana da janela: a variância normal das respostas (e picos isolados) não
+reduz o limite, uma subida sustentada sim.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional, TypeVar
+
+import anthropic
+from prometheus_client import Counter, Gauge
+
+from cancellation import CancelToken
+
+logger = logging.getLogger(__name__)
+
+ADAPTIVE_INITIAL_LIMIT = float(os.getenv('ADAPTIVE_INITIAL_LIMIT', '8'))
+ADAPTIVE_MIN_LIMIT = float(os.getenv('ADAPTIVE_MIN_LIMIT', '1'))
+ADAPTIVE_MAX_LIMIT = float(os.getenv('ADAPTIVE_MAX_LIMIT', '64'))
+# Fator de redução com 429/529/timeouts e com latência degradada
+ADAPTIVE_BACKOFF = float(os.getenv('ADAPTIVE_BACKOFF', '0.5'))
+ADAPTIVE_LATENCY_BACKOFF = float(os.getenv('ADAPTIVE_LATENCY_BACKOFF', '0.9'))
+# Média recente acima de base × tolerância conta como degradação
+ADAPTIVE_LATENCY_TOLERANCE = float(os.getenv('ADAPTIVE_LATENCY_TOLERANCE', '2.0'))
+# Peso de cada resposta na média móvel exponencial da latência recente
+ADAPTIVE_LATENCY_SMOOTHING = float(os.getenv('ADAPTIVE_LATENCY_SMOOTHING', '0.1'))
+# Espera máxima por uma vaga antes de recusar a chamada (sem prazo de quem chama)
+ADAPTIVE_QUEUE_TIMEOUT = float(os.getenv('ADAPTIVE_QUEUE_TIMEOUT', '120'))
+# Latências por operação usadas para a base (mediana recente)
+ADAPTIVE_BASELINE_WINDOW = int(os.getenv('ADAPTIVE_BASELINE_WINDOW', '100'))
+
+# Um limitador por worker: com PROMETHEUS_MULTIPROC_DIR somam-se os dos workers vivos
+LIMIT_GAUGE = Gauge("autofund_model_concurrency_limit", "Limite atual de chamadas simultâneas ao modelo",
+                    multiprocess_mode="livesum")
+INFLIGHT_GAUGE = Gauge("autofund_model_inflight", "Chamadas ao modelo em curso", multiprocess_mode="livesum")
+LIMITER_REJECTED = Counter(
+    "autofund_model_limiter_rejected_total", "Chamadas recusadas por falta de vaga", ["operation"])
+LIMIT_DECREASES = Counter(
+    "autofund_model_limit_decreases_total", "Reduções do limite de concorrência", ["reason"])
+
+T = TypeVar("T")
+
+
+class ConcurrencyLimitExceeded(Exception):
+    def __init__(self, operation: str, waited: float):
+        super().__init__(f"Sem vaga para chamar o modelo ({operation}) após {waited:.0f}s")
+        self.operation = operation
+
+
+def is_overload(error: BaseException) -> bool:
+    """Sinais de sobrecarga do lado da API: 429, 529 e timeouts"""
+    if isinstance(error, anthropic.APITimeoutError):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in (429, 529)
+    return False
+
+
+class AdaptiveLimiter:
+    """Semáforo com limite AIMD partilhado pelas threads do processo"""
+
+    def __init__(self, initial: float = ADAPTIVE_INITIAL_LIMIT, min_limit: float = ADAPTIVE_MIN_LIMIT,
+                 max_limit: float = ADAPTIVE_MAX_LIMIT, backoff: float = ADAPTIVE_BACKOFF,
+                 latency_backoff: float = ADAPTIVE_LATENCY_BACKOFF,
+                 latency_tolerance: float = ADAPTIVE_LATENCY_TOLERANCE,
+                 latency_smoothing: float = ADAPTIVE_LATENCY_SMOOTHING,
+                 queue_timeout: float = ADAPTIVE_QUEUE_TIMEOUT,
+                 baseline_window: int = ADAPTIVE_BASELINE_WINDOW):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+        self.latency_smoothing = latency_smoothing
+        self.queue_timeout = queue_timeout
+        self.baseline_window = baseline_window
+        self.inflight = 0
+        self._cond = threading.Condition()
+        self._latencies: Dict[str, deque] = {}
+        self._recent: Dict[str, float] = {}
+        # Uma só redução por "geração" de pedidos: falhas simultâneas do
+        # mesmo pico não devem dividir o limite várias vezes
+        self._generation = 0
+        self.stats = {"rejected": 0, "decreases": 0}
+        LIMIT_GAUGE.set(self.limit)
+        INFLIGHT_GAUGE.set(0)
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def acquire(self, operation: str, timeout: Optional[float] = None,
+                cancel_token: Optional[CancelToken] = None) -> int:
+        """Ocupa uma vaga; retorna a geração do limite no momento da entrada
+
+        `timeout` (o que resta do orçamento de quem chama) limita a espera;
+        com `cancel_token` a espera termina com TaskCancelled no cancelamento.
+        """
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        started = time.monotonic()
+        if cancel_token is not None:
+            cancel_token.on_cancel(self._wake)
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                if cancel_token is not None:
+                    cancel_token.check("à espera de vaga para o modelo")
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if self.inflight < int(self.limit):
+                        break
+                    self.stats["rejected"] += 1
+                    LIMITER_REJECTED.labels(operation=operation).inc()
+                    raise ConcurrencyLimitExceeded(operation, time.monotonic() - started)
+            self.inflight += 1
+            INFLIGHT_GAUGE.set(self.inflight)
+            return self._generation
+
+    def release(self, operation: str, generation: int, latency: float, error: Optional[BaseException] = None):
+        with self._cond:
+            self.inflight -= 1
+            INFLIGHT_GAUGE.set(self.inflight)
+            if error is not None:
+                if is_overload(error):
+                    self._decrease(generation, self.backoff, "overload")
+            else:
+                baseline = self._baseline(operation)
+                recent = self._record(operation, latency)
+                if baseline is not None and recent > baseline * self.latency_tolerance:
+                    self._decrease(generation, self.latency_backoff, "latency")
+                else:
+                    # Aumento aditivo: +1 por cada `limit` respostas saudáveis
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            LIMIT_GAUGE.set(self.limit)
+            self._cond.notify_all()
+
+    def _baseline(self, operation: str) -> Optional[float]:
+        window = self._latencies.get(operation)
+        if not window or len(window) < 5:
+            return None
+        ordered = sorted(window)
+        return ordered[len(ordered) // 2]
+
+    def _record(self, operation: str, latency: float) -> float:
+        """Guarda a latência na janela e retorna a média móvel exponencial atualizada"""
+        window = self._latencies.get(operation)
+        if window is None:
+            window = self._latencies[operation] = deque(maxlen=self.baseline_window)
+        window.append(latency)
+        previous = self._recent.get(operation, latency)
+        recent = self._recent[operation] = previous + self.latency_smoothing * (latency - previous)
+        return recent
+
+    def _decrease(self, generation: int, factor: float, reason: str):
+        if generation != self._generation:
+            return
+        self._generation += 1
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.stats["decreases"] += 1
+        LIMIT_DECREASES.labels(reason=reason).inc()
+        logger.warning(f"Limite de concorrência do modelo: {previous:.1f} → {self.limit:.1f} ({reason})")
+
+    def run(self, operation: str, fn: Callable[[], T], timeout: Optional[float] = None,
+            cancel_token: Optional[CancelToken] = None) -> T:
+        generation = self.acquire(operation, timeout, cancel_token)
+        started = time.monotonic()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.release(operation, generation, time.monotonic() - started, e)
+            raise
+        self.release(operation, generation, time.monotonic() - started)
+        return result
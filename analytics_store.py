@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Armazém Analítico
+Guarda extrações e rácios de cada análise concluída em Parquet particionado
+por ano fiscal (periodo=AAAA/), para benchmarking setorial e consultas de
+carteira sem percorrer os relatórios JSON em outputs/.
+
+Uso:
+    python analytics_store.py backfill outputs/   # importa relatórios JSON existentes
+    python analytics_store.py compact             # junta ficheiros pequenos por partição
+"""
+
+import os
+import sys
+import json
+import uuid
+import atexit
+import logging
+import threading
+import time
+from pathlib import Path
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional; sem ele o armazém fica desativado
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_STORE_DIR = Path(os.getenv('ANALYTICS_STORE_DIR', 'outputs/analytics'))
+ANALYTICS_STORE_ENABLED = os.getenv('ANALYTICS_STORE_ENABLED', 'true').lower() == 'true'
+# Linhas são acumuladas e escritas em lote para evitar muitos ficheiros pequenos
+ANALYTICS_FLUSH_ROWS = int(os.getenv('ANALYTICS_FLUSH_ROWS', '500'))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv('ANALYTICS_FLUSH_SECONDS', '60'))
+
+# Colunas do armazém (campos de ExtracoesFinanceiras + rácios + risco)
+FLOAT_COLUMNS = [
+    "volume_negocios", "custo_mercadorias", "custo_materias", "fornecimento_servicos",
+    "custos_pessoal", "depreciacoes", "ebitda", "resultados_operacionais",
+    "resultados_financeiros", "resultados_antes_imposto", "imposto_periodo",
+    "resultado_liquido", "ativo_corrente", "ativo_nao_corrente", "total_ativo",
+    "passivo_corrente", "passivo_nao_corrente", "total_passivo", "capital_proprio",
+    "total_ativo_bruto", "total_amortizacoes_acumuladas", "investimentos_em_imobilizado",
+    "autonomia_financeira", "liquidez_geral", "margem_ebitda", "rentabilidade_ativos",
+    "endividamento", "pontuacao_risco",
+]
+STRING_COLUMNS = ["nif", "nome_empresa", "cae", "nivel_risco", "conjunto_regras", "task_id"]
+
+
+def _schema():
+    fields = [pa.field(c, pa.string()) for c in STRING_COLUMNS]
+    fields += [pa.field(c, pa.float64()) for c in FLOAT_COLUMNS]
+    fields += [
+        pa.field("contabilidade_bate", pa.bool_()),
+        pa.field("data_processamento", pa.timestamp("us")),
+        pa.field("periodo", pa.string()),
+    ]
+    return pa.schema(fields)
+
+
+def build_row(dados_financeiros: Dict[str, Any], analise: Dict[str, Any],
+              task_id: Optional[str] = None,
+              data_processamento: Optional[datetime] = None) -> Dict[str, Any]:
+    """Constrói uma linha do armazém a partir de dicts de extração e análise"""
+    row = {c: dados_financeiros.get(c) for c in STRING_COLUMNS if c in dados_financeiros}
+    row.update({c: dados_financeiros.get(c) for c in FLOAT_COLUMNS if c in dados_financeiros})
+    row.update({c: analise.get(c) for c in FLOAT_COLUMNS if c in analise})
+    row["nivel_risco"] = analise.get("nivel_risco")
+    row["conjunto_regras"] = analise.get("conjunto_regras")
+    row["contabilidade_bate"] = dados_financeiros.get("contabilidade_bate")
+    row["task_id"] = task_id
+    row["periodo"] = str(dados_financeiros["periodo"])
+    row["data_processamento"] = data_processamento or datetime.now()
+    return row
+
+
+class AnalyticsStore:
+    """Armazém colunar (Parquet particionado por periodo) com escrita em lote"""
+
+    def __init__(self, root: Path = ANALYTICS_STORE_DIR,
+                 flush_rows: int = ANALYTICS_FLUSH_ROWS,
+                 flush_seconds: float = ANALYTICS_FLUSH_SECONDS):
+        if pa is None:
+            raise ImportError("pyarrow necessário para o armazém analítico (pip install pyarrow)")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.schema = _schema()
+        self._buffer: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def start(self):
+        """Arranca a escrita periódica: linhas não ficam em memória num worker sem tráfego"""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="analytics-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_seconds):
+            with self._lock:
+                due = bool(self._buffer)
+            if due:
+                self.flush()
+
+    def close(self):
+        """Pára a escrita periódica e escreve as linhas pendentes"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        self.flush()
+
+    def append(self, row: Dict[str, Any]):
+        """Acrescenta uma linha; escreve o lote quando atinge o limite de linhas ou de tempo"""
+        with self._lock:
+            self._buffer.append(row)
+            due = (len(self._buffer) >= self.flush_rows or
+                   time.monotonic() - self._last_flush >= self.flush_seconds)
+        if due:
+            self.flush()
+
+    def append_analysis(self, dados_financeiros: Dict[str, Any], analise: Dict[str, Any],
+                        task_id: Optional[str] = None):
+        self.append(build_row(dados_financeiros, analise, task_id))
+
+    def flush(self):
+        """Escreve as linhas pendentes como um novo ficheiro por partição"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+        if not rows:
+            return
+        try:
+            table = pa.Table.from_pylist(rows, schema=self.schema)
+            pq.write_to_dataset(
+                table,
+                root_path=str(self.root),
+                partition_cols=["periodo"],
+                basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            )
+            logger.info(f"Armazém analítico: {len(rows)} linhas escritas")
+        except Exception as e:
+            # Repor as linhas para nova tentativa no próximo flush
+            logger.error(f"Erro ao escrever no armazém analítico: {e}")
+            with self._lock:
+                self._buffer[:0] = rows
+
+    def dataset(self):
+        return ds.dataset(str(self.root), format="parquet", partitioning="hive", schema=self.schema)
+
+    def query(self, columns: Optional[List[str]] = None, periodos: Optional[List[str]] = None,
+              filter_expression=None, latest_only: bool = True) -> pd.DataFrame:
+        """Lê colunas do armazém com poda de partições por ano fiscal
+
+        Com latest_only=True fica apenas a análise mais recente de cada (nif, periodo).
+        """
+        if not any(self.root.rglob("*.parquet")):
+            return pd.DataFrame(columns=columns or self.schema.names)
+
+        expression = filter_expression
+        if periodos:
+            period_filter = ds.field("periodo").isin([str(p) for p in periodos])
+            expression = period_filter if expression is None else expression & period_filter
+
+        read_columns = columns
+        if latest_only and columns is not None:
+            read_columns = list(dict.fromkeys(columns + ["nif", "periodo", "data_processamento"]))
+
+        table = self.dataset().to_table(columns=read_columns, filter=expression)
+        df = table.to_pandas()
+        if latest_only and not df.empty:
+            df = (df.sort_values("data_processamento")
+                    .drop_duplicates(["nif", "periodo"], keep="last")
+                    .reset_index(drop=True))
+            if columns is not None:
+                df = df[columns]
+        return df
+
+    def compact(self):
+        """Junta os ficheiros de cada partição num só ficheiro"""
+        self.flush()
+        for partition in sorted(p for p in self.root.iterdir() if p.is_dir()):
+            files = sorted(partition.glob("*.parquet"))
+            if len(files) <= 1:
+                continue
+            table = pa.concat_tables([pq.read_table(f, schema=self.schema.remove(
+                self.schema.get_field_index("periodo"))) for f in files])
+            target = partition / f"part-{uuid.uuid4().hex}-0.parquet"
+            pq.write_table(table, target)
+            for f in files:
+                f.unlink()
+            logger.info(f"Partição {partition.name}: {len(files)} ficheiros compactados")
+
+    def backfill_from_json(self, outputs_dir: str) -> int:
+        """Importa relatórios JSON (analysis_*.json) gerados antes do armazém existir"""
+        count = 0
+        for path in sorted(Path(outputs_dir).glob("analysis_*.json")):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    report = json.load(f)
+                processed = report.get("metadata", {}).get("data_processamento")
+                self.append(build_row(
+                    report["dados_financeiros"], report["analise"],
+                    data_processamento=datetime.fromisoformat(processed) if processed else None
+                ))
+                count += 1
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning(f"Relatório ignorado ({path}): {e}")
+        self.flush()
+        return count
+
+
+_store: Optional[AnalyticsStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[AnalyticsStore]:
+    """Armazém global do processo, ou None se desativado ou sem pyarrow"""
+    global _store
+    if not ANALYTICS_STORE_ENABLED or pa is None:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = AnalyticsStore()
+            _store.start()
+            atexit.register(_store.close)
+    return _store
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] not in ("backfill", "compact"):
+        print(__doc__)
+        return
+    store = AnalyticsStore()
+    if sys.argv[1] == "backfill":
+        outputs_dir = sys.argv[2] if len(sys.argv) > 2 else "outputs"
+        print(f"✅ {store.backfill_from_json(outputs_dir)} relatórios importados para {store.root}")
+    else:
+        store.compact()
+        print(f"✅ Armazém compactado em {store.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+AiparatiExpress API - Autenticação
+Verificação de JWT (HS*/RS*/ES*, chaves por JWKS com rotação) com cache
+LRU/TTL das claims indexada pelo hash do token: pedidos frequentes (polling
+de status) autorizam-se com uma consulta a um dict em vez de verificar a
+assinatura. AUTH_MODE=mvp mantém o comportamento de MVP (qualquer token).
+"""
+
+import os
+import hmac
+import json
+import time
+import hashlib
+import asyncio
+import logging
+import threading
+import urllib.request
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# "mvp" (aceita qualquer token) ou "jwt"
+AUTH_MODE = os.getenv('AUTH_MODE', 'mvp')
+JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', '')
+# Valores de exemplo já publicados (compose, .env de exemplo): quem os conhece forja tokens
+PLACEHOLDER_JWT_SECRETS = {
+    "your-super-secret-key-change-in-production", "your-super-secret-jwt-key-change-this",
+    "change-me", "changeme",
+}
+JWT_ALGORITHMS = [a.strip() for a in os.getenv('JWT_ALGORITHMS', 'HS256').split(',') if a.strip()]
+JWT_AUDIENCE = os.getenv('JWT_AUDIENCE') or None
+JWT_ISSUER = os.getenv('JWT_ISSUER') or None
+AUTH_JWKS_URL = os.getenv('AUTH_JWKS_URL', '')
+# Recarga periódica das chaves e intervalo mínimo entre recargas forçadas por kid desconhecido
+AUTH_JWKS_REFRESH_SECONDS = float(os.getenv('AUTH_JWKS_REFRESH_SECONDS', '3600'))
+AUTH_JWKS_MIN_REFRESH_SECONDS = float(os.getenv('AUTH_JWKS_MIN_REFRESH_SECONDS', '60'))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '300'))
+# Token de serviço do Prometheus; sem ele /api/system/metrics fica fechado
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+
+class AuthError(HTTPException):
+    def __init__(self, detail: str = "Token inválido"):
+        super().__init__(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+
+def check_auth_config(mode: str = None, secret: str = None, jwks_url: str = None):
+    """Recusa arrancar em AUTH_MODE=jwt sem AUTH_JWKS_URL nem um JWT_SECRET_KEY real"""
+    mode = mode if mode is not None else AUTH_MODE
+    secret = secret if secret is not None else JWT_SECRET_KEY
+    jwks_url = jwks_url if jwks_url is not None else AUTH_JWKS_URL
+    if mode != "jwt" or jwks_url:
+        return
+    if not secret:
+        raise RuntimeError("AUTH_MODE=jwt sem AUTH_JWKS_URL nem JWT_SECRET_KEY")
+    if secret in PLACEHOLDER_JWT_SECRETS:
+        raise RuntimeError("JWT_SECRET_KEY tem um valor de exemplo; gere um com openssl rand -base64 32")
+
+
+def is_metrics_token(token: str, expected: str = None) -> bool:
+    """Token do scraper de métricas (comparação em tempo constante); nunca aceite vazio"""
+    expected = expected if expected is not None else METRICS_TOKEN
+    return bool(expected) and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def token_key(token: str) -> bytes:
+    """Chave da cache: os tokens em si não ficam em memória"""
+    return hashlib.sha256(token.encode()).digest()
+
+
+def user_from_claims(claims: Dict[str, Any]) -> Dict[str, Any]:
+    user_id = str(claims["sub"])
+    return {
+        "user_id": user_id,
+        "email": claims.get("email", f"user-{user_id}@aiparati.pt"),
+        "subscription_tier": claims.get("tier", claims.get("subscription_tier", "free")),
+    }
+
+
+class ClaimsCache:
+    """LRU com validade por entrada (nunca para além do `exp` do token)"""
+
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes, now: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: bytes, user: Dict[str, Any], expires_at: Optional[float], now: float):
+        deadline = now + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._entries[key] = (deadline, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class JWKSProvider:
+    """Chaves públicas por `kid`, recarregadas periodicamente e quando surge um kid novo"""
+
+    def __init__(self, url: str, refresh_seconds: float = AUTH_JWKS_REFRESH_SECONDS,
+                 min_refresh_seconds: float = AUTH_JWKS_MIN_REFRESH_SECONDS):
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.keys: Dict[str, Dict[str, Any]] = {}
+        self.loaded_at = 0.0
+
+    def fetch(self) -> List[Dict[str, Any]]:
+        with urllib.request.urlopen(self.url, timeout=5) as response:
+            return json.loads(response.read())["keys"]
+
+    def refresh(self):
+        keys = self.fetch()
+        self.keys = {k.get("kid", ""): k for k in keys}
+        self.loaded_at = time.monotonic()
+        logger.info(f"JWKS carregado ({len(self.keys)} chaves)")
+
+    def needs_refresh(self, kid: str) -> bool:
+        age = time.monotonic() - self.loaded_at
+        if age >= self.refresh_seconds:
+            return True
+        return kid not in self.keys and age >= self.min_refresh_seconds
+
+    def get(self, kid: str) -> Optional[Dict[str, Any]]:
+        return self.keys.get(kid)
+
+
+class TokenVerifier:
+    """Verifica JWTs e guarda as claims em cache até expirarem"""
+
+    def __init__(self, secret: str = JWT_SECRET_KEY, algorithms: List[str] = None,
+                 jwks_url: str = AUTH_JWKS_URL, audience: Optional[str] = JWT_AUDIENCE,
+                 issuer: Optional[str] = JWT_ISSUER, cache: Optional[ClaimsCache] = None):
+        from jose import jwt
+
+        # Sem JWKS a assinatura é verificada com o segredo: vazio ou de exemplo aceitaria tokens forjados
+        check_auth_config("jwt", secret, jwks_url or "")
+        self._jwt = jwt
+        self.secret = secret
+        self.algorithms = algorithms or JWT_ALGORITHMS
+        self.jwks = JWKSProvider(jwks_url) if jwks_url else None
+        self.audience = audience
+        self.issuer = issuer
+        self.cache = cache or ClaimsCache()
+
+    def lookup(self, token: str) -> Optional[Dict[str, Any]]:
+        """Caminho rápido: utilizador em cache para este token, ou None"""
+        return self.cache.get(token_key(token), time.time())
+
+    def _key_for(self, token: str):
+        if self.jwks is None:
+            return self.secret
+        kid = self._jwt.get_unverified_header(token).get("kid", "")
+        key = self.jwks.get(kid)
+        if key is None:
+            raise AuthError("Chave de assinatura desconhecida")
+        return key
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        from jose import JWTError, ExpiredSignatureError
+
+        try:
+            return self._jwt.decode(
+                token, self._key_for(token), algorithms=self.algorithms,
+                audience=self.audience, issuer=self.issuer,
+                options={"verify_aud": self.audience is not None}
+            )
+        except ExpiredSignatureError:
+            raise AuthError("Token expirado")
+        except JWTError:
+            raise AuthError()
+
+    async def authenticate(self, token: str) -> Dict[str, Any]:
+        user = self.lookup(token)
+        if user is not None:
+            return user
+
+        if self.jwks is not None:
+            try:
+                kid = self._jwt.get_unverified_header(token).get("kid", "")
+            except Exception:
+                raise AuthError()
+            if self.jwks.needs_refresh(kid):
+                try:
+                    await asyncio.to_thread(self.jwks.refresh)
+                except Exception as e:
+                    logger.error(f"Erro ao carregar JWKS: {e}")
+
+        claims = self.decode(token)
+        if "sub" not in claims:
+            raise AuthError()
+        user = user_from_claims(claims)
+        self.cache.put(token_key(token), user, claims.get("exp"), time.time())
+        return user
+
+
+_verifier: Optional[TokenVerifier] = None
+
+
+def get_verifier() -> TokenVerifier:
+    global _verifier
+    if _verifier is None:
+        _verifier = TokenVerifier()
+    return _verifier
+
+
+async def authenticate(token: str) -> Dict[str, Any]:
+    """Utilizador do pedido a partir do bearer token, segundo AUTH_MODE"""
+    if AUTH_MODE == "jwt":
+        return await get_verifier().authenticate(token)
+    # MVP: aceita qualquer token (em prod usar AUTH_MODE=jwt)
+    return {"user_id": token[:8], "email": f"user-{token[:8]}@aiparati.pt", "subscription_tier": "free"}
@@ -0,0 +1,63 @@
+"""
+AiparatiExpress API - Pacotes ZIP em streaming
+Constrói o ZIP à medida que é enviado, a partir dos ficheiros já gerados:
+sem arquivo temporário em disco e com memória constante (um bloco de cada
+vez). JSON e texto são comprimidos; XLSX, PDF e ZIP já estão comprimidos e
+vão sem compressão.
+"""
+
+import os
+import zipfile
+from typing import Iterator, List, NamedTuple
+
+CHUNK_SIZE = 64 * 1024
+
+# Extensões cujo conteúdo já está comprimido
+STORED_EXTENSIONS = {".xlsx", ".pdf", ".zip", ".png", ".jpg"}
+
+
+class ZipEntry(NamedTuple):
+    arcname: str
+    path: str
+
+
+class _ChunkSink:
+    """Destino de escrita sem seek: acumula os bytes até serem recolhidos"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self.chunks = self.chunks, []
+        if chunks:
+            yield b"".join(chunks)
+
+
+def compress_type_for(path: str) -> int:
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def stream_zip(entries: List[ZipEntry]) -> Iterator[bytes]:
+    """Gera o ZIP em blocos; o zipfile usa descritores de dados por não haver seek"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w") as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo.from_file(entry.path, entry.arcname)
+            info.compress_type = compress_type_for(entry.path)
+            with open(entry.path, "rb") as src, archive.open(info, "w") as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    dst.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    # Diretório central, escrito ao fechar o arquivo
+    yield from sink.drain()
@@ -0,0 +1,173 @@
+"""
+AiparatiExpress API - Downloads
+Respostas de download com ETag forte (hash do conteúdo), If-None-Match → 304,
+pedidos Range (206/416) e tipos MIME corretos. Com DOWNLOAD_ACCEL_PREFIX
+definido, a API só autoriza e devolve X-Accel-Redirect: o nginx envia os
+bytes por sendfile a partir do diretório de outputs.
+"""
+
+import os
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Tuple, Dict, Iterator
+
+from fastapi import Request, HTTPException
+from fastapi.responses import Response, FileResponse, StreamingResponse
+
+OUTPUT_ROOT = Path(os.getenv('OUTPUT_DIR', 'outputs'))
+# Ex.: "/_protected/outputs/" (location internal no nginx com alias para OUTPUT_ROOT)
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '')
+CHUNK_SIZE = 64 * 1024
+
+MEDIA_TYPES = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".json": "application/json",
+    ".pdf": "application/pdf",
+    ".zip": "application/zip",
+}
+
+# ETag por (caminho, mtime, tamanho): o hash só é recalculado se o ficheiro mudar
+_etag_cache: Dict[Tuple[str, int, int], str] = {}
+_etag_lock = threading.Lock()
+
+
+def media_type_for(path: str) -> str:
+    return MEDIA_TYPES.get(Path(path).suffix.lower(), "application/octet-stream")
+
+
+def content_etag(path: str, stat: Optional[os.stat_result] = None) -> str:
+    """ETag forte: SHA-256 do conteúdo (entre aspas, como exige o cabeçalho)"""
+    stat = stat or os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _etag_lock:
+        etag = _etag_cache.get(key)
+    if etag is not None:
+        return etag
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    etag = f'"{digest.hexdigest()[:32]}"'
+
+    with _etag_lock:
+        _etag_cache[key] = etag
+    return etag
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Avalia If-None-Match (lista de ETags ou '*'; prefixo W/ ignorado)"""
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Intervalo (início, fim inclusivo) de um pedido Range com um único intervalo
+
+    Retorna None para servir o ficheiro completo (sem Range, unidade
+    desconhecida ou múltiplos intervalos); levanta 416 se for insatisfazível.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+
+    start_s, sep, end_s = spec.partition("-")
+    if not sep:
+        return None
+    try:
+        if start_s == "":
+            # Sufixo: últimos N bytes
+            length = int(end_s)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+            end = min(end, size - 1)
+    except ValueError:
+        return None
+
+    if start < 0 or start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Intervalo não satisfazível",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+def _iter_file_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _accel_path(path: str) -> Optional[str]:
+    """URI interno do nginx para o ficheiro, ou None se estiver fora de OUTPUT_ROOT"""
+    if not DOWNLOAD_ACCEL_PREFIX:
+        return None
+    try:
+        relative = Path(path).resolve().relative_to(OUTPUT_ROOT.resolve())
+    except ValueError:
+        return None
+    return DOWNLOAD_ACCEL_PREFIX.rstrip("/") + "/" + relative.as_posix()
+
+
+def file_download_response(request: Request, path: str, filename: str) -> Response:
+    """Resposta de download condicional (304), parcial (206) ou completa (200)"""
+    if not os.path.exists(path):
+        raise HTTPException(
+            status_code=404,
+            detail="Ficheiro não encontrado"
+        )
+
+    stat = os.stat(path)
+    etag = content_etag(path, stat)
+    media_type = media_type_for(path)
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # Privado (ficheiros do utilizador) mas revalidável pelo ETag
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={k: headers[k] for k in ("ETag", "Cache-Control")})
+
+    accel = _accel_path(path)
+    if accel is not None:
+        # O nginx trata de Range e envia os bytes; o ETag segue para o cliente
+        headers["X-Accel-Redirect"] = accel
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    # If-Range com outro ETag: o ficheiro mudou, envia-se completo
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if not if_range or if_range == etag:
+        byte_range = parse_range(request.headers.get("range"), stat.st_size)
+
+    if byte_range is None:
+        return FileResponse(path=path, media_type=media_type, headers=headers, stat_result=stat)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _iter_file_range(path, start, end),
+        status_code=206,
+        media_type=media_type,
+        headers=headers
+    )
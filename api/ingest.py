@@ -0,0 +1,220 @@
+"""
+AiparatiExpress API - Ingestão de uploads
+Lê o PDF em blocos, aplica os limites de tamanho e de páginas a meio da
+leitura e calcula hash SHA-256, validação do cabeçalho PDF e contagem de
+páginas na mesma passagem, gravando o ficheiro em disco. O conteúdo não fica
+em memória: o pipeline lê o PDF do ficheiro gravado quando a task corre.
+PDFs com as páginas em object streams são contados pela árvore de páginas
+(pypdf, opcional) e recusados quando o número de páginas não é conhecido.
+"""
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional
+
+import aiofiles
+from fastapi import UploadFile, HTTPException
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover - sem pypdf só se contam páginas não comprimidas
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_MB', '10')) * 1024 * 1024
+MAX_FILES_PER_REQUEST = 3
+# Uma IES tem poucas dezenas de páginas; acima disto o PDF não é uma IES
+MAX_PDF_PAGES = int(os.getenv('MAX_PDF_PAGES', '100'))
+CHUNK_SIZE = 64 * 1024
+
+# Objetos de página (/Type /Page, mas não /Pages)
+_PAGE_PATTERN = re.compile(rb"/Type\s{0,8}/Page(?![A-Za-z])")
+# Bytes mantidos entre blocos; maior do que qualquer ocorrência do padrão
+_PAGE_CARRY = 32
+
+
+class UploadTooLarge(HTTPException):
+    """413; subclasse de HTTPException para atravessar o parser de formulários do FastAPI"""
+
+    def __init__(self, detail: str = "Ficheiro demasiado grande"):
+        super().__init__(status_code=413, detail=detail)
+
+
+class InvalidPDF(HTTPException):
+    def __init__(self, detail: str = "Ficheiro não é um PDF válido"):
+        super().__init__(status_code=400, detail=detail)
+
+
+@dataclass
+class IngestedUpload:
+    """PDF recebido: caminho em disco e metadados"""
+
+    filename: str
+    path: Path
+    size: int
+    sha256: str
+    pages: int
+
+
+class _PageCounter:
+    """Conta objetos de página em blocos sucessivos sem contar duas vezes"""
+
+    def __init__(self):
+        self.pending = b""
+        self.count = 0
+
+    def feed(self, chunk: bytes):
+        buf = self.pending + chunk
+        cut = max(len(buf) - _PAGE_CARRY, 0)
+        # Só conta ocorrências que começam antes do corte; as restantes
+        # ficam em `pending` e são vistas completas no bloco seguinte
+        self.count += sum(1 for m in _PAGE_PATTERN.finditer(buf) if m.start() < cut)
+        self.pending = buf[cut:]
+
+    def finish(self) -> int:
+        self.count += len(_PAGE_PATTERN.findall(self.pending))
+        self.pending = b""
+        return self.count
+
+
+def _count_pages(path: Path) -> Optional[int]:
+    """Páginas segundo a árvore de páginas (/Count); None sem pypdf ou se o PDF não abrir"""
+    if PdfReader is None:
+        return None
+    try:
+        return len(PdfReader(str(path)).pages)
+    except Exception as e:
+        logger.warning(f"Não foi possível ler a árvore de páginas de {path.name}: {e}")
+        return None
+
+
+async def ingest_upload(file: UploadFile, dest_path: Path,
+                        max_bytes: int = MAX_UPLOAD_BYTES,
+                        max_pages: int = MAX_PDF_PAGES) -> IngestedUpload:
+    """Lê o upload em blocos, valida-o e grava-o em dest_path
+
+    Levanta UploadTooLarge ou InvalidPDF; em erro o ficheiro parcial é removido.
+    """
+    digest = hashlib.sha256()
+    pages = _PageCounter()
+    size = 0
+
+    try:
+        async with aiofiles.open(dest_path, "wb") as out:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(
+                        f"Ficheiro demasiado grande (máx {max_bytes // (1024 * 1024)}MB)"
+                    )
+
+                if size == len(chunk) and b"%PDF-" not in chunk[:1024]:
+                    raise InvalidPDF()
+
+                digest.update(chunk)
+                pages.feed(chunk)
+                if pages.count > max_pages:
+                    raise InvalidPDF(f"PDF com demasiadas páginas (máx {max_pages})")
+                await out.write(chunk)
+
+        if size == 0:
+            raise InvalidPDF("Ficheiro vazio")
+        page_count = pages.finish()
+        if page_count == 0:
+            # Objetos de página dentro de object streams (PDF 1.5+) estão
+            # comprimidos e não aparecem na leitura em bruto
+            page_count = await asyncio.to_thread(_count_pages, dest_path) or 0
+            if page_count == 0:
+                raise InvalidPDF("Não foi possível determinar o número de páginas do PDF")
+        if page_count > max_pages:
+            raise InvalidPDF(f"PDF com demasiadas páginas (máx {max_pages})")
+
+    except Exception:
+        try:
+            os.remove(dest_path)
+        except OSError:
+            pass
+        raise
+
+    return IngestedUpload(
+        filename=file.filename,
+        path=dest_path,
+        size=size,
+        sha256=digest.hexdigest(),
+        pages=page_count
+    )
+
+
+class UploadSizeLimitMiddleware:
+    """Interrompe uploads que excedem o limite enquanto o corpo ainda está a chegar
+
+    O parser multipart do Starlette lê todo o corpo antes do endpoint correr;
+    este middleware conta os bytes recebidos e responde 413 assim que o total
+    ultrapassa o máximo, sem esperar pelo resto do pedido.
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/upload",
+                 max_body_bytes: int = MAX_UPLOAD_BYTES * MAX_FILES_PER_REQUEST + 1024 * 1024):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or not scope["path"].startswith(self.path_prefix)):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise UploadTooLarge("Pedido excede o tamanho máximo")
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except UploadTooLarge:
+            if response_started:
+                raise
+            logger.warning(f"Upload interrompido após {received} bytes (limite {self.max_body_bytes})")
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Ficheiro demasiado grande"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -3,19 +3,21 @@ AiparatiExpress API
 Backend FastAPI para processamento de IES e candidaturas Portugal 2030
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Form, Header, Response, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import os
 import json
 import uuid
+import random
+import hashlib
 import shutil
 from pathlib import Path
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import asyncio
 import uvicorn
 from dotenv import load_dotenv
@@ -32,9 +34,34 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 if not MOCK_MODE:
-    from autofund_ai_poc_v3 import AutoFundAI, ExtracoesFinanceiras, AnaliseFinanceira
+    from autofund_ai_poc_v3 import (
+        AutoFundAI, ExtracoesFinanceiras, AnaliseFinanceira, TEMPLATE_PATH, MODEL_BREAKER, is_unavailable
+    )
+    from excel_pool import ExcelRenderPool, EXCEL_POOL_WORKERS
 else:
     AutoFundAI = None
+    MODEL_BREAKER = None
+
+from api.ingest import ingest_upload, UploadSizeLimitMiddleware
+from api.auth import authenticate, check_auth_config, is_metrics_token
+from api.rate_limit import RateLimitMiddleware
+from api.quota import QuotaExceeded, create_ledger, create_write_behind
+from api.scheduler import FairScheduler
+from api.offline_queue import (
+    OfflineStore, OfflineDrainer, OFFLINE_QUEUE_ENABLED, OFFLINE_MAX_ATTEMPTS
+)
+from api.downloads import file_download_response, etag_matches
+from api.bundles import ZipEntry, stream_zip
+from api.task_index import TaskIndex, InvalidCursor
+from api.sweeper import TaskSweeper
+from api.responses import json_bytes, with_raw_fields, parse_fields, project, json_response
+from prometheus_client import CollectorRegistry, Gauge, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+from api.signed_downloads import sign_downloads, serve_signed, check_signing_secret, SIGNED_DOWNLOAD_PREFIX
+from risk_rules import get_registry as get_risk_rule_registry
+from sector_benchmark import get_benchmark
+from cancellation import CancelToken, TaskCancelled
+from latency_budget import LatencyBudget
+from circuit_breaker import CircuitOpen
 
 # Configuração
 logging.basicConfig(level=logging.INFO)
@@ -61,6 +88,14 @@ env_origins = os.getenv("ALLOWED_ORIGINS")
 if env_origins:
     allowed_origins.extend([origin.strip() for origin in env_origins.split(",")])
 
+# Limites por utilizador/plano e classe de endpoint; registado antes do CORS para
+# que as respostas 429 também levem os cabeçalhos CORS
+app.add_middleware(RateLimitMiddleware)
+
+# Corta uploads acima do limite enquanto o corpo ainda está a ser recebido;
+# também antes do CORS, para o browser conseguir ler o 413
+app.add_middleware(UploadSizeLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -74,9 +109,10 @@ app.add_middleware(
         "X-Client-Version",
         "Accept",
         "Accept-Language",
-        "Cache-Control"
+        "Cache-Control",
+        "Idempotency-Key"
     ],
-    expose_headers=["X-Total-Count", "X-Rate-Limit-Remaining"],
+    expose_headers=["X-Total-Count", "X-Rate-Limit-Remaining", "Retry-After"],
     max_age=86400,  # 24 hours
 )
 
@@ -107,16 +143,173 @@ class AnalysisResult(BaseModel):
     dados_financeiros: Dict[str, Any]
     analise: Dict[str, Any]
     download_urls: Dict[str, str]
+    # Links assinados e com validade (só com DOWNLOAD_SIGNING_SECRET configurado)
+    signed_download_urls: Optional[Dict[str, str]] = None
 
 # Storage em memória (para MVP - em prod usar Redis/DB)
 active_tasks = {}
 user_sessions = {}
 
+# Deduplicação de submissões: (user_id, Idempotency-Key) e (user_id, impressão digital
+# do conteúdo + metadados) → task_id
+idempotency_index: Dict[Tuple[str, str], str] = {}
+submission_index: Dict[Tuple[str, str], str] = {}
+
+# Índice secundário user_id → tasks ordenadas por criação, com contagens por estado
+task_index = TaskIndex()
+
+# Pool de processos para renderização Excel/JSON (criado no arranque)
+render_pool = None
+
+# Limpeza periódica de tasks expiradas e respetivos ficheiros
+TASK_SWEEPER_ENABLED = os.getenv('TASK_SWEEPER_ENABLED', 'true').lower() == 'true'
+sweeper_task = None
+
+ACTIVE_TASKS = Gauge("autofund_active_tasks", "Tasks em memória", multiprocess_mode="livesum")
+# Vários workers: cada processo escreve as métricas neste diretório (limpo no arranque
+# do contentor) e /api/system/metrics agrega-as; sem ele só se vê o worker que responde
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Fila de processamento: fair queueing por utilizador com pesos por plano
+job_scheduler = FairScheduler()
+# Espera mínima de uma task adiada pelo circuito do modelo
+DEFER_MIN_SECONDS = float(os.getenv('DEFER_MIN_SECONDS', '5'))
+
+# Tasks à espera da API do modelo, persistidas e reenviadas quando recupera
+offline_store = OfflineStore() if OFFLINE_QUEUE_ENABLED else None
+offline_drainer = None
+offline_drainer_task = None
+offline_lease_task = None
+
+# Quota reservada no upload e confirmada/libertada no fim; persistida em lotes
+quota_ledger = create_ledger()
+quota_writer_task = None
+
+# Long-polling de /api/status: condição por task, sinalizada a cada mudança de estado
+STATUS_MAX_WAIT_SECONDS = float(os.getenv('STATUS_MAX_WAIT_SECONDS', '30'))
+TERMINAL_STATUSES = {"completed", "error", "cancelled"}
+status_conditions: Dict[str, asyncio.Condition] = {}
+main_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def add_task(task: dict):
+    task.setdefault("version", 1)
+    active_tasks[task["task_id"]] = task
+    task_index.add(task)
+
+def remove_task(task: dict):
+    task_index.remove(task)
+    active_tasks.pop(task["task_id"], None)
+
+def evict_task(task: dict):
+    """Remove a task de memória e dos índices (os ficheiros ficam a cargo de quem chama)"""
+    unregister_submission(task)
+    remove_task(task)
+    signal_status_change(task)
+
+def set_task_status(task: dict, status: str):
+    """Altera o estado da task mantendo o índice por utilizador coerente"""
+    task["status"] = status
+    task_index.set_status(task, status)
+    # Corpo de /api/status em cache deixa de corresponder ao estado
+    task.pop("status_body", None)
+    task["version"] = task.get("version", 1) + 1
+    if status in TERMINAL_STATUSES and task.pop("offline_persisted", False):
+        offline_store.submit(offline_store.remove, task["task_id"])
+    signal_status_change(task)
+
+async def _notify_status(task_id: str):
+    condition = status_conditions.get(task_id)
+    if condition is None:
+        return
+    async with condition:
+        condition.notify_all()
+    task = active_tasks.get(task_id)
+    if task is None or task["status"] in TERMINAL_STATUSES:
+        status_conditions.pop(task_id, None)
+
+def signal_status_change(task: dict):
+    """Acorda os pedidos em long-poll; pode ser chamado fora do event loop"""
+    if task["task_id"] not in status_conditions:
+        return
+    try:
+        asyncio.get_running_loop().create_task(_notify_status(task["task_id"]))
+    except RuntimeError:
+        if main_loop is not None:
+            asyncio.run_coroutine_threadsafe(_notify_status(task["task_id"]), main_loop)
+
+async def wait_for_status_change(task: dict, version: int, timeout: float):
+    """Espera até a versão da task mudar (ou a task desaparecer) ou o timeout expirar"""
+    task_id = task["task_id"]
+    condition = status_conditions.setdefault(task_id, asyncio.Condition())
+    try:
+        async with condition:
+            await asyncio.wait_for(
+                condition.wait_for(
+                    lambda: task.get("version") != version or task_id not in active_tasks
+                ),
+                timeout
+            )
+    except asyncio.TimeoutError:
+        pass
+
 # Dependência simples de autenticação
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    # MVP: aceita qualquer token (em prod validar JWT)
-    return {"user_id": token[:8], "email": f"user-{token[:8]}@aiparati.pt"}
+    return await authenticate(credentials.credentials)
+
+@app.on_event("startup")
+async def warm_up():
+    """Compila regras de risco, carrega o benchmark setorial e arranca o pool de renderização"""
+    global render_pool, sweeper_task, main_loop, quota_writer_task
+    main_loop = asyncio.get_running_loop()
+    # Sem segredo os links assinados ficam desativados; com o de exemplo não arranca
+    check_signing_secret(required=False)
+    # AUTH_MODE=jwt só com segredo real ou JWKS
+    check_auth_config()
+    get_risk_rule_registry()
+    get_benchmark()
+
+    job_scheduler.start()
+    if offline_store is not None:
+        await start_offline_drainer()
+
+    quota_writer = create_write_behind(quota_ledger)
+    if quota_writer is not None:
+        try:
+            await quota_writer.reconcile()
+        except Exception as e:
+            logger.error(f"Erro ao reconciliar quotas: {e}")
+        quota_writer_task = asyncio.create_task(quota_writer.run())
+
+    if TASK_SWEEPER_ENABLED:
+        sweeper = TaskSweeper(active_tasks, evict_task, orphan_dirs=[UPLOAD_DIR, OUTPUT_DIR],
+                              held_tasks=offline_store.load if offline_store is not None else None)
+        sweeper_task = asyncio.create_task(sweeper.run())
+
+    if not MOCK_MODE and EXCEL_POOL_WORKERS > 0:
+        render_pool = ExcelRenderPool(TEMPLATE_PATH, EXCEL_POOL_WORKERS)
+        await asyncio.to_thread(render_pool.warm_up)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_scheduler.stop()
+    if offline_drainer_task is not None:
+        offline_drainer_task.cancel()
+    if offline_lease_task is not None:
+        offline_lease_task.cancel()
+    if offline_store is not None:
+        # Linhas devolvidas (depois das escritas pendentes): outro worker retoma-as sem esperar
+        await asyncio.wrap_future(offline_store.submit(offline_store.release))
+    if sweeper_task is not None:
+        sweeper_task.cancel()
+    if quota_writer_task is not None:
+        # O cancelamento provoca a última escrita do consumo pendente
+        quota_writer_task.cancel()
+        await asyncio.gather(quota_writer_task, return_exceptions=True)
+    if render_pool is not None:
+        render_pool.shutdown(wait=False)
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Os gauges "live*" deixam de contar este worker
+        multiprocess.mark_process_dead(os.getpid())
 
 @app.get("/")
 async def root():
@@ -128,14 +321,69 @@ async def root():
         "timestamp": datetime.now().isoformat()
     }
 
+def submission_fingerprint(pdf_hashes: List[str], **metadata) -> str:
+    """Impressão digital de uma submissão: hashes dos PDFs + metadados do formulário"""
+    payload = json.dumps({"pdfs": pdf_hashes, **metadata}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def find_duplicate_task(user_id: str, idempotency_key: Optional[str] = None,
+                        fingerprint: Optional[str] = None) -> Optional[dict]:
+    """Task existente (em curso ou concluída) para a mesma chave ou o mesmo conteúdo
+
+    Tasks com erro ou canceladas não são reutilizadas: uma nova submissão volta a processar.
+    A mesma Idempotency-Key com conteúdo diferente é rejeitada (422).
+    """
+    candidates = []
+    if idempotency_key:
+        candidates.append(idempotency_index.get((user_id, idempotency_key)))
+    if fingerprint:
+        candidates.append(submission_index.get((user_id, fingerprint)))
+
+    for task_id in candidates:
+        task = active_tasks.get(task_id) if task_id else None
+        if task is None or task["status"] in ("error", "cancelled"):
+            continue
+        if idempotency_key and fingerprint and task.get("idempotency_key") == idempotency_key \
+                and task.get("submission_fingerprint") != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key já usada com outro conteúdo"
+            )
+        return task
+    return None
+
+def register_submission(task: dict):
+    user_id = task["user_id"]
+    if task.get("idempotency_key"):
+        idempotency_index[(user_id, task["idempotency_key"])] = task["task_id"]
+    submission_index[(user_id, task["submission_fingerprint"])] = task["task_id"]
+
+def unregister_submission(task: dict):
+    user_id = task["user_id"]
+    for index, key in ((idempotency_index, task.get("idempotency_key")),
+                       (submission_index, task.get("submission_fingerprint"))):
+        if key and index.get((user_id, key)) == task["task_id"]:
+            del index[(user_id, key)]
+
+def duplicate_response(task: dict, response: Response) -> ProcessResponse:
+    response.headers["Idempotent-Replayed"] = "true"
+    return ProcessResponse(
+        task_id=task["task_id"],
+        status=task["status"],
+        message="Submissão repetida: a devolver a tarefa existente"
+    )
+
 @app.post("/api/upload", response_model=ProcessResponse)
 async def upload_ies(
+    response: Response,
     file: UploadFile = File(...),
     nif: str = Form(...),
     ano_exercicio: str = Form(...),
     designacao_social: str = Form(...),
     email: str = Form(...),
     context: Optional[str] = Form(None),
+    programa: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -143,8 +391,11 @@ async def upload_ies(
 
     - **file**: Ficheiro PDF da IES
     - **context**: Contexto adicional opcional
+    - **programa**: Conjunto de regras de risco do aviso (opcional)
+    - **Idempotency-Key** (header): repetir o pedido com a mesma chave devolve a mesma tarefa
 
-    Retorna task_id para acompanhamento
+    Retorna task_id para acompanhamento. Um PDF idêntico com os mesmos dados
+    devolve a tarefa existente em vez de criar outra.
     """
 
     # Validação
@@ -154,44 +405,74 @@ async def upload_ies(
             detail="Apenas ficheiros PDF são aceites"
         )
 
-    if file.size > 10 * 1024 * 1024:  # 10MB
+    if programa and programa not in get_risk_rule_registry().names():
         raise HTTPException(
             status_code=400,
-            detail="Ficheiro demasiado grande (máx 10MB)"
+            detail=f"Programa desconhecido: {programa}"
         )
 
     # Gerar IDs
     task_id = str(uuid.uuid4())
     user_id = current_user["user_id"]
 
-    # Guardar ficheiro
+    # Guardar ficheiro (leitura em blocos com limite, hash e validação PDF)
     file_path = UPLOAD_DIR / f"{task_id}_{file.filename}"
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        upload = await ingest_upload(file, file_path)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao guardar ficheiro: {e}")
         raise HTTPException(status_code=500, detail="Erro ao guardar ficheiro")
 
+    fingerprint = submission_fingerprint(
+        [upload.sha256], nif=nif, ano_exercicio=ano_exercicio, designacao_social=designacao_social,
+        email=email, context=context or "", programa=programa
+    )
+    existing = find_duplicate_task(user_id, idempotency_key, fingerprint)
+    if existing:
+        os.remove(file_path)
+        return duplicate_response(existing, response)
+
+    try:
+        await quota_ledger.reserve(user_id, current_user.get("subscription_tier", "free"))
+    except QuotaExceeded:
+        os.remove(file_path)
+        raise
+    # Um pedido idêntico (duplo clique) pode ter-se registado durante a reserva
+    existing = find_duplicate_task(user_id, idempotency_key, fingerprint)
+    if existing:
+        await quota_ledger.release(user_id)
+        os.remove(file_path)
+        return duplicate_response(existing, response)
+
     # Criar task
     task = {
         "task_id": task_id,
         "user_id": user_id,
         "status": "uploaded",
         "file_path": str(file_path),
+        "pdf_hashes": [upload.sha256],
+        "pdf_pages": [upload.pages],
         "nif": nif,
         "ano_exercicio": ano_exercicio,
         "designacao_social": designacao_social,
         "email": email,
         "context": context or "",
+        "programa": programa,
+        "idempotency_key": idempotency_key,
+        "submission_fingerprint": fingerprint,
+        "subscription_tier": current_user.get("subscription_tier", "free"),
+        "quota_reserved": 1,
         "created_at": datetime.now(),
         "result": None
     }
 
-    active_tasks[task_id] = task
+    add_task(task)
+    register_submission(task)
 
-    # Iniciar processamento assíncrono
-    asyncio.create_task(process_ies_async(task_id))
+    # Colocar na fila de processamento
+    schedule_task(task)
 
     return ProcessResponse(
         task_id=task_id,
@@ -199,20 +480,288 @@ async def upload_ies(
         message=f"Ficheiro {file.filename} recebido. A processar..."
     )
 
+@app.post("/api/upload/multi", response_model=ProcessResponse)
+async def upload_ies_multi(
+    response: Response,
+    files: List[UploadFile] = File(...),
+    nif: str = Form(...),
+    designacao_social: str = Form(...),
+    email: str = Form(...),
+    context: Optional[str] = Form(None),
+    programa: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Upload de vários IES (2 a 3 exercícios) da mesma empresa para análise plurianual
+
+    - **files**: Ficheiros PDF da IES, um por exercício
+    - **context**: Contexto adicional opcional
+    - **programa**: Conjunto de regras de risco do aviso (opcional)
+
+    Retorna task_id para acompanhamento
+    """
+
+    if not 2 <= len(files) <= 3:
+        raise HTTPException(
+            status_code=400,
+            detail="Análise plurianual requer entre 2 e 3 ficheiros IES"
+        )
+
+    for file in files:
+        if not file.filename.endswith('.pdf'):
+            raise HTTPException(
+                status_code=400,
+                detail="Apenas ficheiros PDF são aceites"
+            )
+
+    if programa and programa not in get_risk_rule_registry().names():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Programa desconhecido: {programa}"
+        )
+
+    task_id = str(uuid.uuid4())
+    user_id = current_user["user_id"]
+
+    uploads = []
+    try:
+        for i, file in enumerate(files):
+            uploads.append(await ingest_upload(file, UPLOAD_DIR / f"{task_id}_{i}_{file.filename}"))
+    except Exception as e:
+        for upload in uploads:
+            if os.path.exists(upload.path):
+                os.remove(upload.path)
+        if isinstance(e, HTTPException):
+            raise
+        logger.error(f"Erro ao guardar ficheiros: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao guardar ficheiros")
+
+    fingerprint = submission_fingerprint(
+        [upload.sha256 for upload in uploads], nif=nif, designacao_social=designacao_social,
+        email=email, context=context or "", programa=programa
+    )
+    existing = find_duplicate_task(user_id, idempotency_key, fingerprint)
+    if existing:
+        for upload in uploads:
+            os.remove(upload.path)
+        return duplicate_response(existing, response)
+
+    # Uma análise plurianual consome uma unidade de quota
+    try:
+        await quota_ledger.reserve(user_id, current_user.get("subscription_tier", "free"))
+    except QuotaExceeded:
+        for upload in uploads:
+            os.remove(upload.path)
+        raise
+    # Um pedido idêntico (duplo clique) pode ter-se registado durante a reserva
+    existing = find_duplicate_task(user_id, idempotency_key, fingerprint)
+    if existing:
+        await quota_ledger.release(user_id)
+        for upload in uploads:
+            os.remove(upload.path)
+        return duplicate_response(existing, response)
+
+    file_paths = [str(upload.path) for upload in uploads]
+    task = {
+        "task_id": task_id,
+        "user_id": user_id,
+        "status": "uploaded",
+        "file_path": file_paths[0],
+        "file_paths": file_paths,
+        "pdf_hashes": [upload.sha256 for upload in uploads],
+        "pdf_pages": [upload.pages for upload in uploads],
+        "nif": nif,
+        "ano_exercicio": "plurianual",
+        "designacao_social": designacao_social,
+        "email": email,
+        "context": context or "",
+        "programa": programa,
+        "idempotency_key": idempotency_key,
+        "submission_fingerprint": fingerprint,
+        "subscription_tier": current_user.get("subscription_tier", "free"),
+        "quota_reserved": 1,
+        "created_at": datetime.now(),
+        "result": None
+    }
+
+    add_task(task)
+    register_submission(task)
+
+    schedule_task(task)
+
+    return ProcessResponse(
+        task_id=task_id,
+        status="processing",
+        message=f"{len(files)} ficheiros IES recebidos. A processar análise plurianual..."
+    )
+
+def complete_task(task: dict, result: Dict[str, Any]):
+    """Guarda o resultado, já serializado: /api/status e /api/result servem estes bytes"""
+    task["result_json"] = json_bytes(result)
+    task["result_public_json"] = json_bytes(
+        AnalysisResult(**result).model_dump(exclude={"signed_download_urls"})
+    )
+    task["result"] = result
+    task["completed_at"] = datetime.now()
+    set_task_status(task, "completed")
+
+async def cancel_task(task: dict) -> bool:
+    """Cancela uma task por concluir; False se já terminou
+
+    Na fila é retirada antes de começar; em processamento a corrotina é
+    cancelada (o worker fica livre de imediato) e o token aborta o pedido em
+    curso ao modelo e as etapas seguintes do pipeline. A reserva de quota é
+    libertada.
+    """
+    if task["status"] in TERMINAL_STATUSES:
+        return False
+    task_id = task["task_id"]
+    task.setdefault("cancel_token", CancelToken()).cancel()
+    if not job_scheduler.cancel(task_id):
+        running = job_scheduler.running.get(task_id)
+        if running is not None:
+            running.cancel()
+    task["completed_at"] = datetime.now()
+    set_task_status(task, "cancelled")
+    await settle_quota(task, consumed=False)
+    logger.info(f"Task {task_id} cancelada pelo utilizador")
+    return True
+
+def defer_task(task: dict, delay: float) -> bool:
+    """Volta a pôr a task na fila daqui a `delay` segundos (com dispersão)
+
+    False se a task já esgotou as tentativas (passa a erro em vez de repetir).
+    """
+    if task.get("attempts", 0) >= OFFLINE_MAX_ATTEMPTS:
+        return False
+    set_task_status(task, "deferred")
+    delay = max(delay, DEFER_MIN_SECONDS) * random.uniform(1.0, 1.5)
+    task["retry_at"] = datetime.now() + timedelta(seconds=delay)
+
+    def resume():
+        # Cancelada ou eliminada entretanto: nada a fazer
+        if active_tasks.get(task["task_id"]) is task and task["status"] == "deferred":
+            task.pop("retry_at", None)
+            set_task_status(task, "uploaded")
+            schedule_task(task)
+
+    asyncio.get_running_loop().call_later(delay, resume)
+    return True
+
+def model_available() -> bool:
+    """API do modelo utilizável: chave configurada e circuito não aberto"""
+    if MOCK_MODE:
+        return True
+    return bool(os.getenv('ANTHROPIC_API_KEY')) and MODEL_BREAKER.state != "open"
+
+def queue_offline(task: dict, reason: str) -> bool:
+    """Persiste a task e deixa-a à espera da API; False se a fila offline não a aceita"""
+    if offline_store is None or task.get("attempts", 0) >= OFFLINE_MAX_ATTEMPTS:
+        return False
+    set_task_status(task, "queued_offline")
+    # Cópia: a escrita corre na thread do store enquanto a task continua a mudar
+    offline_store.submit(offline_store.put, dict(task), reason)
+    task["offline_persisted"] = True
+    offline_drainer.add(task)
+    logger.warning(f"Task {task['task_id']} na fila offline ({reason})")
+    return True
+
+def resume_offline_task(task: dict) -> bool:
+    # Cancelada ou eliminada entretanto: nada a fazer
+    if active_tasks.get(task["task_id"]) is not task or task["status"] != "queued_offline":
+        return False
+    set_task_status(task, "uploaded")
+    submit_task(task)
+    return True
+
+async def claim_offline_tasks():
+    """Reclama as tasks persistidas sem dono (ou de workers mortos) e renova a posse das nossas"""
+    restored = 0
+    for task in await asyncio.wrap_future(offline_store.submit(offline_store.claim)):
+        if task["task_id"] in active_tasks:
+            continue
+        paths = task.get("file_paths") or [task["file_path"]]
+        if not all(os.path.exists(p) for p in paths):
+            offline_store.submit(offline_store.remove, task["task_id"])
+            continue
+        task["status"] = "queued_offline"
+        task["offline_persisted"] = True
+        add_task(task)
+        register_submission(task)
+        offline_drainer.add(task)
+        restored += 1
+    if restored:
+        logger.info(f"{restored} tasks recarregadas da fila offline")
+
+async def renew_offline_lease():
+    while True:
+        await asyncio.sleep(offline_store.lease / 3)
+        try:
+            await claim_offline_tasks()
+        except Exception as e:
+            logger.error(f"Erro ao renovar a fila offline: {e}")
+
+async def start_offline_drainer():
+    """Recarrega as tasks persistidas e arranca o reenvio a ritmo controlado"""
+    global offline_drainer, offline_drainer_task, offline_lease_task
+    offline_drainer = OfflineDrainer(model_available, resume_offline_task)
+    await claim_offline_tasks()
+    offline_drainer_task = asyncio.create_task(offline_drainer.run())
+    offline_lease_task = asyncio.create_task(renew_offline_lease())
+
+def submit_task(task: dict):
+    job_scheduler.submit(
+        task["task_id"], task["user_id"], task.get("subscription_tier", "free"),
+        lambda: process_ies_async(task["task_id"])
+    )
+
+def schedule_task(task: dict):
+    # Sem API disponível o upload é aceite e fica na fila offline
+    if not model_available() and queue_offline(task, "api_indisponivel"):
+        return
+    submit_task(task)
+
+async def settle_quota(task: dict, consumed: bool):
+    """Confirma (análise concluída) ou liberta (erro) a quota reservada no upload"""
+    amount = task.pop("quota_reserved", 0)
+    if not amount:
+        return
+    try:
+        if consumed:
+            await quota_ledger.commit(task["user_id"], amount)
+        else:
+            await quota_ledger.release(task["user_id"], amount)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar quota da task {task['task_id']}: {e}")
+
+def record_attempt(task: dict):
+    """Conta uma tentativa de processamento, também na linha da fila offline
+
+    Gravada antes de a tentativa correr: se o worker morrer a meio, quem
+    reclamar a linha vê-a contada e OFFLINE_MAX_ATTEMPTS continua a valer.
+    """
+    task["attempts"] = task.get("attempts", 0) + 1
+    if task.get("offline_persisted") and offline_store is not None:
+        offline_store.submit(offline_store.update, dict(task))
+
 async def process_ies_async(task_id: str):
     """Processa IES em background"""
     task = active_tasks.get(task_id)
     if not task:
         return
 
+    cancel_token = task.setdefault("cancel_token", CancelToken())
+    record_attempt(task)
+
     try:
         # Atualizar status
-        task["status"] = "extracting"
+        set_task_status(task, "extracting")
 
         if MOCK_MODE:
             # Mock processing for testing
             await asyncio.sleep(2)  # Simulate processing time
-            task["status"] = "analyzing"
+            set_task_status(task, "analyzing")
             await asyncio.sleep(2)  # Simulate analysis time
 
             # Mock result
@@ -265,13 +814,35 @@ async def process_ies_async(task_id: str):
             # Inicializar AutoFundAI
             api_key = os.getenv('ANTHROPIC_API_KEY')
             if not api_key:
+                if queue_offline(task, "sem_api_key"):
+                    return
                 raise Exception("API key não configurada")
 
-            autofund = AutoFundAI(api_key)
-
-            # Processar
-            task["status"] = "analyzing"
-            result = autofund.process_ies(task["file_path"], task.get("context", ""))
+            # Prazo por plano repartido pelas etapas; a análise degrada para a
+            # versão determinística em vez de deixar a task presa
+            autofund = AutoFundAI(api_key, rule_set=task.get("programa"), render_pool=render_pool,
+                                  cancel_token=task["cancel_token"],
+                                  latency_budget=LatencyBudget.for_tier(task.get("subscription_tier", "free")),
+                                  task_id=task_id)
+
+            # Processar fora do event loop (chamadas ao modelo são bloqueantes;
+            # a renderização Excel corre no pool de processos). O PDF é lido do
+            # ficheiro gravado no upload; o hash da ingestão evita recalculá-lo.
+            set_task_status(task, "analyzing")
+            hashes = task.get("pdf_hashes")
+            if task.get("file_paths"):
+                result = await asyncio.to_thread(
+                    autofund.process_ies_multi, task["file_paths"], task.get("context", ""),
+                    pdf_hashes=hashes
+                )
+            else:
+                result = await asyncio.to_thread(
+                    autofund.process_ies, task["file_path"], task.get("context", ""),
+                    pdf_hash=hashes[0] if hashes else None
+                )
+
+        # Cancelada (ou eliminada) enquanto o pipeline terminava: o resultado é descartado
+        cancel_token.check("resultado")
 
         # Preparar URLs de download
         excel_path = result["ficheiros_gerados"]["excel"]
@@ -283,24 +854,80 @@ async def process_ies_async(task_id: str):
         }
 
         # Atualizar task
-        task["status"] = "completed"
-        task["result"] = result
-        task["completed_at"] = datetime.now()
+        complete_task(task, result)
+        await settle_quota(task, consumed=True)
 
         logger.info(f"Task {task_id} completada com sucesso")
 
+    except TaskCancelled:
+        # Estado e quota já tratados por cancel_task
+        logger.info(f"Task {task_id} cancelada")
+
+    except CircuitOpen as e:
+        # API do modelo degradada: a extração volta à fila em vez de falhar
+        logger.warning(f"Task {task_id} adiada: {e}")
+        if offline_store is None:
+            requeued = defer_task(task, e.retry_after)
+        else:
+            requeued = queue_offline(task, "circuito_aberto")
+        if not requeued:
+            await fail_task(task, e)
+
     except Exception as e:
-        logger.error(f"Erro na task {task_id}: {e}")
-        task["status"] = "error"
-        task["error"] = str(e)
-        task["completed_at"] = datetime.now()
+        if cancel_token.cancelled:
+            logger.info(f"Task {task_id} cancelada ({e})")
+            return
+        if not MOCK_MODE and is_unavailable(e) and queue_offline(task, "falha_api"):
+            return
+        await fail_task(task, e)
+
+async def fail_task(task: dict, error: Exception):
+    logger.error(f"Erro na task {task['task_id']}: {error}")
+    task["error"] = str(error)
+    task["completed_at"] = datetime.now()
+    set_task_status(task, "error")
+    await settle_quota(task, consumed=False)
+
+def status_head(task: dict) -> Dict[str, Any]:
+    head = {
+        "task_id": task["task_id"],
+        "status": task["status"],
+        "created_at": task["created_at"].isoformat()
+    }
+    if task["status"] in ("completed", "cancelled"):
+        head["completed_at"] = task["completed_at"].isoformat()
+    elif task["status"] == "error":
+        head["error"] = task.get("error", "Erro desconhecido")
+        head["completed_at"] = task.get("completed_at", datetime.now()).isoformat()
+    elif task["status"] == "deferred" and task.get("retry_at"):
+        head["retry_at"] = task["retry_at"].isoformat()
+    return head
+
+def status_body(task: dict) -> bytes:
+    """Corpo de /api/status, serializado uma vez por estado e reutilizado"""
+    body = task.get("status_body")
+    if body is None:
+        body = json_bytes(status_head(task))
+        if task["status"] == "completed":
+            body = with_raw_fields(body, result=task["result_json"])
+        task["status_body"] = body
+    return body
 
 @app.get("/api/status/{task_id}")
 async def get_status(
     task_id: str,
+    request: Request,
+    fields: Optional[str] = None,
+    wait: float = Query(0, ge=0, le=STATUS_MAX_WAIT_SECONDS),
     current_user: dict = Depends(get_current_user)
 ):
-    """Verifica status de processamento"""
+    """Verifica status de processamento
+
+    `fields` (p.ex. `analise.nivel_risco,dados_financeiros`) limita o resultado
+    incluído aos campos indicados. Com `If-None-Match` igual ao ETag atual
+    responde 304; com `wait=N` espera até N segundos por uma mudança de estado
+    antes de responder.
+    """
 
     task = active_tasks.get(task_id)
     if not task:
@@ -315,27 +942,38 @@ async def get_status(
             detail="Acesso não autorizado"
         )
 
-    response = {
-        "task_id": task_id,
-        "status": task["status"],
-        "created_at": task["created_at"].isoformat()
-    }
+    paths = parse_fields(fields)
 
-    if task["status"] == "completed":
-        response["result"] = task["result"]
-        response["completed_at"] = task["completed_at"].isoformat()
-    elif task["status"] == "error":
-        response["error"] = task.get("error", "Erro desconhecido")
-        response["completed_at"] = task.get("completed_at", datetime.now()).isoformat()
+    def current_etag() -> str:
+        suffix = f"-{hashlib.sha1(fields.encode()).hexdigest()[:8]}" if paths else ""
+        return f'"{task_id}-{task.get("version", 1)}{suffix}"'
+
+    if_none_match = request.headers.get("if-none-match")
+    if etag_matches(if_none_match, current_etag()):
+        if wait > 0 and task["status"] not in TERMINAL_STATUSES:
+            await wait_for_status_change(task, task.get("version", 1), wait)
+            if task_id not in active_tasks:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Task não encontrada"
+                )
+        if etag_matches(if_none_match, current_etag()):
+            return Response(status_code=304, headers={"ETag": current_etag(), "Cache-Control": "no-cache"})
+
+    headers = {"ETag": current_etag(), "Cache-Control": "no-cache"}
+    if paths is None or task["status"] != "completed":
+        return json_response(status_body(task), headers=headers)
 
-    return response
+    body = json_bytes({**status_head(task), "result": project(task["result"], paths)})
+    return json_response(body, headers=headers)
 
-@app.get("/api/result/{task_id}", response_model=AnalysisResult)
+@app.get("/api/result/{task_id}", responses={200: {"model": AnalysisResult}})
 async def get_result(
     task_id: str,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Obtém resultado completo da análise"""
+    """Obtém resultado completo da análise (ou só os campos em `fields`)"""
 
     task = active_tasks.get(task_id)
     if not task or task["status"] != "completed":
@@ -350,15 +988,121 @@ async def get_result(
             detail="Acesso não autorizado"
         )
 
-    return AnalysisResult(**task["result"])
+    paths = parse_fields(fields)
+    wants_signed = paths is None or ["signed_download_urls"] in paths
+    if paths is None:
+        body = task["result_public_json"]
+    else:
+        public_paths = [p for p in paths if p[0] in AnalysisResult.model_fields
+                        and p[0] != "signed_download_urls"]
+        body = json_bytes(project(task["result"], public_paths))
+
+    if wants_signed:
+        # Links assinados têm validade: gerados a cada pedido e acrescentados aos bytes em cache
+        nif = task["result"]["metadata"]["nif"]
+        signed_urls = sign_downloads(
+            task["result"]["ficheiros_gerados"],
+            {"excel": f"aiparati_{nif}.xlsx", "json": f"aiparati_{nif}.json"}
+        )
+        body = with_raw_fields(body, signed_download_urls=json_bytes(signed_urls or None))
+
+    return json_response(body)
+
+MAX_BUNDLE_TASKS = int(os.getenv('MAX_BUNDLE_TASKS', '50'))
+
+def bundle_entries(task: Dict[str, Any], include_pdf: bool, prefix: str = "") -> List[ZipEntry]:
+    """Ficheiros de uma task para o pacote ZIP (Excel, JSON e opcionalmente os PDFs)"""
+    nif = task["result"]["metadata"]["nif"]
+    files = task["result"]["ficheiros_gerados"]
+    entries = [
+        ZipEntry(f"{prefix}aiparati_{nif}.xlsx", files["excel"]),
+        ZipEntry(f"{prefix}aiparati_{nif}.json", files["json"]),
+    ]
+    if include_pdf:
+        for upload_path in task.get("file_paths") or [task["file_path"]]:
+            # Remove o prefixo "<task_id>_" do nome guardado em disco
+            name = os.path.basename(upload_path).split("_", 1)[-1]
+            entries.append(ZipEntry(f"{prefix}{name}", upload_path))
+
+    missing = [entry.path for entry in entries if not os.path.exists(entry.path)]
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail="Ficheiro não encontrado"
+        )
+    return entries
+
+def zip_response(entries: List[ZipEntry], filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/api/download/bundle")
+async def download_bundle_multi(
+    task_ids: str,
+    include_pdf: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Pacote ZIP com os ficheiros de várias tasks (uma pasta por task)"""
+
+    ids = list(dict.fromkeys(t for t in task_ids.split(",") if t))
+    if not ids or len(ids) > MAX_BUNDLE_TASKS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Indique entre 1 e {MAX_BUNDLE_TASKS} tasks"
+        )
+
+    entries = []
+    for task_id in ids:
+        task = active_tasks.get(task_id)
+        if not task or task["status"] != "completed":
+            raise HTTPException(
+                status_code=404,
+                detail=f"Ficheiros não disponíveis para a task {task_id}"
+            )
+        if task["user_id"] != current_user["user_id"]:
+            raise HTTPException(
+                status_code=403,
+                detail="Acesso não autorizado"
+            )
+        entries += bundle_entries(task, include_pdf, prefix=f"{task_id}/")
+
+    return zip_response(entries, f"aiparati_{len(ids)}_analises.zip")
+
+@app.get("/api/download/{task_id}/bundle")
+async def download_bundle(
+    task_id: str,
+    include_pdf: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Pacote ZIP com Excel + JSON (+ PDF de origem) numa só transferência"""
+
+    task = active_tasks.get(task_id)
+    if not task or task["status"] != "completed":
+        raise HTTPException(
+            status_code=404,
+            detail="Ficheiro não disponível"
+        )
+
+    if task["user_id"] != current_user["user_id"]:
+        raise HTTPException(
+            status_code=403,
+            detail="Acesso não autorizado"
+        )
+
+    entries = bundle_entries(task, include_pdf)
+    return zip_response(entries, f"aiparati_{task['result']['metadata']['nif']}.zip")
 
 @app.get("/api/download/{task_id}/{file_type}")
 async def download_file(
     task_id: str,
     file_type: str,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
-    """Download de ficheiros gerados"""
+    """Download de ficheiros gerados (suporta ETag/If-None-Match e Range)"""
 
     task = active_tasks.get(task_id)
     if not task or task["status"] != "completed":
@@ -385,33 +1129,83 @@ async def download_file(
             detail="Tipo de ficheiro inválido"
         )
 
-    if not os.path.exists(file_path):
-        raise HTTPException(
-            status_code=404,
-            detail="Ficheiro não encontrado"
-        )
+    return file_download_response(request, file_path, filename)
 
-    return FileResponse(
-        path=file_path,
-        filename=filename,
-        media_type="application/octet-stream"
-    )
+# Downloads por link assinado (verificação só com o segredo, sem auth nem tasks);
+# em produção o nginx encaminha este prefixo para `api.signed_downloads:app`
+app.add_route(SIGNED_DOWNLOAD_PREFIX + "/{path:path}", serve_signed, methods=["GET", "HEAD"])
+
+@app.get("/api/quota")
+async def get_quota(current_user: dict = Depends(get_current_user)):
+    """Consumo de quota do utilizador no mês corrente (análises concluídas, em curso e limite)"""
+    usage = await quota_ledger.usage(current_user["user_id"], current_user.get("subscription_tier", "free"))
+    return {"used": usage.used, "reserved": usage.reserved, "limit": usage.limit, "available": usage.available,
+            "period": quota_ledger.period_fn().isoformat()}
 
 @app.get("/api/tasks")
-async def list_tasks(current_user: dict = Depends(get_current_user)):
-    """Lista tarefas do utilizador"""
+async def list_tasks(
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Lista tarefas do utilizador (mais recentes primeiro, paginação por cursor)
+
+    `status` aceita vários estados separados por vírgulas.
+    """
+
+    user_id = current_user["user_id"]
+    statuses = [s for s in status.split(",") if s] if status else None
+
+    try:
+        task_ids, next_cursor = task_index.page(user_id, limit, cursor, statuses)
+    except InvalidCursor:
+        raise HTTPException(
+            status_code=400,
+            detail="Cursor inválido"
+        )
 
     user_tasks = []
-    for task_id, task in active_tasks.items():
-        if task["user_id"] == current_user["user_id"]:
-            user_tasks.append({
-                "task_id": task_id,
-                "status": task["status"],
-                "created_at": task["created_at"].isoformat(),
-                "completed_at": task.get("completed_at", datetime.now()).isoformat()
-            })
+    for task_id in task_ids:
+        task = active_tasks[task_id]
+        user_tasks.append({
+            "task_id": task_id,
+            "status": task["status"],
+            "created_at": task["created_at"].isoformat(),
+            "completed_at": task.get("completed_at", datetime.now()).isoformat()
+        })
+
+    response.headers["X-Total-Count"] = str(task_index.count(user_id, statuses))
+    return {"tasks": user_tasks, "next_cursor": next_cursor}
+
+@app.post("/api/tasks/{task_id}/cancel")
+async def cancel_task_endpoint(
+    task_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Cancela o processamento de uma tarefa (na fila ou em curso)"""
+
+    task = active_tasks.get(task_id)
+    if not task:
+        raise HTTPException(
+            status_code=404,
+            detail="Task não encontrada"
+        )
 
-    return {"tasks": user_tasks}
+    if task["user_id"] != current_user["user_id"]:
+        raise HTTPException(
+            status_code=403,
+            detail="Acesso não autorizado"
+        )
+
+    if not await cancel_task(task):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Task já terminada (estado: {task['status']})"
+        )
+
+    return {"task_id": task_id, "status": task["status"]}
 
 @app.delete("/api/tasks/{task_id}")
 async def delete_task(
@@ -433,10 +1227,14 @@ async def delete_task(
             detail="Acesso não autorizado"
         )
 
+    # Parar o processamento antes de apagar os ficheiros que ele usa
+    await cancel_task(task)
+
     # Eliminar ficheiros
     try:
-        if os.path.exists(task.get("file_path", "")):
-            os.remove(task["file_path"])
+        for upload_path in task.get("file_paths") or [task.get("file_path", "")]:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
 
         if task.get("result"):
             for file_path in task["result"]["ficheiros_gerados"].values():
@@ -446,7 +1244,7 @@ async def delete_task(
         logger.error(f"Erro ao eliminar ficheiros: {e}")
 
     # Eliminar task
-    del active_tasks[task_id]
+    evict_task(task)
 
     return {"message": "Task eliminada com sucesso"}
 
@@ -462,6 +1260,21 @@ async def health_check():
         "api_key_configured": bool(os.getenv('ANTHROPIC_API_KEY'))
     }
 
+async def require_metrics_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # As métricas agregam todos os utilizadores: só o scraper, nunca um token de utilizador
+    if not is_metrics_token(credentials.credentials):
+        raise HTTPException(status_code=403, detail="Acesso reservado à monitorização")
+
+@app.get("/api/system/metrics", dependencies=[Depends(require_metrics_token)])
+async def system_metrics():
+    """Métricas no formato de texto do Prometheus (só com o token de serviço METRICS_TOKEN)"""
+    ACTIVE_TASKS.set(len(active_tasks))
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, PROMETHEUS_MULTIPROC_DIR)
+    return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
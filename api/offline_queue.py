@@ -0,0 +1,221 @@
+"""
+AiparatiExpress API - Fila offline
+Com a API do modelo indisponível (sem ANTHROPIC_API_KEY, circuito aberto ou
+falhas de ligação) os uploads não se perdem: a task fica em `queued_offline`,
+persistida em SQLite junto aos uploads, e volta à fila de processamento a
+ritmo controlado quando a dependência recupera, em vez de todas de uma vez.
+
+Com vários workers sobre o mesmo ficheiro cada linha tem dono: um worker só
+recarrega as tasks que reclama atomicamente (sem dono, ou com a concessão
+expirada por o dono ter morrido) e renova periodicamente as suas. O acesso
+ao SQLite corre numa thread dedicada, fora do event loop.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+OFFLINE_QUEUE_ENABLED = os.getenv('OFFLINE_QUEUE_ENABLED', 'true').lower() == 'true'
+OFFLINE_QUEUE_PATH = os.getenv('OFFLINE_QUEUE_PATH', 'uploads/offline_queue.db')
+# Tasks reenviadas por segundo quando a API recupera
+OFFLINE_DRAIN_RATE = float(os.getenv('OFFLINE_DRAIN_RATE', '0.2'))
+# Intervalo entre verificações da disponibilidade da API
+OFFLINE_PROBE_SECONDS = float(os.getenv('OFFLINE_PROBE_SECONDS', '15'))
+# Tentativas de processamento antes de a task passar a erro
+OFFLINE_MAX_ATTEMPTS = int(os.getenv('OFFLINE_MAX_ATTEMPTS', '5'))
+# Validade da posse das linhas; o dono renova-a a cada terço deste intervalo
+OFFLINE_LEASE_SECONDS = float(os.getenv('OFFLINE_LEASE_SECONDS', '60'))
+
+# Campos da task que não vão para disco (objetos em memória ou derivados)
+TRANSIENT_FIELDS = {"cancel_token", "status_body", "version", "retry_at", "offline_persisted"}
+DATETIME_FIELDS = ("created_at", "completed_at")
+
+OFFLINE_QUEUED = Counter(
+    "autofund_offline_queued_total", "Tasks colocadas na fila offline", ["reason"])
+OFFLINE_DRAINED = Counter(
+    "autofund_offline_drained_total", "Tasks reenviadas da fila offline para processamento")
+OFFLINE_DEPTH = Gauge("autofund_offline_queue_depth", "Tasks à espera na fila offline",
+                      multiprocess_mode="livesum")
+
+
+def _default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+
+def serialize_task(task: Dict[str, Any]) -> str:
+    return json.dumps({k: v for k, v in task.items() if k not in TRANSIENT_FIELDS},
+                      default=_default, ensure_ascii=False)
+
+
+def deserialize_task(payload: str) -> Dict[str, Any]:
+    task = json.loads(payload)
+    for name in DATETIME_FIELDS:
+        if task.get(name):
+            task[name] = datetime.fromisoformat(task[name])
+    return task
+
+
+class OfflineStore:
+    """Tasks em espera persistidas em SQLite (uma linha por task, até terminar)
+
+    Os métodos são síncronos; no event loop usa-se `submit`, que os executa
+    numa thread própria pela ordem de chegada (um remove nunca passa à frente
+    do put da mesma task).
+    """
+
+    def __init__(self, path: str = OFFLINE_QUEUE_PATH, lease: float = OFFLINE_LEASE_SECONDS):
+        self.path = path
+        self.lease = lease
+        # Identifica este worker como dono das linhas que cria ou reclama
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="offline-store")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS offline_tasks ("
+                "task_id TEXT PRIMARY KEY, queued_at REAL NOT NULL, reason TEXT, payload TEXT NOT NULL, "
+                "owner TEXT, lease_until REAL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(offline_tasks)")}
+            for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE offline_tasks ADD COLUMN {column} {kind}")
+        return self._conn
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        """Executa uma operação do store fora do event loop; erros ficam no log"""
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def put(self, task: Dict[str, Any], reason: str):
+        OFFLINE_QUEUED.labels(reason=reason).inc()
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO offline_tasks (task_id, queued_at, reason, payload, owner, lease_until) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(task_id) DO UPDATE SET reason = excluded.reason, payload = excluded.payload, "
+                "owner = excluded.owner, lease_until = excluded.lease_until",
+                (task["task_id"], time.time(), reason, serialize_task(task), self.owner, time.time() + self.lease)
+            )
+
+    def update(self, task: Dict[str, Any]):
+        """Reescreve o payload de uma task já persistida (não recria linhas removidas)"""
+        with self._lock:
+            self._connect().execute(
+                "UPDATE offline_tasks SET payload = ? WHERE task_id = ?", (serialize_task(task), task["task_id"])
+            )
+
+    def remove(self, task_id: str):
+        with self._lock:
+            self._connect().execute("DELETE FROM offline_tasks WHERE task_id = ?", (task_id,))
+
+    def claim(self) -> List[Dict[str, Any]]:
+        """Reclama as linhas sem dono ou com a posse expirada e renova as próprias
+
+        O UPDATE é atómico no SQLite: cada linha fica com um único worker.
+        Retorna todas as tasks deste worker.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE offline_tasks SET owner = ?, lease_until = ? "
+                "WHERE owner IS NULL OR owner = ? OR lease_until < ?",
+                (self.owner, now + self.lease, self.owner, now)
+            )
+            rows = conn.execute(
+                "SELECT payload FROM offline_tasks WHERE owner = ? ORDER BY queued_at", (self.owner,)
+            ).fetchall()
+        return [deserialize_task(payload) for (payload,) in rows]
+
+    def release(self):
+        """Devolve as linhas deste worker (paragem ordenada: outro worker retoma-as já)"""
+        with self._lock:
+            self._connect().execute("UPDATE offline_tasks SET owner = NULL WHERE owner = ?", (self.owner,))
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Todas as tasks persistidas, de qualquer dono"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT payload FROM offline_tasks ORDER BY queued_at").fetchall()
+        return [deserialize_task(payload) for (payload,) in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _log_failure(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Erro na fila offline: {future.exception()}")
+
+
+class OfflineDrainer:
+    """Reenvia as tasks em espera, por ordem de chegada, a OFFLINE_DRAIN_RATE por segundo"""
+
+    def __init__(self, is_available: Callable[[], bool], resubmit: Callable[[Dict[str, Any]], bool],
+                 rate: float = OFFLINE_DRAIN_RATE, probe_interval: float = OFFLINE_PROBE_SECONDS):
+        self.is_available = is_available
+        self.resubmit = resubmit
+        self.rate = rate
+        self.probe_interval = probe_interval
+        self._pending: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, task: Dict[str, Any]):
+        self._pending.append(task)
+        OFFLINE_DEPTH.set(len(self._pending))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def drain_one(self) -> bool:
+        """Reenvia a próxima task ainda em espera; False se não havia nenhuma"""
+        while self._pending:
+            task = self._pending.popleft()
+            OFFLINE_DEPTH.set(len(self._pending))
+            # Tasks canceladas ou eliminadas entretanto são ignoradas
+            if self.resubmit(task):
+                OFFLINE_DRAINED.inc()
+                return True
+        return False
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if not self.is_available():
+                await asyncio.sleep(self.probe_interval)
+                continue
+            if self.drain_one():
+                await asyncio.sleep(1.0 / self.rate)
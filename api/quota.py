@@ -0,0 +1,439 @@
+"""
+AiparatiExpress API - Quotas
+Reserva de quota no upload com contadores atómicos em memória (ou no Redis,
+partilhados entre workers): reservar → confirmar no fim do processamento ou
+libertar em caso de erro. O consumo confirmado é escrito na tabela `users`
+(quota_used) em lotes periódicos, e os contadores são reconciliados com a
+base de dados no arranque, sem UPDATE por upload na linha do utilizador.
+
+A quota é mensal (mês civil em UTC): o consumo recomeça a zero no dia 1 e o
+limite vem da subscrição ativa (subscriptions.quota_limit), ou de
+users.quota_limit sem subscrição.
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, Optional, List, Tuple
+
+from fastapi import HTTPException
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+# "local" (por processo) ou "redis" (partilhado; precisa de REDIS_URL)
+QUOTA_BACKEND = os.getenv('QUOTA_BACKEND', 'local')
+REDIS_URL = os.getenv('REDIS_URL')
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+QUOTA_FLUSH_SECONDS = float(os.getenv('QUOTA_FLUSH_SECONDS', '5'))
+# Validade dos contadores no Redis: cobre o mês e deixa expirar os meses passados
+QUOTA_KEY_TTL = 40 * 86400
+
+# Quota por plano para utilizadores ainda sem registo na base de dados
+TIER_QUOTAS = {
+    "free": int(os.getenv('FREE_TIER_QUOTA', '5')),
+    "premium": int(os.getenv('PREMIUM_TIER_QUOTA', '100')),
+    "enterprise": int(os.getenv('ENTERPRISE_TIER_QUOTA', '1000')),
+}
+
+QUOTA_REJECTED = Counter("autofund_quota_rejected_total", "Uploads rejeitados por quota esgotada", ["tier"])
+QUOTA_FLUSHES = Counter("autofund_quota_flush_total", "Escritas em lote de quota na base de dados", ["result"])
+
+
+class QuotaExceeded(HTTPException):
+    def __init__(self, detail: str = "Quota de análises esgotada para o plano atual"):
+        super().__init__(status_code=402, detail=detail)
+
+
+@dataclass
+class QuotaUsage:
+    used: int
+    reserved: int
+    limit: int
+
+    @property
+    def available(self) -> int:
+        return max(self.limit - self.used - self.reserved, 0)
+
+
+def tier_quota(tier: str) -> int:
+    return TIER_QUOTAS.get(tier, TIER_QUOTAS["free"])
+
+
+def current_period(now: Optional[datetime] = None) -> date:
+    """Primeiro dia do mês (UTC) a que o consumo é imputado"""
+    now = now or datetime.now(timezone.utc)
+    return now.date().replace(day=1)
+
+
+# Consumo pendente por (período, utilizador): o mês em que foi confirmado
+PendingUsage = Dict[Tuple[date, str], int]
+
+
+class LocalQuotaLedger:
+    """Contadores do processo; cada operação corre sem await, logo é atómica no event loop"""
+
+    def __init__(self, period_fn: Callable[[], date] = current_period):
+        self.period_fn = period_fn
+        self._period = period_fn()
+        self._usage: Dict[str, QuotaUsage] = {}
+        # Consumo confirmado ainda não escrito na base de dados
+        self._pending: PendingUsage = {}
+
+    def _roll(self) -> date:
+        period = self.period_fn()
+        if period != self._period:
+            # Mês novo: o consumo recomeça; limites e reservas em curso mantêm-se
+            for usage in self._usage.values():
+                usage.used = 0
+            self._period = period
+        return period
+
+    def _get(self, user_id: str, tier: str) -> QuotaUsage:
+        self._roll()
+        usage = self._usage.get(user_id)
+        if usage is None:
+            usage = self._usage[user_id] = QuotaUsage(0, 0, tier_quota(tier))
+        return usage
+
+    async def reserve(self, user_id: str, tier: str = "free", amount: int = 1):
+        usage = self._get(user_id, tier)
+        if usage.used + usage.reserved + amount > usage.limit:
+            QUOTA_REJECTED.labels(tier=tier).inc()
+            raise QuotaExceeded()
+        usage.reserved += amount
+
+    async def commit(self, user_id: str, amount: int = 1):
+        usage = self._get(user_id, "free")
+        usage.reserved = max(usage.reserved - amount, 0)
+        usage.used += amount
+        key = (self._period, user_id)
+        self._pending[key] = self._pending.get(key, 0) + amount
+
+    async def release(self, user_id: str, amount: int = 1):
+        usage = self._get(user_id, "free")
+        usage.reserved = max(usage.reserved - amount, 0)
+
+    async def usage(self, user_id: str, tier: str = "free") -> QuotaUsage:
+        usage = self._get(user_id, tier)
+        return QuotaUsage(usage.used, usage.reserved, usage.limit)
+
+    async def drain_pending(self) -> PendingUsage:
+        pending, self._pending = self._pending, {}
+        return pending
+
+    async def restore_pending(self, pending: PendingUsage):
+        for key, amount in pending.items():
+            self._pending[key] = self._pending.get(key, 0) + amount
+
+    async def load(self, rows: List[Tuple[str, int, int]], period: Optional[date] = None):
+        """Reconciliação: consumo do mês e limite persistidos mais o que ainda não foi escrito"""
+        if (period or self.period_fn()) != self._roll():
+            return
+        for user_id, used, limit in rows:
+            usage = self._usage.get(user_id)
+            pending = self._pending.get((self._period, user_id), 0)
+            if usage is None:
+                self._usage[user_id] = QuotaUsage(used + pending, 0, limit)
+            else:
+                usage.used = used + pending
+                usage.limit = limit
+
+
+# -1: contador inexistente (novo no mês ou despejado pelo Redis), recarregar da BD
+_RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local used = tonumber(redis.call('HGET', KEYS[1], 'used') or '0')
+local reserved = tonumber(redis.call('HGET', KEYS[1], 'reserved') or '0')
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit'))
+if used + reserved + tonumber(ARGV[1]) > limit then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'reserved', ARGV[1])
+return 1
+"""
+
+# O pendente conta sempre; o contador só se existir (senão é recarregado com o pendente)
+_COMMIT_SCRIPT = """
+redis.call('HINCRBY', KEYS[2], ARGV[2], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local reserved = tonumber(redis.call('HGET', KEYS[1], 'reserved') or '0')
+redis.call('HSET', KEYS[1], 'reserved', math.max(reserved - tonumber(ARGV[1]), 0))
+redis.call('HINCRBY', KEYS[1], 'used', ARGV[1])
+return 1
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local reserved = tonumber(redis.call('HGET', KEYS[1], 'reserved') or '0')
+redis.call('HSET', KEYS[1], 'reserved', math.max(reserved - tonumber(ARGV[1]), 0))
+return 1
+"""
+
+# Cria o contador do mês: consumo na BD + pendente ainda não escrito; o limite é sempre atualizado
+_SEED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    local pending = tonumber(redis.call('HGET', KEYS[2], ARGV[3]) or '0')
+    redis.call('HSET', KEYS[1], 'used', tonumber(ARGV[1]) + pending, 'reserved', 0)
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+redis.call('HSET', KEYS[1], 'limit', ARGV[2])
+return 1
+"""
+
+# Move o hash de pendentes para uma chave de lote e devolve-o, atomicamente
+_DRAIN_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {}
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+local items = redis.call('HGETALL', KEYS[2])
+redis.call('DEL', KEYS[2])
+return items
+"""
+
+
+class RedisQuotaLedger:
+    """Contadores partilhados entre workers; reserva e confirmação em scripts Lua atómicos
+
+    Os contadores têm TTL e podem ser despejados pelo Redis (volatile-lru):
+    quando faltam são recriados a partir da BD (`loader`) mais o consumo
+    pendente. O hash de pendentes não tem TTL e nunca é despejado.
+    """
+
+    PENDING_KEY = "autofund:quota:pending"
+
+    def __init__(self, url: str = REDIS_URL, period_fn: Callable[[], date] = current_period):
+        import redis.asyncio as redis_asyncio
+
+        self.client = redis_asyncio.Redis.from_url(url, decode_responses=True)
+        self.period_fn = period_fn
+        # async (user_id, period) -> (used, limit) ou None; definido pelo write-behind
+        self.loader: Optional[Callable] = None
+        self._reserve = self.client.register_script(_RESERVE_SCRIPT)
+        self._commit = self.client.register_script(_COMMIT_SCRIPT)
+        self._release = self.client.register_script(_RELEASE_SCRIPT)
+        self._seed_script = self.client.register_script(_SEED_SCRIPT)
+        self._drain = self.client.register_script(_DRAIN_SCRIPT)
+
+    @staticmethod
+    def _key(user_id: str, period: date) -> str:
+        return f"autofund:quota:{period.isoformat()}:{user_id}"
+
+    @staticmethod
+    def _field(user_id: str, period: date) -> str:
+        return f"{period.isoformat()}:{user_id}"
+
+    async def _seed(self, user_id: str, tier: str, period: date):
+        row = await self.loader(user_id, period) if self.loader is not None else None
+        used, limit = row if row is not None else (0, tier_quota(tier))
+        await self._seed_script(keys=[self._key(user_id, period), self.PENDING_KEY],
+                                args=[used, limit, self._field(user_id, period), QUOTA_KEY_TTL])
+
+    async def reserve(self, user_id: str, tier: str = "free", amount: int = 1):
+        period = self.period_fn()
+        result = await self._reserve(keys=[self._key(user_id, period)], args=[amount])
+        if result == -1:
+            await self._seed(user_id, tier, period)
+            result = await self._reserve(keys=[self._key(user_id, period)], args=[amount])
+        if result != 1:
+            QUOTA_REJECTED.labels(tier=tier).inc()
+            raise QuotaExceeded()
+
+    async def commit(self, user_id: str, amount: int = 1):
+        period = self.period_fn()
+        await self._commit(keys=[self._key(user_id, period), self.PENDING_KEY],
+                           args=[amount, self._field(user_id, period)])
+
+    async def release(self, user_id: str, amount: int = 1):
+        await self._release(keys=[self._key(user_id, self.period_fn())], args=[amount])
+
+    async def usage(self, user_id: str, tier: str = "free") -> QuotaUsage:
+        period = self.period_fn()
+        values = await self.client.hgetall(self._key(user_id, period))
+        if not values:
+            await self._seed(user_id, tier, period)
+            values = await self.client.hgetall(self._key(user_id, period))
+        return QuotaUsage(int(values.get("used", 0)), int(values.get("reserved", 0)),
+                          int(values.get("limit", tier_quota(tier))))
+
+    async def drain_pending(self) -> PendingUsage:
+        batch_key = f"{self.PENDING_KEY}:{os.getpid()}"
+        items = await self._drain(keys=[self.PENDING_KEY, batch_key])
+        pending: PendingUsage = {}
+        for i in range(0, len(items), 2):
+            period, user_id = items[i].split(":", 1)
+            pending[(date.fromisoformat(period), user_id)] = int(items[i + 1])
+        return pending
+
+    async def restore_pending(self, pending: PendingUsage):
+        async with self.client.pipeline(transaction=True) as pipe:
+            for (period, user_id), amount in pending.items():
+                pipe.hincrby(self.PENDING_KEY, self._field(user_id, period), amount)
+            await pipe.execute()
+
+    async def load(self, rows: List[Tuple[str, int, int]], period: Optional[date] = None):
+        """Reconciliação: o Redis já tem o consumo mais recente; a BD só preenche o que falta"""
+        period = period or self.period_fn()
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id, used, limit in rows:
+                await self._seed_script(keys=[self._key(user_id, period), self.PENDING_KEY],
+                                        args=[used, limit, self._field(user_id, period), QUOTA_KEY_TTL],
+                                        client=pipe)
+            await pipe.execute()
+
+
+# Consumo do mês pedido (0 se o registado é de um mês anterior) e limite da subscrição ativa
+_LOAD_SQL = """
+SELECT u.id AS user_id,
+       CASE WHEN u.quota_period = $1 THEN u.quota_used ELSE 0 END AS quota_used,
+       COALESCE(s.quota_limit, u.quota_limit) AS quota_limit
+FROM users u
+LEFT JOIN LATERAL (
+    SELECT quota_limit FROM subscriptions
+    WHERE user_id = u.id AND status = 'active' AND (ends_at IS NULL OR ends_at > NOW())
+    ORDER BY started_at DESC
+    LIMIT 1
+) s ON true
+WHERE u.is_active
+"""
+
+# Consumo de um mês anterior ao registado chega tarde e já não conta
+_APPLY_SQL = """
+UPDATE users
+SET quota_used = CASE WHEN quota_period = $3 THEN quota_used + $2 ELSE $2 END,
+    quota_period = $3,
+    updated_at = NOW()
+WHERE id = $1::uuid AND (quota_period IS NULL OR quota_period <= $3)
+"""
+
+
+def _user_uuid(user_id: str) -> Optional[uuid.UUID]:
+    try:
+        return uuid.UUID(user_id)
+    except ValueError:
+        return None
+
+
+class QuotaStore:
+    """Leitura e escrita em lote de users.quota_used / quota_period e do limite da subscrição (asyncpg)"""
+
+    def __init__(self, database_url: str = DATABASE_URL):
+        self.database_url = database_url
+        self._pool = None
+
+    async def _get_pool(self):
+        if self._pool is None:
+            import asyncpg
+
+            self._pool = await asyncpg.create_pool(self.database_url, min_size=1, max_size=2)
+        return self._pool
+
+    @staticmethod
+    def _row(r) -> Tuple[str, int, int]:
+        return (str(r["user_id"]), r["quota_used"] or 0, r["quota_limit"] or 0)
+
+    async def load(self, period: date) -> List[Tuple[str, int, int]]:
+        pool = await self._get_pool()
+        rows = await pool.fetch(_LOAD_SQL, period)
+        return [self._row(r) for r in rows]
+
+    async def load_user(self, user_id: str, period: date) -> Optional[Tuple[int, int]]:
+        user_uuid = _user_uuid(user_id)
+        if user_uuid is None:
+            return None
+        pool = await self._get_pool()
+        r = await pool.fetchrow(_LOAD_SQL + " AND u.id = $2::uuid", period, user_uuid)
+        return None if r is None else self._row(r)[1:]
+
+    async def apply(self, pending: PendingUsage):
+        records = []
+        for (period, user_id), amount in pending.items():
+            user_uuid = _user_uuid(user_id)
+            if user_uuid is None:
+                # Sem linha em users (ids que não são UUID): nada a persistir
+                logger.warning(f"Consumo de quota de {user_id} não persistido: id não é UUID")
+                continue
+            records.append((user_uuid, amount, period))
+        if not records:
+            return
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(_APPLY_SQL, records)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+
+
+class QuotaWriteBehind:
+    """Escreve periodicamente na BD o consumo confirmado acumulado no ledger"""
+
+    def __init__(self, ledger, store: QuotaStore, interval: float = QUOTA_FLUSH_SECONDS):
+        self.ledger = ledger
+        self.store = store
+        self.interval = interval
+        if isinstance(ledger, RedisQuotaLedger):
+            ledger.loader = store.load_user
+
+    async def reconcile(self):
+        period = self.ledger.period_fn()
+        rows = await self.store.load(period)
+        await self.ledger.load(rows, period)
+        logger.info(f"Quotas reconciliadas com a base de dados ({len(rows)} utilizadores)")
+
+    async def flush(self) -> int:
+        pending = await self.ledger.drain_pending()
+        if not pending:
+            return 0
+        try:
+            await self.store.apply(pending)
+        except Exception as e:
+            # Volta para a fila: é escrito na próxima passagem
+            await self.ledger.restore_pending(pending)
+            QUOTA_FLUSHES.labels(result="error").inc()
+            logger.error(f"Erro ao escrever quotas na base de dados: {e}")
+            return 0
+        QUOTA_FLUSHES.labels(result="ok").inc()
+        return len(pending)
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush()
+        finally:
+            # Última escrita ao parar (shutdown cancela a tarefa)
+            await self.flush()
+
+
+def create_ledger(backend: str = QUOTA_BACKEND):
+    if backend == "redis" and REDIS_URL:
+        try:
+            return RedisQuotaLedger()
+        except ImportError:
+            logger.warning("redis não instalado: quotas contadas por processo")
+    return LocalQuotaLedger()
+
+
+def create_write_behind(ledger) -> Optional[QuotaWriteBehind]:
+    """Write-behind para Postgres, se DATABASE_URL estiver definido e asyncpg instalado"""
+    if not DATABASE_URL.startswith("postgres"):
+        return None
+    try:
+        import asyncpg  # noqa: F401
+    except ImportError:
+        logger.warning("asyncpg não instalado: consumo de quota não é persistido")
+        return None
+    return QuotaWriteBehind(ledger, QuotaStore(DATABASE_URL))
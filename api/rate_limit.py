@@ -0,0 +1,226 @@
+"""
+AiparatiExpress API - Limitação de pedidos
+Token bucket por utilizador (ou IP, sem token), por classe de endpoint
+(upload, status, download, default) e por plano de subscrição. Em modo local
+os buckets vivem no processo; com RATE_LIMIT_BACKEND=redis são partilhados
+entre workers através de um script Lua atómico.
+"""
+
+import os
+import json
+import math
+import time
+import logging
+from typing import Dict, Tuple, Optional
+
+from prometheus_client import Counter
+from api.auth import authenticate
+
+logger = logging.getLogger(__name__)
+
+# "local" (por processo) ou "redis" (partilhado; precisa de REDIS_URL)
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'local')
+REDIS_URL = os.getenv('REDIS_URL')
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+# (capacidade do bucket, pedidos repostos por segundo) por classe e plano
+DEFAULT_RATE_LIMITS = {
+    "upload": {"anonymous": (2, 1 / 60), "free": (5, 5 / 60), "premium": (20, 20 / 60),
+               "enterprise": (100, 100 / 60)},
+    "status": {"anonymous": (10, 1), "free": (30, 2), "premium": (60, 5), "enterprise": (200, 20)},
+    "download": {"anonymous": (10, 0.5), "free": (20, 1), "premium": (60, 3), "enterprise": (200, 10)},
+    "default": {"anonymous": (20, 1), "free": (60, 5), "premium": (120, 10), "enterprise": (300, 30)},
+}
+# JSON {"classe": {"plano": [capacidade, por_segundo]}} fundido sobre os valores por omissão
+RATE_LIMITS_JSON = os.getenv('RATE_LIMITS_JSON', '')
+
+# Prefixos de caminho por classe; a ordem importa (o primeiro que corresponde)
+ENDPOINT_CLASSES = [
+    ("/api/upload", "upload"),
+    ("/api/status", "status"),
+    ("/api/result", "status"),
+    ("/api/tasks", "status"),
+    ("/api/download", "download"),
+    ("/files", "download"),
+]
+EXEMPT_PATHS = {"/", "/docs", "/redoc", "/openapi.json"}
+
+RATE_LIMITED = Counter(
+    "autofund_rate_limited_total", "Pedidos rejeitados por limite de pedidos", ["endpoint_class", "tier"])
+
+
+def load_rate_limits(raw: str = RATE_LIMITS_JSON) -> Dict[str, Dict[str, Tuple[float, float]]]:
+    limits = {cls: dict(tiers) for cls, tiers in DEFAULT_RATE_LIMITS.items()}
+    if raw:
+        for cls, tiers in json.loads(raw).items():
+            limits.setdefault(cls, {}).update({tier: tuple(v) for tier, v in tiers.items()})
+    return limits
+
+
+def endpoint_class(path: str) -> Optional[str]:
+    if path in EXEMPT_PATHS:
+        return None
+    for prefix, cls in ENDPOINT_CLASSES:
+        if path.startswith(prefix):
+            return cls
+    return "default"
+
+
+class LocalTokenBuckets:
+    """Buckets em memória do processo
+
+    Sem locks: o middleware corre sempre no event loop e cada atualização é
+    feita sem pontos de suspensão, logo é atómica face aos outros pedidos.
+    """
+
+    PRUNE_EVERY = 10000
+
+    def __init__(self):
+        # chave → [tokens, instante da última atualização]
+        self._buckets: Dict[str, list] = {}
+        self._calls = 0
+
+    def acquire(self, key: str, capacity: float, rate: float,
+                now: Optional[float] = None) -> Tuple[bool, int, float]:
+        """Consome um token; retorna (permitido, tokens restantes, segundos até haver token)"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now]
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        bucket[0], bucket[1] = tokens, now
+
+        self._calls += 1
+        if self._calls % self.PRUNE_EVERY == 0:
+            self._prune(now)
+
+        retry_after = 0.0 if allowed else (1 - tokens) / rate
+        return allowed, int(tokens), retry_after
+
+    def clear(self):
+        self._buckets.clear()
+
+    def _prune(self, now: float, idle_seconds: float = 3600):
+        # Buckets parados há muito tempo estão cheios: equivalem a não existir
+        for key in [k for k, (_, ts) in self._buckets.items() if now - ts > idle_seconds]:
+            del self._buckets[key]
+
+
+_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisTokenBuckets:
+    """Buckets partilhados entre workers (atualização atómica em Lua no Redis)"""
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis.asyncio as redis_asyncio
+
+        self.client = redis_asyncio.Redis.from_url(url)
+        self._script = self.client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, key: str, capacity: float, rate: float) -> Tuple[bool, int, float]:
+        allowed, tokens = await self._script(keys=[f"autofund:ratelimit:{key}"], args=[capacity, rate])
+        tokens = float(tokens)
+        retry_after = 0.0 if allowed else (1 - tokens) / rate
+        return bool(allowed), int(tokens), retry_after
+
+
+# Buckets do processo (partilhados por todas as instâncias do middleware)
+LOCAL_BUCKETS = LocalTokenBuckets()
+
+
+class RateLimitMiddleware:
+    """Aplica os limites antes do endpoint e acrescenta X-Rate-Limit-Remaining às respostas"""
+
+    def __init__(self, app, limits: Optional[Dict[str, Dict[str, Tuple[float, float]]]] = None,
+                 backend: str = RATE_LIMIT_BACKEND, enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.enabled = enabled
+        self.limits = limits if limits is not None else load_rate_limits()
+        self.local = LOCAL_BUCKETS
+        self.shared: Optional[RedisTokenBuckets] = None
+        if backend == "redis" and REDIS_URL:
+            try:
+                self.shared = RedisTokenBuckets()
+            except ImportError:
+                logger.warning("redis não instalado: limitação de pedidos por processo")
+
+    async def _identity(self, scope) -> Tuple[str, str]:
+        """(chave do cliente, plano): utilizador autenticado ou IP"""
+        headers = dict(scope.get("headers") or [])
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if authorization.lower().startswith("bearer "):
+            try:
+                user = await authenticate(authorization[7:].strip())
+                return f"user:{user['user_id']}", user.get("subscription_tier", "free")
+            except Exception:
+                # Token inválido: limitado como anónimo; o endpoint responde 401
+                pass
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}", "anonymous"
+
+    async def _acquire(self, key: str, capacity: float, rate: float) -> Tuple[bool, int, float]:
+        if self.shared is not None:
+            try:
+                return await self.shared.acquire(key, capacity, rate)
+            except Exception as e:
+                logger.warning(f"Redis indisponível para limitação de pedidos: {e}")
+        return self.local.acquire(key, capacity, rate)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        cls = endpoint_class(scope["path"])
+        tiers = self.limits.get(cls) if cls else None
+        if not tiers:
+            await self.app(scope, receive, send)
+            return
+
+        client_key, tier = await self._identity(scope)
+        capacity, rate = tiers.get(tier) or tiers.get("free")
+        allowed, remaining, retry_after = await self._acquire(f"{cls}:{client_key}", capacity, rate)
+
+        if not allowed:
+            RATE_LIMITED.labels(endpoint_class=cls, tier=tier).inc()
+            body = json.dumps({"detail": "Demasiados pedidos"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode()),
+                            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+                            (b"x-rate-limit-remaining", b"0")],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_remaining(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-rate-limit-remaining", str(remaining).encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_remaining)
@@ -0,0 +1,78 @@
+"""
+AiparatiExpress API - Serialização de respostas
+Codificação JSON rápida (orjson quando instalado) para bytes, composição de
+corpos a partir de fragmentos já serializados e projeção de campos
+(`?fields=analise.nivel_risco,dados_financeiros`).
+"""
+
+import json
+from datetime import datetime, date
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - fallback sem orjson
+    orjson = None
+
+
+def _default(value: Any):
+    # Tipos numpy (p.ex. rácios calculados com pandas) e afins
+    if hasattr(value, "item"):
+        return value.item()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def json_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def with_raw_fields(body: bytes, **fragments: bytes) -> bytes:
+    """Acrescenta a um objeto JSON serializado campos cujo valor já está em bytes"""
+    extra = b",".join(json_bytes(name) + b":" + value for name, value in fragments.items())
+    if not extra:
+        return body
+    if body == b"{}":
+        return b"{" + extra + b"}"
+    return body[:-1] + b"," + extra + b"}"
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[List[str]]]:
+    """'a.b,c' → [['a', 'b'], ['c']]; None se não houver projeção"""
+    if not fields:
+        return None
+    paths = [f.strip().split(".") for f in fields.split(",") if f.strip()]
+    if not paths or not all(all(path) for path in paths):
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro fields inválido"
+        )
+    return paths
+
+
+def project(obj: Dict[str, Any], paths: List[List[str]]) -> Dict[str, Any]:
+    """Subconjunto de obj com os caminhos pedidos (caminhos inexistentes são ignorados)"""
+    result: Dict[str, Any] = {}
+    for path in paths:
+        value = obj
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            # Só com a folha encontrada se criam os dicts intermédios
+            target = result
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+    return result
+
+
+def json_response(body: bytes, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
@@ -0,0 +1,175 @@
+"""
+AiparatiExpress API - Escalonamento de tasks
+Fila de processamento com weighted fair queueing entre utilizadores: cada
+task recebe uma etiqueta de fim virtual (max(tempo virtual, última etiqueta
+do utilizador) + 1/peso do plano) e é despachada a de menor etiqueta. Um
+lote de 500 IES de um utilizador não atrasa o upload isolado de outro, e
+planos superiores têm mais peso. Tasks à espera há mais de
+SCHEDULER_MAX_WAIT_SECONDS passam à frente (garantia contra starvation).
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Awaitable, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_TASKS = int(os.getenv('MAX_CONCURRENT_TASKS', '5'))
+SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv('SCHEDULER_MAX_WAIT_SECONDS', '600'))
+
+# Peso por plano: fração do processamento em caso de contenção
+TIER_WEIGHTS = {"free": 1.0, "premium": 2.0, "enterprise": 4.0}
+
+QUEUE_WAIT = Histogram(
+    "autofund_queue_wait_seconds", "Tempo de espera na fila até ao início do processamento", ["tier"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+QUEUE_DEPTH = Gauge("autofund_queue_depth", "Tasks à espera de processamento", ["tier"],
+                    multiprocess_mode="livesum")
+JOBS_AGED = Counter(
+    "autofund_queue_aged_total", "Tasks despachadas pela garantia de espera máxima", ["tier"])
+
+
+@dataclass(order=True)
+class Job:
+    finish_tag: float
+    seq: int
+    task_id: str = field(compare=False)
+    user_id: str = field(compare=False)
+    tier: str = field(compare=False)
+    run: Callable[[], Awaitable[None]] = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+    done: bool = field(compare=False, default=False)
+
+
+class FairScheduler:
+    """Fila WFQ por utilizador com pesos por plano e N workers assíncronos"""
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_TASKS,
+                 max_wait: float = SCHEDULER_MAX_WAIT_SECONDS,
+                 weights: Optional[Dict[str, float]] = None):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.weights = weights or TIER_WEIGHTS
+        self._heap: List[Job] = []
+        # Ordem de chegada, para a garantia de espera máxima (remoção preguiçosa)
+        self._arrivals: deque = deque()
+        self._jobs: Dict[str, Job] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._available: Optional[asyncio.Condition] = None
+        self._workers: List[asyncio.Task] = []
+        self.running: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def weight(self, tier: str) -> float:
+        return self.weights.get(tier, self.weights["free"])
+
+    def submit(self, task_id: str, user_id: str, tier: str, run: Callable[[], Awaitable[None]]) -> Job:
+        """Coloca a task na fila; `run` cria a corrotina de processamento"""
+        start = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+        finish = start + 1.0 / self.weight(tier)
+        self._last_finish[user_id] = finish
+
+        job = Job(finish, next(self._seq), task_id, user_id, tier, run)
+        heapq.heappush(self._heap, job)
+        self._arrivals.append(job)
+        self._jobs[task_id] = job
+        QUEUE_DEPTH.labels(tier=tier).inc()
+        self._notify()
+        return job
+
+    def cancel(self, task_id: str) -> bool:
+        """Retira da fila uma task ainda não iniciada; True se estava na fila"""
+        job = self._jobs.pop(task_id, None)
+        if job is None:
+            return False
+        job.done = True
+        QUEUE_DEPTH.labels(tier=job.tier).dec()
+        return True
+
+    def _pop_next(self, now: float) -> Optional[Job]:
+        while self._arrivals and self._arrivals[0].done:
+            self._arrivals.popleft()
+        if self._arrivals and now - self._arrivals[0].enqueued_at >= self.max_wait:
+            job = self._arrivals.popleft()
+            JOBS_AGED.labels(tier=job.tier).inc()
+        else:
+            job = None
+            while self._heap:
+                candidate = heapq.heappop(self._heap)
+                if not candidate.done:
+                    job = candidate
+                    break
+            if job is None:
+                return None
+            self._virtual_time = max(self._virtual_time, job.finish_tag)
+
+        job.done = True
+        del self._jobs[job.task_id]
+        QUEUE_DEPTH.labels(tier=job.tier).dec()
+        self._prune_users()
+        return job
+
+    def _prune_users(self):
+        # Utilizadores cuja última etiqueta já foi ultrapassada não precisam de estado
+        if len(self._last_finish) > 1000:
+            self._last_finish = {u: f for u, f in self._last_finish.items() if f > self._virtual_time}
+
+    def _notify(self):
+        if self._available is None:
+            return
+        async def wake():
+            async with self._available:
+                self._available.notify()
+        asyncio.get_running_loop().create_task(wake())
+
+    async def next_job(self) -> Job:
+        async with self._available:
+            while True:
+                job = self._pop_next(time.monotonic())
+                if job is not None:
+                    return job
+                await self._available.wait()
+
+    async def _worker(self):
+        while True:
+            job = await self.next_job()
+            QUEUE_WAIT.labels(tier=job.tier).observe(time.monotonic() - job.enqueued_at)
+            # Cada task corre numa asyncio.Task própria para poder ser cancelada
+            # sem cancelar o worker
+            job_task = asyncio.create_task(job.run())
+            self.running[job.task_id] = job_task
+            try:
+                await asyncio.wait({job_task})
+            finally:
+                self.running.pop(job.task_id, None)
+
+            if job_task.cancelled():
+                logger.info(f"Task {job.task_id} cancelada durante o processamento")
+            elif job_task.exception() is not None:
+                logger.error(f"Erro não tratado na task {job.task_id}: {job_task.exception()}")
+
+    def start(self):
+        self._available = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent)]
+        if self._jobs:
+            self._notify()
+        logger.info(f"Escalonador iniciado ({self.max_concurrent} workers)")
+
+    async def stop(self):
+        tasks = self._workers + list(self.running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
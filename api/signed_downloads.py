@@ -0,0 +1,123 @@
+"""
+AiparatiExpress API - Links de download assinados
+URLs com assinatura HMAC-SHA256 e data de expiração para os ficheiros em
+OUTPUT_ROOT. A verificação só precisa do segredo partilhado: não consulta o
+armazenamento de tasks nem a autenticação, pelo que pode correr num processo
+à parte (`uvicorn api.signed_downloads:app --port 8001`) atrás do nginx.
+"""
+
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional, Dict
+from urllib.parse import quote, urlencode
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from fastapi import HTTPException
+
+from api.downloads import OUTPUT_ROOT, file_download_response
+
+logger = logging.getLogger(__name__)
+
+# Sem segredo configurado não são emitidos links assinados
+DOWNLOAD_SIGNING_SECRET = os.getenv('DOWNLOAD_SIGNING_SECRET', '')
+# Valores de exemplo já publicados: quem os conhece forja links para qualquer ficheiro
+PLACEHOLDER_SECRETS = {"change-me-download-secret", "change-me", "changeme"}
+DOWNLOAD_URL_TTL = int(os.getenv('DOWNLOAD_URL_TTL', '3600'))
+SIGNED_DOWNLOAD_PREFIX = os.getenv('SIGNED_DOWNLOAD_PREFIX', '/files')
+
+
+def check_signing_secret(secret: str = None, required: bool = True):
+    """Recusa arrancar com o segredo de exemplo ou, se `required`, sem segredo"""
+    secret = secret if secret is not None else DOWNLOAD_SIGNING_SECRET
+    if secret in PLACEHOLDER_SECRETS:
+        raise RuntimeError("DOWNLOAD_SIGNING_SECRET tem um valor de exemplo; gere um com openssl rand -base64 32")
+    if required and not secret:
+        raise RuntimeError("DOWNLOAD_SIGNING_SECRET não configurado")
+
+
+def _usable(secret: str) -> bool:
+    return bool(secret) and secret not in PLACEHOLDER_SECRETS
+
+
+def _signature(secret: str, path: str, expires: int, filename: str) -> str:
+    message = f"{path}\n{expires}\n{filename}".encode()
+    digest = hmac.new(secret.encode(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def relative_output_path(file_path: str) -> Optional[str]:
+    """Caminho relativo a OUTPUT_ROOT, ou None se o ficheiro estiver fora"""
+    try:
+        return Path(file_path).resolve().relative_to(OUTPUT_ROOT.resolve()).as_posix()
+    except ValueError:
+        return None
+
+
+def sign_download(file_path: str, filename: str, ttl: int = DOWNLOAD_URL_TTL,
+                  secret: str = None, now: float = None) -> Optional[str]:
+    """URL assinado e com validade para um ficheiro de output"""
+    secret = secret if secret is not None else DOWNLOAD_SIGNING_SECRET
+    relative = relative_output_path(file_path)
+    if not _usable(secret) or relative is None:
+        return None
+
+    expires = int((now if now is not None else time.time()) + ttl)
+    query = urlencode({
+        "expires": expires,
+        "name": filename,
+        "sig": _signature(secret, relative, expires, filename)
+    })
+    return f"{SIGNED_DOWNLOAD_PREFIX}/{quote(relative)}?{query}"
+
+
+def sign_downloads(files: Dict[str, str], filenames: Dict[str, str], **kwargs) -> Dict[str, str]:
+    """Assina vários ficheiros ({tipo: caminho}); omite os que não podem ser assinados"""
+    urls = {}
+    for file_type, file_path in files.items():
+        url = sign_download(file_path, filenames[file_type], **kwargs)
+        if url:
+            urls[file_type] = url
+    return urls
+
+
+def verify_download(path: str, expires: str, filename: str, sig: str,
+                    secret: str = None, now: float = None) -> bool:
+    secret = secret if secret is not None else DOWNLOAD_SIGNING_SECRET
+    if not _usable(secret) or not expires.isdigit():
+        return False
+    if int(expires) < (now if now is not None else time.time()):
+        return False
+    return hmac.compare_digest(_signature(secret, path, int(expires), filename), sig)
+
+
+async def serve_signed(request: Request):
+    path = request.path_params["path"]
+    params = request.query_params
+    if not verify_download(path, params.get("expires", ""), params.get("name", ""), params.get("sig", "")):
+        return JSONResponse({"detail": "Link inválido ou expirado"}, status_code=403)
+
+    file_path = (OUTPUT_ROOT / path).resolve()
+    # A assinatura já fixa o caminho; esta verificação protege contra segredos fracos
+    if OUTPUT_ROOT.resolve() not in file_path.parents:
+        return JSONResponse({"detail": "Link inválido ou expirado"}, status_code=403)
+
+    try:
+        return file_download_response(request, str(file_path), params["name"])
+    except HTTPException as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+
+
+# App mínima: a mesma rota é registada em api.main para instalações de um só
+# processo; em produção corre isolada, fora do processo da API, e sem um
+# segredo válido não arranca
+app = Starlette(routes=[Route(SIGNED_DOWNLOAD_PREFIX + "/{path:path}", serve_signed,
+                              methods=["GET", "HEAD"])],
+                on_startup=[check_signing_secret])
@@ -0,0 +1,233 @@
+"""
+AiparatiExpress API - Limpeza de tasks e ficheiros
+Tarefa de fundo que remove de memória as tasks terminadas cujo prazo de
+retenção (por estado e plano de subscrição) expirou, e apaga ou arquiva
+(gzip) os respetivos uploads e outputs em lotes. Ficheiros órfãos (p.ex.
+de tasks perdidas num reinício) são removidos pela idade, nunca antes da
+retenção mais longa de uma task: podem pertencer a outro worker, cujas tasks
+este não vê. Os ficheiros de tasks na fila offline partilhada não são tocados.
+"""
+
+import os
+import gzip
+import json
+import time
+import shutil
+import asyncio
+import logging
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable, Iterable, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Horas de retenção por estado e plano ("*" = qualquer plano). Estados em curso
+# (uploaded, extracting, analyzing) nunca são removidos.
+DEFAULT_RETENTION_HOURS = {
+    "completed": {"free": 24, "premium": 168, "enterprise": 720, "*": 24},
+    "error": {"*": 24},
+    "cancelled": {"*": 24},
+}
+# JSON com a mesma estrutura, fundido por cima dos valores por omissão
+TASK_RETENTION_JSON = os.getenv('TASK_RETENTION_JSON', '')
+SWEEP_INTERVAL_SECONDS = float(os.getenv('SWEEP_INTERVAL_SECONDS', '300'))
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', '200'))
+# "delete" ou "archive" (gzip para SWEEP_ARCHIVE_DIR)
+SWEEP_FILE_ACTION = os.getenv('SWEEP_FILE_ACTION', 'delete')
+SWEEP_ARCHIVE_DIR = Path(os.getenv('SWEEP_ARCHIVE_DIR', 'outputs/archive'))
+# Por omissão: retenção mais longa de uma task mais ORPHAN_MARGIN_HOURS
+ORPHAN_RETENTION_HOURS = float(os.getenv('ORPHAN_RETENTION_HOURS', '0')) or None
+# Folga para o processamento (upload gravado antes de a task terminar)
+ORPHAN_MARGIN_HOURS = 24
+# Só ficheiros gerados pela API no nível de topo dos diretórios (não caches nem índices)
+ORPHAN_EXTENSIONS = {".pdf", ".xlsx", ".json"}
+
+TASKS_EVICTED = Counter(
+    "autofund_sweeper_tasks_evicted_total", "Tasks removidas por expiração", ["status", "tier"])
+FILES_RECLAIMED = Counter(
+    "autofund_sweeper_files_total", "Ficheiros apagados ou arquivados", ["action", "kind"])
+BYTES_RECLAIMED = Counter(
+    "autofund_sweeper_bytes_reclaimed_total", "Bytes libertados em disco", ["action"])
+SWEEP_DURATION = Histogram(
+    "autofund_sweeper_duration_seconds", "Duração de cada passagem de limpeza")
+LAST_SWEEP = Gauge(
+    "autofund_sweeper_last_run_timestamp_seconds", "Instante da última passagem de limpeza",
+    multiprocess_mode="max")
+
+
+def load_retention(raw: str = TASK_RETENTION_JSON) -> Dict[str, Dict[str, float]]:
+    retention = {status: dict(tiers) for status, tiers in DEFAULT_RETENTION_HOURS.items()}
+    if raw:
+        for status, tiers in json.loads(raw).items():
+            retention.setdefault(status, {}).update(tiers)
+    return retention
+
+
+def task_files(task: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """(tipo, caminho) de todos os ficheiros associados a uma task"""
+    files = [("upload", p) for p in task.get("file_paths") or [task.get("file_path")] if p]
+    if task.get("result"):
+        files += [("output", p) for p in task["result"].get("ficheiros_gerados", {}).values()]
+    return files
+
+
+def archive_target(archive_dir: Path, owner: str, path: str) -> Path:
+    """Destino do arquivo: uma pasta por task (os outputs têm nomes por NIF e
+    instante, repetidos entre tasks); nunca substitui um arquivo existente"""
+    target = archive_dir / owner / (os.path.basename(path) + ".gz")
+    n = 1
+    while target.exists():
+        target = archive_dir / owner / f"{os.path.basename(path)}.{n}.gz"
+        n += 1
+    return target
+
+
+def reclaim_file(path: str, action: str, archive_dir: Path, owner: str = "orphans") -> int:
+    """Apaga ou comprime o ficheiro; retorna os bytes libertados (0 se não existir)
+
+    `owner` é a task do ficheiro e dá nome à pasta do arquivo.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0
+
+    if action == "archive":
+        target = archive_target(archive_dir, owner, path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "rb") as src, gzip.open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        size -= os.path.getsize(target)
+
+    os.remove(path)
+    return max(size, 0)
+
+
+class TaskSweeper:
+    """Remove tasks expiradas e recupera o espaço dos seus ficheiros"""
+
+    def __init__(self, tasks: Dict[str, Dict[str, Any]], evict: Callable[[Dict[str, Any]], None],
+                 retention: Optional[Dict[str, Dict[str, float]]] = None,
+                 action: str = SWEEP_FILE_ACTION, archive_dir: Path = SWEEP_ARCHIVE_DIR,
+                 batch_size: int = SWEEP_BATCH_SIZE,
+                 orphan_dirs: Iterable[Path] = (), orphan_hours: Optional[float] = ORPHAN_RETENTION_HOURS,
+                 held_tasks: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None):
+        if action not in ("delete", "archive"):
+            raise ValueError(f"SWEEP_FILE_ACTION inválida: {action}")
+        self.tasks = tasks
+        self.evict = evict
+        self.retention = retention if retention is not None else load_retention()
+        self.action = action
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.orphan_dirs = [Path(d) for d in orphan_dirs]
+        longest = max((h for tiers in self.retention.values() for h in tiers.values()), default=0)
+        if orphan_hours is None:
+            orphan_hours = longest + ORPHAN_MARGIN_HOURS
+        elif orphan_hours <= longest:
+            logger.warning(f"ORPHAN_RETENTION_HOURS={orphan_hours:g} não excede a retenção mais longa "
+                           f"({longest:g}h): ficheiros de tasks de outros workers podem ser apagados")
+        self.orphan_hours = orphan_hours
+        # Tasks guardadas fora deste worker (fila offline partilhada)
+        self.held_tasks = held_tasks
+
+    def retention_for(self, task: Dict[str, Any]) -> Optional[timedelta]:
+        tiers = self.retention.get(task["status"])
+        if not tiers:
+            return None
+        hours = tiers.get(task.get("subscription_tier", "free"), tiers.get("*"))
+        return timedelta(hours=hours) if hours is not None else None
+
+    def expired(self, now: datetime) -> List[Dict[str, Any]]:
+        result = []
+        for task in list(self.tasks.values()):
+            keep = self.retention_for(task)
+            if keep is not None and task.get("completed_at", task["created_at"]) + keep <= now:
+                result.append(task)
+        return result
+
+    def _reclaim(self, files: List[Tuple[str, str, str]]) -> Tuple[int, int]:
+        """Apaga ou arquiva um lote de (tipo, caminho, task dona ou 'orphans')"""
+        count = reclaimed = 0
+        for kind, path, owner in files:
+            try:
+                freed = reclaim_file(path, self.action, self.archive_dir, owner)
+            except OSError as e:
+                logger.warning(f"Limpeza: não foi possível tratar {path}: {e}")
+                continue
+            if os.path.exists(path):
+                continue
+            count += 1
+            reclaimed += freed
+            FILES_RECLAIMED.labels(action=self.action, kind=kind).inc()
+        BYTES_RECLAIMED.labels(action=self.action).inc(reclaimed)
+        return count, reclaimed
+
+    def _orphans(self, now: float) -> List[Tuple[str, str, str]]:
+        tasks = list(self.tasks.values())
+        if self.held_tasks is not None:
+            try:
+                tasks += list(self.held_tasks())
+            except Exception as e:
+                # Sem saber que tasks estão guardadas não se apaga nenhum órfão
+                logger.warning(f"Limpeza: fila offline indisponível, órfãos ficam para a próxima passagem: {e}")
+                return []
+        referenced = {os.path.abspath(p) for task in tasks for _, p in task_files(task)}
+        cutoff = now - self.orphan_hours * 3600
+        orphans = []
+        for directory in self.orphan_dirs:
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory):
+                if (entry.is_file() and os.path.splitext(entry.name)[1].lower() in ORPHAN_EXTENSIONS
+                        and entry.stat().st_mtime < cutoff
+                        and os.path.abspath(entry.path) not in referenced):
+                    orphans.append(("orphan", entry.path, "orphans"))
+        return orphans
+
+    async def sweep(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Uma passagem completa; o trabalho em disco corre fora do event loop"""
+        started = time.monotonic()
+        now = now or datetime.now()
+        stats = {"tasks": 0, "files": 0, "bytes": 0}
+
+        expired = self.expired(now)
+        for start in range(0, len(expired), self.batch_size):
+            batch = expired[start:start + self.batch_size]
+            files = []
+            for task in batch:
+                # A task pode ter sido apagada pelo utilizador entretanto
+                if self.tasks.get(task["task_id"]) is not task:
+                    continue
+                self.evict(task)
+                files += [(kind, path, task["task_id"]) for kind, path in task_files(task)]
+                stats["tasks"] += 1
+                TASKS_EVICTED.labels(status=task["status"], tier=task.get("subscription_tier", "free")).inc()
+            count, reclaimed = await asyncio.to_thread(self._reclaim, files)
+            stats["files"] += count
+            stats["bytes"] += reclaimed
+
+        if self.orphan_dirs:
+            orphans = await asyncio.to_thread(self._orphans, now.timestamp())
+            for start in range(0, len(orphans), self.batch_size):
+                count, reclaimed = await asyncio.to_thread(
+                    self._reclaim, orphans[start:start + self.batch_size])
+                stats["files"] += count
+                stats["bytes"] += reclaimed
+
+        SWEEP_DURATION.observe(time.monotonic() - started)
+        LAST_SWEEP.set(time.time())
+        if stats["tasks"] or stats["files"]:
+            logger.info(f"Limpeza: {stats['tasks']} tasks, {stats['files']} ficheiros, "
+                        f"{stats['bytes'] / 1024:.0f}KB libertados")
+        return stats
+
+    async def run(self, interval: float = SWEEP_INTERVAL_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Erro na limpeza de tasks: {e}")
@@ -0,0 +1,116 @@
+"""
+AiparatiExpress API - Índice de tasks por utilizador
+Índice secundário user_id → tasks ordenadas por (created_at, task_id), com
+contadores por estado, para listar e paginar as tasks de um utilizador sem
+percorrer as de todos os outros.
+"""
+
+import json
+import base64
+import bisect
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Iterable
+
+IndexKey = Tuple[float, str]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(key: IndexKey) -> str:
+    raw = json.dumps([key[0], key[1]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> IndexKey:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, task_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(ts), str(task_id)
+    except Exception:
+        raise InvalidCursor("Cursor inválido")
+
+
+class TaskIndex:
+    """Tasks de cada utilizador por ordem de criação e contagem por estado"""
+
+    def __init__(self):
+        self._keys: Dict[str, List[IndexKey]] = defaultdict(list)
+        self._status: Dict[str, str] = {}
+        self._counts: Dict[str, Counter] = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(task: dict) -> IndexKey:
+        created_at: datetime = task["created_at"]
+        return created_at.timestamp(), task["task_id"]
+
+    def add(self, task: dict):
+        with self._lock:
+            keys = self._keys[task["user_id"]]
+            key = self._key(task)
+            # Tasks chegam quase sempre por ordem: append em vez de insort
+            if not keys or keys[-1] <= key:
+                keys.append(key)
+            else:
+                bisect.insort(keys, key)
+            self._status[task["task_id"]] = task["status"]
+            self._counts[task["user_id"]][task["status"]] += 1
+
+    def remove(self, task: dict):
+        with self._lock:
+            keys = self._keys.get(task["user_id"])
+            status = self._status.pop(task["task_id"], None)
+            if keys is None or status is None:
+                return
+            key = self._key(task)
+            pos = bisect.bisect_left(keys, key)
+            if pos < len(keys) and keys[pos] == key:
+                del keys[pos]
+            self._counts[task["user_id"]][status] -= 1
+            if not keys:
+                del self._keys[task["user_id"]]
+                del self._counts[task["user_id"]]
+
+    def set_status(self, task: dict, status: str):
+        with self._lock:
+            previous = self._status.get(task["task_id"])
+            if previous is not None and previous != status:
+                counts = self._counts[task["user_id"]]
+                counts[previous] -= 1
+                counts[status] += 1
+                self._status[task["task_id"]] = status
+
+    def count(self, user_id: str, statuses: Optional[Iterable[str]] = None) -> int:
+        with self._lock:
+            counts = self._counts.get(user_id)
+            if counts is None:
+                return 0
+            if statuses is None:
+                return sum(counts.values())
+            return sum(counts[s] for s in set(statuses))
+
+    def page(self, user_id: str, limit: int, cursor: Optional[str] = None,
+             statuses: Optional[Iterable[str]] = None) -> Tuple[List[str], Optional[str]]:
+        """IDs das tasks mais recentes primeiro, a seguir ao cursor; retorna (ids, próximo cursor)"""
+        wanted = set(statuses) if statuses is not None else None
+        with self._lock:
+            keys = self._keys.get(user_id, [])
+            end = len(keys)
+            if cursor:
+                end = bisect.bisect_left(keys, decode_cursor(cursor))
+
+            task_ids: List[str] = []
+            pos = end - 1
+            while pos >= 0 and len(task_ids) < limit:
+                task_id = keys[pos][1]
+                if wanted is None or self._status.get(task_id) in wanted:
+                    task_ids.append(task_id)
+                pos -= 1
+
+            # Há página seguinte se restam chaves antes da última devolvida
+            next_cursor = encode_cursor(keys[pos + 1]) if task_ids and pos >= 0 else None
+        return task_ids, next_cursor
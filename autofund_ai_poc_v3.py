@@ -10,8 +10,13 @@ Correções implementadas:
 """
 
 import os
+import io
 import json
+import time
+import hashlib
 import logging
+import threading
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from typing import Optional, Dict, Any, List, Tuple
 from dataclasses import dataclass
@@ -29,6 +34,16 @@ from openpyxl.utils import get_column_letter
 from openpyxl.utils.cell import column_index_from_string
 from dotenv import load_dotenv
 
+from risk_rules import get_rule_set, RiskAssessment
+from analytics_store import get_store as get_analytics_store
+from sector_benchmark import get_benchmark
+from single_flight import SingleFlight, SingleFlightTimeout
+from cancellation import CancelToken, TaskCancelled
+from latency_budget import LatencyBudget, BudgetExceeded, MIN_CALL_TIMEOUT, request_options
+from hedging import HedgePolicy, HEDGING_ENABLED
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from adaptive_limiter import AdaptiveLimiter, ConcurrencyLimitExceeded
+
 # Configuração de logging
 logging.basicConfig(
     level=logging.INFO,
@@ -49,6 +64,33 @@ IES_PDF_PATH = "IES - 2023.pdf"
 TEMPLATE_PATH = "template_iapmei.xlsx"
 OUTPUT_DIR = Path("outputs")
 OUTPUT_DIR.mkdir(exist_ok=True)
+EXTRACTION_CACHE_DIR = Path(os.getenv('EXTRACTION_CACHE_DIR', str(OUTPUT_DIR / "cache" / "extracoes")))
+ANALYSIS_CACHE_DIR = Path(os.getenv('ANALYSIS_CACHE_DIR', str(OUTPUT_DIR / "cache" / "analises")))
+# Respostas de análise só servem a entrega aos pedidos concorrentes (single-flight entre workers)
+ANALYSIS_CACHE_TTL = float(os.getenv('ANALYSIS_CACHE_TTL', '900'))
+
+# Extrações (por hash do PDF) e análises (por hash do input) idênticas em
+# simultâneo partilham uma única chamada ao modelo, também entre workers
+EXTRACTION_FLIGHT = SingleFlight("extracao", lock_dir=EXTRACTION_CACHE_DIR / "locks")
+ANALYSIS_FLIGHT = SingleFlight("analise", lock_dir=ANALYSIS_CACHE_DIR / "locks")
+
+# Cauda de latência da extração: pedido duplicado após o p90 (EXTRACTION_HEDGING=true)
+EXTRACTION_HEDGE = HedgePolicy("extracao") if HEDGING_ENABLED else None
+
+# Circuito partilhado pela extração e pela análise (circuit_breaker.py)
+MODEL_BREAKER = CircuitBreaker("anthropic")
+# Concorrência das chamadas ao modelo ajustada por AIMD (adaptive_limiter.py)
+MODEL_LIMITER = AdaptiveLimiter()
+
+# Indicadores usados na análise plurianual
+TREND_FIELDS = [
+    "volume_negocios", "ebitda", "resultado_liquido", "total_ativo",
+    "capital_proprio", "total_passivo", "custos_pessoal"
+]
+
+# Modelos
+EXTRACTION_MODEL = "claude-3-5-sonnet-20241022"
+ANALYSIS_MODEL = "claude-opus-4-20250514"
 
 # Cores para formatação Excel
 COLOR_RED = "FFFF0000"
@@ -143,6 +185,12 @@ class AnaliseFinanceira(BaseModel):
 
     # Classificação de risco
     nivel_risco: str = Field(..., description="BAIXO | MÉDIO | ALTO | CRÍTICO")
+    pontuacao_risco: Optional[float] = Field(None, description="Pontuação total das regras de risco")
+    contribuicoes_risco: Dict[str, float] = Field(default_factory=dict, description="Pontos atribuídos por regra")
+    conjunto_regras: Optional[str] = Field(None, description="Conjunto de regras de risco aplicado")
+
+    # Comparação com empresas da mesma divisão CAE e dimensão
+    benchmark_setorial: Optional[Dict[str, Any]] = Field(None, description="Percentis dos rácios face aos pares")
 
     # Análise qualitativa
     pontos_fortes: List[str] = Field(default_factory=list)
@@ -156,32 +204,176 @@ class AnaliseFinanceira(BaseModel):
         extra = "forbid"
 
 
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash SHA-256 do conteúdo de um ficheiro"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_model_failure(error: BaseException) -> bool:
+    """Erros que indicam degradação da API (e não do pedido em si)"""
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def is_unavailable(error: BaseException) -> bool:
+    """A API não pode atender o pedido agora (falha do lado da API ou sem vaga no limitador)"""
+    return is_model_failure(error) or isinstance(error, ConcurrencyLimitExceeded)
+
+
+def model_call(fn, cancel_token: Optional[CancelToken] = None, operation: Optional[str] = None,
+               timeout: Optional[float] = None):
+    """Chamada à API do modelo através de MODEL_BREAKER e, com `operation`, de MODEL_LIMITER
+
+    A espera por vaga no limitador fica limitada a `timeout` (o tempo da etapa)
+    e termina com o cancelamento. Pedidos abortados por cancelamento não
+    contam como falhas da API. Os clientes de create_client() não repetem
+    pedidos, pelo que cada 429/529 chega logo ao limitador.
+    """
+    call = (lambda: MODEL_LIMITER.run(operation, fn, timeout, cancel_token)) if operation else fn
+    return MODEL_BREAKER.call(
+        call, lambda e: is_model_failure(e) and not (cancel_token is not None and cancel_token.cancelled)
+    )
+
+
+def create_client(api_key: str) -> anthropic.Anthropic:
+    """Cliente do SDK sem retries automáticos
+
+    Os retries internos (2 por omissão, com backoff) multiplicavam o tempo de
+    cada etapa para lá do LatencyBudget e escondiam os 429/529 de
+    MODEL_LIMITER e de MODEL_BREAKER; quem decide repetir é a fila offline.
+    """
+    base_url = os.getenv('ANTHROPIC_BASE_URL')
+    auth_token = os.getenv('ANTHROPIC_AUTH_TOKEN')
+
+    # Check if we're using a custom proxy/API gateway
+    if base_url and auth_token:
+        return anthropic.Anthropic(api_key=auth_token, base_url=base_url, max_retries=0)
+    return anthropic.Anthropic(api_key=api_key, max_retries=0)
+
+
+class ExtractionCache:
+    """Cache em disco das extrações por IES, indexada pelo hash do PDF"""
+
+    def __init__(self, cache_dir: Path = EXTRACTION_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, pdf_hash: str) -> Path:
+        return self.cache_dir / f"{pdf_hash}.json"
+
+    def get(self, pdf_hash: str) -> Optional[Dict[str, Any]]:
+        path = self._path(pdf_hash)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Cache de extração ilegível ({path}): {e}")
+            return None
+
+    def put(self, pdf_hash: str, raw_data: Dict[str, Any]):
+        # Escrita atómica para não expor ficheiros parciais a outros workers
+        path = self._path(pdf_hash)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(raw_data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class AnalysisCache(ExtractionCache):
+    """Resposta de análise partilhada entre workers, indexada pelo hash do input enviado ao modelo
+
+    É o canal pelo qual o single-flight entrega a análise a pedidos idênticos
+    noutro worker (que esperam pelo lock e depois leem daqui); não é uma cache
+    de longa duração: entradas com mais de `ttl` segundos são ignoradas e
+    removidas.
+    """
+
+    def __init__(self, cache_dir: Path = ANALYSIS_CACHE_DIR, ttl: float = ANALYSIS_CACHE_TTL):
+        super().__init__(cache_dir)
+        self.ttl = ttl
+
+    def _expired(self, path: Path) -> bool:
+        try:
+            return time.time() - path.stat().st_mtime > self.ttl
+        except FileNotFoundError:
+            return False
+
+    def get(self, analysis_key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(analysis_key)
+        if self._expired(path):
+            path.unlink(missing_ok=True)
+            return None
+        return super().get(analysis_key)
+
+    def put(self, analysis_key: str, analysis_data: Dict[str, Any]):
+        super().put(analysis_key, analysis_data)
+        # Entradas que ninguém voltou a pedir também não ficam no disco
+        for path in self.cache_dir.glob("*.json"):
+            if self._expired(path):
+                path.unlink(missing_ok=True)
+
+
 class DataExtractor:
     """Classe responsável pela extração de dados do PDF IES usando Claude 3.5 Sonnet"""
 
-    def __init__(self, api_key: str):
-        # Handle custom base URL if configured
-        base_url = os.getenv('ANTHROPIC_BASE_URL')
-        auth_token = os.getenv('ANTHROPIC_AUTH_TOKEN')
-
-        # Check if we're using a custom proxy/API gateway
-        if base_url and auth_token:
-            self.client = anthropic.Anthropic(
-                api_key=auth_token,
-                base_url=base_url
-            )
-        else:
-            self.client = anthropic.Anthropic(api_key=api_key)
+    def __init__(self, api_key: str, hedging: Optional[HedgePolicy] = None,
+                 cancel_token: Optional[CancelToken] = None):
+        self.cancel_token = cancel_token or CancelToken()
+        self.client = create_client(api_key)
         self.file_id = None  # Initialize file ID
+        self.hedging = hedging if hedging is not None else EXTRACTION_HEDGE
+        # Clientes das tentativas com hedging (cada uma com a sua ligação, para poder ser abortada)
+        self._attempt_clients = set()
+        self._attempt_lock = threading.Lock()
+
+    def close(self):
+        """Fecha os clientes, abortando pedidos em curso"""
+        self.client.close()
+        with self._attempt_lock:
+            clients, self._attempt_clients = self._attempt_clients, set()
+        for client in clients:
+            client.close()
+
+    def _close_attempt(self, client):
+        with self._attempt_lock:
+            self._attempt_clients.discard(client)
+        client.close()
+
+    def _extraction_attempt(self, request: Dict[str, Any], timeout: Optional[float]):
+        client = self.client.copy(http_client=anthropic.DefaultHttpxClient())
+        with self._attempt_lock:
+            self._attempt_clients.add(client)
+
+        def call():
+            try:
+                # Cada tentativa ocupa a sua vaga no limitador
+                return MODEL_LIMITER.run(
+                    "extracao", lambda: client.beta.messages.create(**request, **request_options(timeout)),
+                    timeout, self.cancel_token
+                )
+            finally:
+                self._close_attempt(client)
 
-    def upload_pdf(self, pdf_path: str) -> str:
+        return call, lambda: self._close_attempt(client)
+
+    def upload_pdf(self, pdf_path: str, timeout: Optional[float] = None) -> str:
         """Faz upload do PDF IES para a Anthropic Files API"""
         try:
             with open(pdf_path, "rb") as f:
-                response = self.client.beta.files.upload(
+                response = model_call(lambda: self.client.beta.files.upload(
                     file=(os.path.basename(pdf_path), f, "application/pdf"),
-                    purpose="assistants"
-                )
+                    purpose="assistants",
+                    **request_options(timeout)
+                ), self.cancel_token, "upload", timeout)
             self.file_id = response.id
             logger.info(f"PDF uploaded com file_id: {self.file_id}")
             return self.file_id
@@ -189,7 +381,7 @@ class DataExtractor:
             logger.error(f"Erro ao fazer upload do PDF: {str(e)}")
             raise
 
-    def extract_financial_data(self) -> Dict[str, Any]:
+    def extract_financial_data(self, timeout: Optional[float] = None) -> Dict[str, Any]:
         """Extrai dados financeiros estruturados do IES"""
         if not self.file_id:
             raise ValueError("PDF não foi uploaded")
@@ -261,8 +453,8 @@ class DataExtractor:
         """
 
         try:
-            message = self.client.beta.messages.create(
-                model="claude-3-5-sonnet-20241022",
+            request = dict(
+                model=EXTRACTION_MODEL,
                 max_tokens=4000,
                 messages=[
                     {
@@ -284,6 +476,16 @@ class DataExtractor:
                 ],
                 betas=["pdf-to-structured-json-2024-04-01"],
             )
+            if self.hedging is not None:
+                message = model_call(
+                    lambda: self.hedging.run(lambda: self._extraction_attempt(request, timeout)),
+                    self.cancel_token
+                )
+            else:
+                message = model_call(
+                    lambda: self.client.beta.messages.create(**request, **request_options(timeout)),
+                    self.cancel_token, "extracao", timeout
+                )
 
             # Parse do JSON
             json_str = message.content[0].text
@@ -306,19 +508,15 @@ class DataExtractor:
 class FinancialAnalyzer:
     """Classe para análise financeira e geração de insights usando Claude Opus 4.5"""
 
-    def __init__(self, api_key: str):
-        # Handle custom base URL if configured
-        base_url = os.getenv('ANTHROPIC_BASE_URL')
-        auth_token = os.getenv('ANTHROPIC_AUTH_TOKEN')
-
-        # Check if we're using a custom proxy/API gateway
-        if base_url and auth_token:
-            self.client = anthropic.Anthropic(
-                api_key=auth_token,
-                base_url=base_url
-            )
-        else:
-            self.client = anthropic.Anthropic(api_key=api_key)
+    def __init__(self, api_key: str, rule_set: Optional[str] = None,
+                 cancel_token: Optional[CancelToken] = None):
+        self.cancel_token = cancel_token or CancelToken()
+        # Regras de risco compiladas (RISK_RULE_SET / RISK_RULES_DIR)
+        self.risk_rules = get_rule_set(rule_set)
+        # Percentis setoriais pré-calculados (None até existir índice)
+        self.benchmark = get_benchmark()
+        self.analysis_cache = AnalysisCache()
+        self.client = create_client(api_key)
 
     def calculate_ratios(self, data: ExtracoesFinanceiras) -> Dict[str, float]:
         """Calcula rácios financeiros"""
@@ -341,50 +539,86 @@ class FinancialAnalyzer:
 
         return ratios
 
+    def calculate_trends(self, series: List[ExtracoesFinanceiras]) -> Dict[str, Any]:
+        """Calcula crescimento e tendências de uma série plurianual (ordenada por período)"""
+        df = pd.DataFrame(
+            [{"periodo": d.periodo, **{f: getattr(d, f) for f in TREND_FIELDS},
+              "ativo_corrente": d.ativo_corrente, "passivo_corrente": d.passivo_corrente}
+             for d in series]
+        ).set_index("periodo").astype(float)
+
+        # Rácios por ano, calculados em bloco (0 quando o denominador é nulo)
+        def safe_div(num, den):
+            return (num / den.where(den > 0)).fillna(0.0)
+
+        df["autonomia_financeira"] = safe_div(df["capital_proprio"], df["total_ativo"])
+        df["liquidez_geral"] = safe_div(df["ativo_corrente"], df["passivo_corrente"])
+        df["margem_ebitda"] = safe_div(df["ebitda"], df["volume_negocios"])
+        df["rentabilidade_ativos"] = safe_div(df["resultado_liquido"], df["total_ativo"])
+        df = df.drop(columns=["ativo_corrente", "passivo_corrente"])
+
+        # Crescimento anual relativo ao valor absoluto do ano anterior
+        # (evita sinais invertidos quando o ano anterior é negativo)
+        previous = df[TREND_FIELDS].shift(1)
+        growth = (df[TREND_FIELDS] - previous) / previous.abs().where(previous != 0)
+
+        n_years = len(df)
+        first, last = df[TREND_FIELDS].iloc[0], df[TREND_FIELDS].iloc[-1]
+        valid = (first > 0) & (last > 0)
+        cagr = ((last / first.where(valid)) ** (1 / max(n_years - 1, 1)) - 1)
+
+        # Declive da regressão linear por indicador, normalizado pela média
+        x = np.arange(n_years, dtype=float)
+        values = df.to_numpy(dtype=float)
+        if n_years > 1:
+            slopes = np.polyfit(x, values, 1)[0]
+        else:
+            slopes = np.zeros(values.shape[1])
+        scale = np.abs(values).mean(axis=0)
+        rel_slopes = np.divide(slopes, scale, out=np.zeros_like(slopes), where=scale > 0)
+        tendencia = np.where(rel_slopes > 0.02, "crescente",
+                             np.where(rel_slopes < -0.02, "decrescente", "estável"))
+
+        def clean(frame_or_series):
+            return json.loads(frame_or_series.replace([np.inf, -np.inf], np.nan).to_json())
+
+        return {
+            "anos": list(df.index),
+            "indicadores": clean(df),
+            "crescimento_anual": clean(growth.iloc[1:]),
+            "cagr": clean(cagr),
+            "tendencia": dict(zip(df.columns, tendencia.tolist()))
+        }
+
+    def compare_with_peers(self, data: ExtracoesFinanceiras, ratios: Dict[str, float]) -> Optional[Dict[str, Any]]:
+        """Percentis dos rácios face a empresas da mesma divisão CAE e dimensão"""
+        if self.benchmark is None:
+            return None
+        return self.benchmark.compare(data.cae, data.volume_negocios, ratios)
+
+    def assess_risk(self, ratios: Dict[str, float]) -> RiskAssessment:
+        """Avalia o risco com o conjunto de regras ativo, incluindo contribuições por regra"""
+        return self.risk_rules.score(ratios)
+
     def assess_risk_level(self, ratios: Dict[str, float]) -> str:
         """Classifica o nível de risco da empresa"""
-        risk_score = 0
-
-        # Autonomia Financeira (< 20% = risco)
-        if ratios['autonomia_financeira'] < 0.20:
-            risk_score += 3
-        elif ratios['autonomia_financeira'] < 0.30:
-            risk_score += 2
-        elif ratios['autonomia_financeira'] < 0.40:
-            risk_score += 1
-
-        # Liquidez (< 1 = risco)
-        if ratios['liquidez_geral'] < 1:
-            risk_score += 3
-        elif ratios['liquidez_geral'] < 1.5:
-            risk_score += 1
-
-        # Margem EBITDA (< 5% = risco)
-        if ratios['margem_ebitda'] < 0.05:
-            risk_score += 2
-        elif ratios['margem_ebitda'] < 0.10:
-            risk_score += 1
-
-        # Rentabilidade negativa
-        if ratios['rentabilidade_ativos'] < 0:
-            risk_score += 3
-
-        # Classificação final
-        if risk_score >= 7:
-            return "CRÍTICO"
-        elif risk_score >= 5:
-            return "ALTO"
-        elif risk_score >= 3:
-            return "MÉDIO"
-        else:
-            return "BAIXO"
+        return self.assess_risk(ratios).nivel_risco
+
+    def generate_analysis(self, data: ExtracoesFinanceiras, context: str = "",
+                          trends: Optional[Dict[str, Any]] = None,
+                          budget: Optional[LatencyBudget] = None) -> AnaliseFinanceira:
+        """Gera análise completa usando Claude Opus 4.5
 
-    def generate_analysis(self, data: ExtracoesFinanceiras, context: str = "") -> AnaliseFinanceira:
-        """Gera análise completa usando Claude Opus 4.5"""
+        Com `trends` (ver calculate_trends) a mesma chamada cobre a série plurianual.
+        Com `budget` o pedido ao modelo tem o timeout da etapa e, esgotado o
+        orçamento, a análise determinística substitui a do modelo.
+        """
 
         # Calcular rácios primeiro
         ratios = self.calculate_ratios(data)
-        risk_level = self.assess_risk_level(ratios)
+        risk = self.assess_risk(ratios)
+        risk_level = risk.nivel_risco
+        peers = self.compare_with_peers(data, ratios)
 
         # Preparar dados para o Opus
         financial_summary = {
@@ -398,8 +632,13 @@ class FinancialAnalyzer:
             "capital_proprio": data.capital_proprio,
             "contabilidade_valida": data._contabilidade_bate,
             "ratios": ratios,
-            "risco": risk_level
+            "risco": risk_level,
+            "contribuicoes_risco": risk.contribuicoes
         }
+        if trends:
+            financial_summary["evolucao_plurianual"] = trends
+        if peers:
+            financial_summary["benchmark_setorial"] = peers
 
         system_prompt = """
         És um consultor financeiro sénior especializado em candidaturas ao Portugal 2030/IAPMEI.
@@ -431,6 +670,8 @@ class FinancialAnalyzer:
         2. Se a Autonomia Financeira for baixa (<30%), sugere capitalização ou conversão de suprimentos
         3. Se a Liquidez for <1.5, alerta para risco de solvabilidade a curto prazo
         4. Se o EBITDA for positivo mas RL negativo, explica impacto de custos não recorrentes
+        5. Se existir evolução plurianual, comenta o crescimento e as tendências dos indicadores
+        6. Se existir benchmark setorial, compara com os pares usando apenas os percentis fornecidos
 
         A Memória Descritiva deve:
         - Começar com enquadramento positivo
@@ -448,23 +689,20 @@ class FinancialAnalyzer:
         """
 
         try:
-            response = self.client.messages.create(
-                model="claude-opus-4-20250514",
-                max_tokens=4000,
-                system=system_prompt,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": user_prompt
-                    }
-                ],
-                temperature=0.3  # Mais consistente para análises
-            )
-
-            # Parse da resposta
-            analysis_text = response.content[0].text
-            analysis_text = re.sub(r'```json\n?|\n?```', '', analysis_text).strip()
-            analysis_data = json.loads(analysis_text)
+            analysis_key = hashlib.sha256(
+                json.dumps([ANALYSIS_MODEL, system_prompt, user_prompt]).encode()
+            ).hexdigest()
+            analysis_data = self.analysis_cache.get(analysis_key)
+            if analysis_data is None:
+                timeout = budget.stage_timeout("analise") if budget is not None else None
+                if timeout is not None and timeout < MIN_CALL_TIMEOUT:
+                    raise BudgetExceeded("analise")
+                # A espera por uma análise em curso (ou pelo lock) também gasta o orçamento
+                analysis_data = ANALYSIS_FLIGHT.do(
+                    analysis_key,
+                    lambda: self._request_analysis(analysis_key, system_prompt, user_prompt, timeout),
+                    timeout=timeout, cancel_token=self.cancel_token
+                )
 
             # Criar objeto AnaliseFinanceira
             return AnaliseFinanceira(
@@ -474,20 +712,67 @@ class FinancialAnalyzer:
                 rentabilidade_ativos=ratios['rentabilidade_ativos'],
                 endividamento=ratios['endividamento'],
                 nivel_risco=risk_level,
+                pontuacao_risco=risk.pontuacao,
+                contribuicoes_risco=risk.contribuicoes,
+                conjunto_regras=risk.conjunto_regras,
+                benchmark_setorial=peers,
                 pontos_fortes=analysis_data.get('pontos_fortes', []),
                 pontos_fracos=analysis_data.get('pontos_fracos', []),
                 recomendacoes=analysis_data.get('recomendacoes', []),
                 memoria_descritiva=analysis_data.get('memoria_descritiva', '')
             )
 
+        except TaskCancelled:
+            raise
         except Exception as e:
+            if budget is not None and isinstance(e, (BudgetExceeded, SingleFlightTimeout,
+                                                     anthropic.APITimeoutError)):
+                budget.mark_exceeded("analise")
             logger.error(f"Erro na análise Opus: {str(e)}")
             # Fallback para análise básica
-            return self._generate_fallback_analysis(data, ratios, risk_level)
+            return self._generate_fallback_analysis(data, ratios, risk, peers)
 
-    def _generate_fallback_analysis(self, data: ExtracoesFinanceiras, ratios: Dict[str, float], risk_level: str) -> AnaliseFinanceira:
+    def _request_analysis(self, analysis_key: str, system_prompt: str, user_prompt: str,
+                          timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Pede a análise ao modelo (executado uma vez por input, ver ANALYSIS_FLIGHT)"""
+        # Outro worker pode ter concluído a mesma análise enquanto esperávamos pelo lock
+        cached = self.analysis_cache.get(analysis_key)
+        if cached is not None:
+            return cached
+
+        try:
+            response = model_call(lambda: self.client.messages.create(
+                model=ANALYSIS_MODEL,
+                max_tokens=4000,
+                system=system_prompt,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": user_prompt
+                    }
+                ],
+                temperature=0.3,  # Mais consistente para análises
+                **request_options(timeout)
+            ), self.cancel_token, "analise", timeout)
+        except Exception:
+            # Pedido abortado pelo cancelamento (cliente fechado)
+            self.cancel_token.check("análise")
+            raise
+
+        # Parse da resposta
+        analysis_text = response.content[0].text
+        analysis_text = re.sub(r'```json\n?|\n?```', '', analysis_text).strip()
+        analysis_data = json.loads(analysis_text)
+
+        self.analysis_cache.put(analysis_key, analysis_data)
+        return analysis_data
+
+    def _generate_fallback_analysis(self, data: ExtracoesFinanceiras, ratios: Dict[str, float], risk: RiskAssessment,
+                                    peers: Optional[Dict[str, Any]] = None) -> AnaliseFinanceira:
         """Gera análise básica sem depender do Opus"""
 
+        risk_level = risk.nivel_risco
+
         pontos_fracos = []
         recomendacoes = []
 
@@ -523,6 +808,10 @@ class FinancialAnalyzer:
             rentabilidade_ativos=ratios['rentabilidade_ativos'],
             endividamento=ratios['endividamento'],
             nivel_risco=risk_level,
+            pontuacao_risco=risk.pontuacao,
+            contribuicoes_risco=risk.contribuicoes,
+            conjunto_regras=risk.conjunto_regras,
+            benchmark_setorial=peers,
             pontos_fortes=[f"Volume de negócios: €{data.volume_negocios:,.2f}"],
             pontos_fracos=pontos_fracos,
             recomendacoes=recomendacoes,
@@ -530,6 +819,12 @@ class FinancialAnalyzer:
         )
 
 
+# Template Excel em memória e posições das labels, por (caminho, mtime):
+# evita reler o ficheiro e varrer todas as células a cada preenchimento
+_template_cache: Dict[Tuple[str, int], Dict[str, Any]] = {}
+_template_cache_lock = threading.Lock()
+
+
 class ExcelGenerator:
     """Classe para preenchimento do template Excel IAPMEI"""
 
@@ -589,13 +884,42 @@ class ExcelGenerator:
                 return True
         return False
 
+    def _cached_template(self) -> Dict[str, Any]:
+        """Bytes do template e cache de posições, recarregados se o ficheiro mudar"""
+        key = (os.path.abspath(self.template_path), os.stat(self.template_path).st_mtime_ns)
+        with _template_cache_lock:
+            entry = _template_cache.get(key)
+            if entry is None:
+                with open(self.template_path, "rb") as f:
+                    entry = {"bytes": f.read(), "positions": None}
+                _template_cache.clear()  # só a versão atual do template interessa
+                _template_cache[key] = entry
+        return entry
+
+    def _resolve_positions(self, ws) -> Dict[str, Optional[Tuple[int, int]]]:
+        """Posição alvo de cada label, calculada no template antes de qualquer escrita"""
+        return {
+            label: self.find_cell_by_label(ws, label)
+            for labels in self.field_mappings.values()
+            for label in labels
+        }
+
+    def load_template(self):
+        """Carrega o template (da cache em memória) e as posições das labels"""
+        entry = self._cached_template()
+        wb = load_workbook(io.BytesIO(entry["bytes"]))
+        if entry["positions"] is None and wb.worksheets:
+            entry["positions"] = self._resolve_positions(wb.worksheets[0])
+        return wb, entry["positions"]
+
     def fill_template(self, data: ExtracoesFinanceiras, analysis: AnaliseFinanceira, output_path: str):
         """Preenche o template Excel com dados extraídos e análise"""
 
         try:
             # Carregar ou criar template
+            positions = None
             if os.path.exists(self.template_path):
-                wb = load_workbook(self.template_path)
+                wb, positions = self.load_template()
             else:
                 logger.warning(f"Template não encontrado em {self.template_path}. Criando novo.")
                 wb = Workbook()
@@ -612,6 +936,9 @@ class ExcelGenerator:
             else:
                 ws = wb.worksheets[0]
 
+            if positions is None:
+                positions = self._resolve_positions(ws)
+
             # Preparar dados para preencher
             all_data = {
                 **data.model_dump(),
@@ -631,7 +958,7 @@ class ExcelGenerator:
 
                     # Tentar encontrar célula para cada label possível
                     for label in labels:
-                        cell_pos = self.find_cell_by_label(ws, label)
+                        cell_pos = positions.get(label)
                         if cell_pos:
                             row, col = cell_pos
                             target_cell = ws.cell(row=row, column=col)
@@ -722,75 +1049,245 @@ class ExcelGenerator:
 class AutoFundAI:
     """Classe principal orquestradora do pipeline"""
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, rule_set: Optional[str] = None, render_pool=None,
+                 cancel_token: Optional[CancelToken] = None,
+                 latency_budget: Optional[LatencyBudget] = None, task_id: Optional[str] = None):
         self.api_key = api_key
-        self.extractor = DataExtractor(api_key)
-        self.analyzer = FinancialAnalyzer(api_key)
+        # Task da API que originou o processamento (registada no armazém analítico)
+        self.task_id = task_id
+        self.cancel_token = cancel_token or CancelToken()
+        # Prazo da task (latency_budget.py); None = sem limite além do do cliente
+        self.latency_budget = latency_budget
+        self.extractor = DataExtractor(api_key, cancel_token=self.cancel_token)
+        self.analyzer = FinancialAnalyzer(api_key, rule_set, self.cancel_token)
+        # Cancelar fecha os clientes desta task: o pedido em curso ao modelo é abortado
+        self.cancel_token.on_cancel(self._abort_requests)
         self.excel_generator = ExcelGenerator(TEMPLATE_PATH)
+        # ExcelRenderPool opcional (excel_pool.py): renderização em processos separados
+        self.render_pool = render_pool
+        self.extraction_cache = ExtractionCache()
+        self.analytics_store = get_analytics_store()
 
-    def process_ies(self, pdf_path: str, context: str = "") -> Dict[str, Any]:
-        """Pipeline completo de processamento do IES"""
+    def _abort_requests(self):
+        self.extractor.close()
+        self.analyzer.client.close()
 
-        results = {}
+    def _call_timeout(self, stage: str) -> Optional[float]:
+        """Timeout de uma etapa sem alternativa: nunca abaixo do mínimo útil"""
+        if self.latency_budget is None:
+            return None
+        return max(self.latency_budget.stage_timeout(stage), MIN_CALL_TIMEOUT)
+
+    def extract(self, pdf_path: str, pdf_hash: Optional[str] = None) -> ExtracoesFinanceiras:
+        """Upload, extração e validação de um IES, reutilizando extrações em cache
+
+        `pdf_hash` vem da ingestão do upload e evita reler o PDF só para o hash.
+        """
+        self.cancel_token.check("extração")
+        if pdf_hash is None:
+            pdf_hash = file_sha256(pdf_path)
+        raw_data = self.extraction_cache.get(pdf_hash)
+
+        if raw_data is not None:
+            logger.info(f"Extração em cache para {os.path.basename(pdf_path)} ({pdf_hash[:12]})")
+        else:
+            # A espera por uma extração em curso (ou pelo lock) conta no tempo de upload e extração
+            wait = self.latency_budget.stage_timeout("upload", "extracao") if self.latency_budget else None
+            try:
+                raw_data = EXTRACTION_FLIGHT.do(
+                    pdf_hash, lambda: self._extract_raw(pdf_path, pdf_hash),
+                    timeout=wait, cancel_token=self.cancel_token
+                )
+            except SingleFlightTimeout as e:
+                if self.latency_budget is None:
+                    raise
+                self.latency_budget.mark_exceeded("extracao")
+                raise BudgetExceeded("extracao") from e
+
+        # 3. Validar com Pydantic
+        logger.info("Validando dados extraídos...")
+        financial_data = ExtracoesFinanceiras(**raw_data)
+        logger.info(f"Validação: Contabilidade bate? {financial_data._contabilidade_bate}")
+        return financial_data
+
+    def _extract_raw(self, pdf_path: str, pdf_hash: str) -> Dict[str, Any]:
+        """Upload e extração pelo modelo (executado uma vez por PDF, ver EXTRACTION_FLIGHT)"""
+        # Outro worker pode ter concluído a mesma extração enquanto esperávamos pelo lock
+        raw_data = self.extraction_cache.get(pdf_hash)
+        if raw_data is not None:
+            return raw_data
 
         try:
             # 1. Upload e extração
             logger.info("Iniciando upload e extração do IES...")
-            file_id = self.extractor.upload_pdf(pdf_path)
+            stage = "upload"
+            self.extractor.upload_pdf(pdf_path, timeout=self._call_timeout(stage))
+            self.cancel_token.check("extração")
 
             # 2. Extrair dados financeiros
             logger.info("Extraindo dados financeiros...")
-            raw_data = self.extractor.extract_financial_data()
+            stage = "extracao"
+            raw_data = self.extractor.extract_financial_data(timeout=self._call_timeout(stage))
+        except Exception as e:
+            # Pedido abortado pelo cancelamento (cliente fechado)
+            self.cancel_token.check("extração")
+            if self.latency_budget is not None and isinstance(e, anthropic.APITimeoutError):
+                # Sem dados extraídos não há alternativa: a task falha com o motivo
+                self.latency_budget.mark_exceeded(stage)
+                raise BudgetExceeded(stage) from e
+            raise
 
-            # 3. Validar com Pydantic
-            logger.info("Validando dados extraídos...")
-            financial_data = ExtracoesFinanceiras(**raw_data)
-            logger.info(f"Validação: Contabilidade bate? {financial_data._contabilidade_bate}")
+        # Só guarda em cache extrações que passam a validação
+        ExtracoesFinanceiras(**raw_data)
+        self.extraction_cache.put(pdf_hash, raw_data)
+        return raw_data
+
+    def _render_outputs(self, financial_data: ExtracoesFinanceiras, analysis: AnaliseFinanceira,
+                        extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Gera Excel e relatório JSON e retorna o relatório"""
+        started = time.monotonic()
+        allowed = self.latency_budget.stage_timeout("renderizacao") if self.latency_budget else None
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        excel_path = OUTPUT_DIR / f"autofund_analysis_{financial_data.nif}_{timestamp}.xlsx"
+        json_path = OUTPUT_DIR / f"analysis_{financial_data.nif}_{timestamp}.json"
+
+        # 5. Relatório JSON
+        report = {
+            "metadata": {
+                "empresa": financial_data.nome_empresa,
+                "nif": financial_data.nif,
+                "periodo": financial_data.periodo,
+                "data_processamento": datetime.now().isoformat(),
+                "versao": "1.0.0"
+            },
+            "dados_financeiros": financial_data.model_dump(),
+            "analise": analysis.model_dump(),
+            **(extra or {}),
+            "ficheiros_gerados": {
+                "excel": str(excel_path),
+                "json": str(json_path)
+            }
+        }
 
-            # 4. Análise com Opus
-            logger.info("Gerando análise financeira...")
-            analysis = self.analyzer.generate_analysis(financial_data, context)
+        # 6. Preencher Excel e 7. salvar relatório JSON
+        logger.info("Preenchendo template Excel...")
+        rendered = False
+        if self.render_pool is not None:
+            try:
+                self.render_pool.render(
+                    report["dados_financeiros"], report["analise"], report, str(excel_path), str(json_path)
+                )
+                rendered = True
+            except BrokenProcessPool:
+                # O pool já foi recriado; esta task não espera por ele
+                logger.warning("Pool de renderização indisponível: a renderizar no processo")
+        if not rendered:
+            self.excel_generator.fill_template(financial_data, analysis, str(excel_path))
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
 
-            # 5. Gerar Excel
-            logger.info("Preenchendo template Excel...")
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            excel_filename = f"autofund_analysis_{financial_data.nif}_{timestamp}.xlsx"
-            excel_path = OUTPUT_DIR / excel_filename
+        if self.latency_budget is not None:
+            # A renderização não é interrompida; só é contabilizada
+            self.latency_budget.observe("renderizacao", time.monotonic() - started, allowed)
 
-            self.excel_generator.fill_template(financial_data, analysis, str(excel_path))
+        logger.info(f"Processo concluído com sucesso!")
+        logger.info(f"Excel: {excel_path}")
+        logger.info(f"JSON: {json_path}")
 
-            # 6. Gerar relatório JSON
-            report = {
-                "metadata": {
-                    "empresa": financial_data.nome_empresa,
-                    "nif": financial_data.nif,
-                    "periodo": financial_data.periodo,
-                    "data_processamento": datetime.now().isoformat(),
-                    "versao": "1.0.0"
-                },
-                "dados_financeiros": financial_data.model_dump(),
-                "analise": analysis.model_dump(),
-                "ficheiros_gerados": {
-                    "excel": str(excel_path),
-                    "json": str(OUTPUT_DIR / f"analysis_{financial_data.nif}_{timestamp}.json")
-                }
-            }
+        return report
 
-            # 7. Salvar relatório JSON
-            json_path = OUTPUT_DIR / f"analysis_{financial_data.nif}_{timestamp}.json"
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(report, f, indent=2, ensure_ascii=False)
+    def _store_analytics(self, financial_data: ExtracoesFinanceiras, analise: Dict[str, Any]):
+        """Acrescenta a extração e os rácios ao armazém analítico (se ativo)"""
+        if self.analytics_store is None:
+            return
+        try:
+            self.analytics_store.append_analysis(
+                {**financial_data.model_dump(), "contabilidade_bate": financial_data._contabilidade_bate},
+                analise,
+                task_id=self.task_id
+            )
+        except Exception as e:
+            # O armazém é secundário: nunca deve falhar o processamento
+            logger.warning(f"Erro ao registar no armazém analítico: {e}")
 
-            logger.info(f"Processo concluído com sucesso!")
-            logger.info(f"Excel: {excel_path}")
-            logger.info(f"JSON: {json_path}")
+    def process_ies(self, pdf_path: str, context: str = "",
+                    pdf_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Pipeline completo de processamento do IES"""
+
+        try:
+            financial_data = self.extract(pdf_path, pdf_hash)
+
+            # 4. Análise com Opus
+            self.cancel_token.check("análise")
+            logger.info("Gerando análise financeira...")
+            analysis = self.analyzer.generate_analysis(financial_data, context,
+                                                       budget=self.latency_budget)
 
+            self.cancel_token.check("relatório")
+            report = self._render_outputs(financial_data, analysis)
+            self._store_analytics(financial_data, report["analise"])
             return report
 
         except Exception as e:
             logger.error(f"Erro no processamento: {str(e)}")
             raise
 
+    def process_ies_multi(self, pdf_paths: List[str], context: str = "",
+                          pdf_hashes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Pipeline plurianual: vários IES da mesma empresa, uma única análise
+
+        Cada ano é extraído (ou lido da cache) uma vez; os rácios, crescimentos e
+        tendências são calculados sobre a série e a análise é feita ao ano mais
+        recente com a evolução plurianual no mesmo pedido ao modelo.
+        """
+
+        try:
+            hashes = pdf_hashes or [None] * len(pdf_paths)
+            series = [self.extract(path, digest) for path, digest in zip(pdf_paths, hashes)]
+
+            nifs = {d.nif for d in series}
+            if len(nifs) > 1:
+                raise ValueError(f"IES de empresas diferentes: {', '.join(sorted(nifs))}")
+
+            periodos = [d.periodo for d in series]
+            if len(set(periodos)) != len(periodos):
+                raise ValueError(f"Períodos repetidos na série: {', '.join(periodos)}")
+
+            series.sort(key=lambda d: d.periodo)
+            latest = series[-1]
+
+            logger.info(f"Calculando evolução plurianual ({', '.join(d.periodo for d in series)})...")
+            trends = self.analyzer.calculate_trends(series)
+
+            self.cancel_token.check("análise")
+            logger.info("Gerando análise financeira plurianual...")
+            analysis = self.analyzer.generate_analysis(latest, context, trends=trends,
+                                                       budget=self.latency_budget)
+
+            self.cancel_token.check("relatório")
+            report = self._render_outputs(latest, analysis, extra={
+                "dados_financeiros_anos": {d.periodo: d.model_dump() for d in series},
+                "evolucao_plurianual": trends
+            })
+
+            # Anos anteriores entram no armazém só com rácios e risco determinístico
+            for data in series[:-1]:
+                ratios = self.analyzer.calculate_ratios(data)
+                risk = self.analyzer.assess_risk(ratios)
+                self._store_analytics(data, {
+                    **ratios,
+                    "nivel_risco": risk.nivel_risco,
+                    "pontuacao_risco": risk.pontuacao,
+                    "conjunto_regras": risk.conjunto_regras
+                })
+            self._store_analytics(latest, report["analise"])
+            return report
+
+        except Exception as e:
+            logger.error(f"Erro no processamento plurianual: {str(e)}")
+            raise
+
 
 def main():
     """Função principal para execução local"""
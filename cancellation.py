@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Cancelamento cooperativo
+Token partilhado entre a API e o pipeline (que corre numa thread): o
+pipeline verifica-o entre etapas e o cancelamento fecha os clientes do
+modelo da task, abortando o pedido em curso em vez de esperar pela resposta.
+"""
+
+import logging
+import threading
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class TaskCancelled(Exception):
+    """O processamento foi cancelado a pedido do utilizador"""
+
+
+class CancelToken:
+    """Sinal de cancelamento com callbacks (executados uma vez, no cancelamento)"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Regista callback; se o token já foi cancelado é chamado de imediato"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run(callback)
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run(callback)
+
+    def check(self, stage: str = ""):
+        """Ponto de verificação entre etapas"""
+        if self._event.is_set():
+            raise TaskCancelled(f"Processamento cancelado{f' ({stage})' if stage else ''}")
+
+    @staticmethod
+    def _run(callback: Callable[[], None]):
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Erro ao cancelar: {e}")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Circuit breaker da API do modelo
+Partilhado pela extração e pela análise: com demasiados erros ou chamadas
+lentas numa janela recente o circuito abre e as chamadas falham de imediato
+(a análise usa a versão determinística e a extração é adiada) em vez de
+esperarem por timeouts. Passado o tempo de abertura, alguns pedidos de
+sonda decidem se o circuito fecha ou volta a abrir.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Optional, TypeVar
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_WINDOW_SECONDS = float(os.getenv('CIRCUIT_WINDOW_SECONDS', '60'))
+CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '10'))
+CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', '0.5'))
+# Chamadas acima desta duração contam como lentas
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv('CIRCUIT_SLOW_CALL_SECONDS', '90'))
+CIRCUIT_SLOW_RATE = float(os.getenv('CIRCUIT_SLOW_RATE', '0.8'))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', '2'))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Com vários workers (PROMETHEUS_MULTIPROC_DIR) mostra o pior estado entre eles
+CIRCUIT_STATE = Gauge(
+    "autofund_circuit_state", "Estado do circuito (0 fechado, 1 meio-aberto, 2 aberto)", ["name"],
+    multiprocess_mode="livemax")
+CIRCUIT_TRANSITIONS = Counter(
+    "autofund_circuit_transitions_total", "Mudanças de estado do circuito", ["name", "state"])
+CIRCUIT_REJECTED = Counter(
+    "autofund_circuit_rejected_total", "Chamadas recusadas com o circuito aberto", ["name"])
+
+T = TypeVar("T")
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito {name} aberto (nova tentativa em {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fechado → aberto (taxa de erros/lentidão) → meio-aberto (sondas) → fechado"""
+
+    def __init__(self, name: str, window: float = CIRCUIT_WINDOW_SECONDS, min_calls: int = CIRCUIT_MIN_CALLS,
+                 error_rate: float = CIRCUIT_ERROR_RATE, slow_call: float = CIRCUIT_SLOW_CALL_SECONDS,
+                 slow_rate: float = CIRCUIT_SLOW_RATE, open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 probes: int = CIRCUIT_HALF_OPEN_PROBES, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (instante, falhou, lenta) das chamadas recentes
+        self._outcomes: deque = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_ok = 0
+        CIRCUIT_STATE.labels(name=name).set(0)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open(self._clock())
+            return self._state
+
+    def _transition(self, state: str, now: float):
+        self._state = state
+        if state == OPEN:
+            self._opened_at = now
+        if state == HALF_OPEN:
+            self._probes_started = self._probes_ok = 0
+        if state == CLOSED:
+            self._outcomes.clear()
+        CIRCUIT_STATE.labels(name=self.name).set(_STATE_VALUES[state])
+        CIRCUIT_TRANSITIONS.labels(name=self.name, state=state).inc()
+        logger.warning(f"Circuito {self.name}: {state}")
+
+    def _maybe_half_open(self, now: float):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, now)
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(self.open_seconds - (self._clock() - self._opened_at), 0.0)
+
+    def allow(self) -> bool:
+        """Reserva uma chamada; False se o circuito a recusa"""
+        with self._lock:
+            now = self._clock()
+            self._maybe_half_open(now)
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_started < self.probes:
+                self._probes_started += 1
+                return True
+            return False
+
+    def record(self, failed: bool, duration: float):
+        with self._lock:
+            now = self._clock()
+            slow = duration >= self.slow_call
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN, now)
+                else:
+                    self._probes_ok += 1
+                    if self._probes_ok >= self.probes:
+                        self._transition(CLOSED, now)
+                return
+            if self._state == OPEN:
+                return
+
+            self._outcomes.append((now, failed, slow))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, _, s in self._outcomes if s)
+            if failures / calls >= self.error_rate or slow_calls / calls >= self.slow_rate:
+                self._transition(OPEN, now)
+
+    def call(self, fn: Callable[[], T], is_failure: Optional[Callable[[BaseException], bool]] = None) -> T:
+        """Executa fn através do circuito; `is_failure` decide que exceções contam como falha"""
+        if not self.allow():
+            CIRCUIT_REJECTED.labels(name=self.name).inc()
+            raise CircuitOpen(self.name, self.retry_after())
+        started = self._clock()
+        try:
+            result = fn()
+        except BaseException as e:
+            failed = is_failure(e) if is_failure is not None else isinstance(e, Exception)
+            self.record(failed, self._clock() - started)
+            raise
+        self.record(False, self._clock() - started)
+        return result
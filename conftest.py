@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Fixtures partilhadas pelos testes da API (uploads, quota e limpeza de tasks)
+"""
+
+import pytest
+
+UPLOAD_FORM = {"nif": "516807706", "ano_exercicio": "2023", "designacao_social": "PLF", "email": "a@b.pt"}
+
+
+def build_pdf(pages: int, padding: int = 0) -> bytes:
+    """PDF mínimo com `pages` objetos de página (e `padding` bytes de enchimento)"""
+    body = b"".join(b"%d 0 obj << /Type /Page /Parent 2 0 R >> endobj\n" % (i + 3) for i in range(pages))
+    return b"%PDF-1.4\n1 0 obj << /Type /Catalog >> endobj\n2 0 obj << /Type /Pages /Count 1 >> endobj\n" \
+        + body + b"x" * padding + b"%%EOF"
+
+
+def bearer(user: str) -> dict:
+    """Cabeçalho aceite em MOCK_MODE (o user_id são os 8 primeiros caracteres do token)"""
+    return {"Authorization": f"Bearer {user}-token"}
+
+
+@pytest.fixture
+def make_pdf():
+    return build_pdf
+
+
+@pytest.fixture
+def auth_headers():
+    return bearer
+
+
+@pytest.fixture
+def api_env(tmp_path, monkeypatch):
+    """api.main isolado do repositório e de outros testes
+
+    Uploads e fila offline em tmp_path, quota em memória sem limites herdados
+    e buckets de pedidos limpos; as tasks criadas pelo teste são removidas.
+    """
+    import api.main as api_main
+    import api.rate_limit as rate_limit
+    from api.quota import LocalQuotaLedger
+    from api.offline_queue import OfflineStore
+
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    monkeypatch.setattr(api_main, "UPLOAD_DIR", upload_dir)
+    if api_main.offline_store is not None:
+        monkeypatch.setattr(api_main, "offline_store", OfflineStore(str(upload_dir / "offline_queue.db")))
+    # Sem processamento as reservas de quota nunca são libertadas
+    monkeypatch.setattr(api_main, "quota_ledger", LocalQuotaLedger())
+    # Muitos uploads seguidos do mesmo utilizador: limites de pedidos fora do teste
+    rate_limit.LOCAL_BUCKETS.clear()
+    existing = set(api_main.active_tasks)
+    yield api_main
+    for task_id in set(api_main.active_tasks) - existing:
+        api_main.evict_task(api_main.active_tasks[task_id])
+
+
+@pytest.fixture
+def upload_ies():
+    """Envia um PDF para /api/upload em nome de `user`"""
+    def upload(client, user: str, content: bytes, headers=None, **form):
+        return client.post(
+            "/api/upload",
+            headers={**bearer(user), **(headers or {})},
+            files={"file": ("ies.pdf", content, "application/pdf")},
+            data={**UPLOAD_FORM, **form},
+        )
+    return upload
@@ -364,6 +364,13 @@ CREATE INDEX IF NOT EXISTS idx_financial_analyses_data_gin ON financial_analyses
 CREATE INDEX IF NOT EXISTS idx_financial_analyses_analysis_gin ON financial_analyses USING GIN(analysis);
 CREATE INDEX IF NOT EXISTS idx_subscriptions_user_status ON subscriptions(user_id, status);
 CREATE INDEX IF NOT EXISTS idx_api_usage_endpoint_method ON api_usage(endpoint, method);
+""",
+
+    "003_quota_period.sql": """
+-- Description: Monthly quota period for users.quota_used
+-- Depends: 001_initial_schema
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS quota_period DATE;
 """,
 }
 
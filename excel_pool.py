@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Pool de Renderização Excel/JSON
+Executa o preenchimento do template (openpyxl, CPU-bound) e a escrita do
+relatório JSON em processos separados, para não disputar o GIL com o
+processo da API. Cada worker carrega o template e as posições das labels
+uma vez no arranque; entre processos passam apenas dicts pequenos. Um worker
+que morre (BrokenProcessPool) ou que excede EXCEL_RENDER_TIMEOUT leva à
+recriação do pool; quem chama renderiza essa task no próprio processo.
+"""
+
+import os
+import json
+import logging
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+EXCEL_POOL_WORKERS = int(os.getenv('EXCEL_POOL_WORKERS', '2'))
+# Espera máxima por uma renderização no pool (segundos)
+EXCEL_RENDER_TIMEOUT = float(os.getenv('EXCEL_RENDER_TIMEOUT', '120'))
+
+# Estado de cada processo worker
+_worker_generator = None
+
+
+def _init_worker(template_path: str):
+    """Inicializa o worker: importa o motor e aquece a cache do template"""
+    global _worker_generator
+    from autofund_ai_poc_v3 import ExcelGenerator
+
+    _worker_generator = ExcelGenerator(template_path)
+    if os.path.exists(template_path):
+        _worker_generator.load_template()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _render_job(data: Dict[str, Any], analysis: Dict[str, Any], report: Dict[str, Any],
+                excel_path: str, json_path: str) -> Dict[str, str]:
+    """Executado no worker: preenche o Excel e escreve o relatório JSON"""
+    from autofund_ai_poc_v3 import ExtracoesFinanceiras, AnaliseFinanceira
+
+    _worker_generator.fill_template(
+        ExtracoesFinanceiras(**data), AnaliseFinanceira(**analysis), excel_path
+    )
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return {"excel": excel_path, "json": json_path}
+
+
+class ExcelRenderPool:
+    """Pool de processos pré-aquecidos para renderização dos ficheiros de saída"""
+
+    def __init__(self, template_path: str, max_workers: int = EXCEL_POOL_WORKERS,
+                 timeout: float = EXCEL_RENDER_TIMEOUT):
+        self.template_path = template_path
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn: o processo da API tem threads (event loop, threadpool), fork não é seguro
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.template_path,),
+        )
+
+    def _restart(self, broken: ProcessPoolExecutor, terminate: bool = False):
+        """Substitui o executor (uma vez, mesmo com várias tasks a detetar a falha)"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._create_executor()
+        if terminate:
+            # Um worker preso não termina com shutdown; as renderizações que
+            # corriam nos outros falham com BrokenProcessPool e seguem no processo
+            for process in list((getattr(broken, "_processes", None) or {}).values()):
+                process.terminate()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self):
+        """Arranca todos os workers antes do primeiro pedido real"""
+        pids = {f.result() for f in [self._executor.submit(_ping) for _ in range(self.max_workers)]}
+        logger.info(f"Pool de renderização Excel pronto ({len(pids)} workers)")
+
+    def submit(self, data: Dict[str, Any], analysis: Dict[str, Any], report: Dict[str, Any],
+               excel_path: str, json_path: str):
+        return self._executor.submit(_render_job, data, analysis, report, excel_path, json_path)
+
+    def render(self, data: Dict[str, Any], analysis: Dict[str, Any], report: Dict[str, Any],
+               excel_path: str, json_path: str, timeout: Optional[float] = None) -> Dict[str, str]:
+        """Renderiza e bloqueia até terminar; retorna os caminhos gerados
+
+        Levanta BrokenProcessPool (worker morto) ou TimeoutError (mais de
+        `timeout`, por omissão EXCEL_RENDER_TIMEOUT); em ambos o pool é recriado.
+        """
+        executor = self._executor
+        try:
+            future = executor.submit(_render_job, data, analysis, report, excel_path, json_path)
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except BrokenProcessPool:
+            logger.error("Pool de renderização Excel partido: a recriar")
+            self._restart(executor)
+            raise
+        except FutureTimeout:
+            logger.error("Renderização Excel excedeu o tempo máximo: a recriar o pool")
+            self._restart(executor, terminate=True)
+            raise
+
+    async def render_async(self, data: Dict[str, Any], analysis: Dict[str, Any], report: Dict[str, Any],
+                           excel_path: str, json_path: str) -> Dict[str, str]:
+        return await asyncio.wrap_future(self.submit(data, analysis, report, excel_path, json_path))
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Pedidos de cobertura (hedging)
+Se a resposta não chega dentro do p90 das latências recentes, é lançado um
+pedido duplicado e usa-se o primeiro que responder; o outro é abortado.
+Os duplicados estão limitados a uma fração dos pedidos (orçamento de
+hedging), para que a cauda encurte sem multiplicar o custo.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+HEDGING_ENABLED = os.getenv('EXTRACTION_HEDGING', 'false').lower() == 'true'
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', '0.9'))
+# Máximo de pedidos duplicados em proporção dos pedidos feitos
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', '0.05'))
+# Sem latências suficientes não há limiar fiável: não se duplica
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+HEDGE_WINDOW = int(os.getenv('HEDGE_WINDOW', '200'))
+HEDGE_MAX_WORKERS = int(os.getenv('HEDGE_MAX_WORKERS', '16'))
+
+HEDGE_REQUESTS = Counter("autofund_hedge_requests_total", "Pedidos sujeitos a hedging", ["name"])
+HEDGES_SENT = Counter("autofund_hedges_total", "Pedidos duplicados enviados", ["name"])
+HEDGE_WINS = Counter("autofund_hedge_wins_total", "Pedidos duplicados que responderam primeiro", ["name"])
+HEDGE_SAVED = Counter(
+    "autofund_hedge_latency_saved_seconds_total", "Estimativa do tempo poupado pelos duplicados", ["name"])
+
+T = TypeVar("T")
+
+# Tentativa: (função que faz o pedido, função que o aborta)
+Attempt = Tuple[Callable[[], T], Callable[[], None]]
+
+
+class HedgePolicy:
+    """Limiar de hedging (quantil das latências recentes) e orçamento de duplicados"""
+
+    def __init__(self, name: str, quantile: float = HEDGE_QUANTILE, budget: float = HEDGE_BUDGET,
+                 min_samples: int = HEDGE_MIN_SAMPLES, window: int = HEDGE_WINDOW,
+                 max_workers: int = HEDGE_MAX_WORKERS):
+        self.name = name
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self._latencies: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "latency_saved": 0.0}
+
+    def threshold(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(int(math.ceil(self.quantile * len(ordered))) - 1, len(ordered) - 1)]
+
+    def _tail_mean(self, threshold: float) -> float:
+        with self._lock:
+            tail = [latency for latency in self._latencies if latency > threshold]
+        return sum(tail) / len(tail) if tail else threshold
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _acquire_hedge(self) -> bool:
+        with self._lock:
+            if self.stats["hedges"] + 1 > self.budget * self.stats["requests"]:
+                return False
+            self.stats["hedges"] += 1
+        HEDGES_SENT.labels(name=self.name).inc()
+        return True
+
+    def hedge_rate(self) -> float:
+        with self._lock:
+            return self.stats["hedges"] / self.stats["requests"] if self.stats["requests"] else 0.0
+
+    def run(self, make_attempt: Callable[[], Attempt]) -> T:
+        """Executa um pedido com cobertura; `make_attempt` cria cada tentativa independente"""
+        with self._lock:
+            self.stats["requests"] += 1
+        HEDGE_REQUESTS.labels(name=self.name).inc()
+
+        threshold = self.threshold()
+        call, abort = make_attempt()
+        started = time.monotonic()
+        if threshold is None:
+            # Ainda a aprender o limiar: pedido simples nesta thread
+            result = call()
+            self.record(time.monotonic() - started)
+            return result
+
+        primary = self._pool.submit(call)
+        wait([primary], timeout=threshold)
+        if primary.done() or not self._acquire_hedge():
+            # Só respostas entram no limiar: falhas rápidas baixavam-no
+            result = primary.result()
+            self.record(time.monotonic() - started)
+            return result
+
+        hedge_call, hedge_abort = make_attempt()
+        logger.info(f"Hedging {self.name}: sem resposta após {threshold:.1f}s, pedido duplicado")
+        hedge = self._pool.submit(hedge_call)
+        aborts: Dict = {primary: abort, hedge: hedge_abort}
+
+        pending = set(aborts)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                elapsed = time.monotonic() - started
+                # A latência do pedido original fica censurada no momento da resposta
+                self.record(elapsed)
+                for loser in pending:
+                    aborts[loser]()
+                if future is hedge:
+                    saved = max(self._tail_mean(threshold) - elapsed, 0.0)
+                    with self._lock:
+                        self.stats["hedge_wins"] += 1
+                        self.stats["latency_saved"] += saved
+                    HEDGE_WINS.labels(name=self.name).inc()
+                    HEDGE_SAVED.labels(name=self.name).inc(saved)
+                return future.result()
+        raise error
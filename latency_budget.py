@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Orçamento de latência
+Cada task tem um orçamento total (por plano) repartido pelas etapas do
+pipeline: upload, extração, análise e renderização. O tempo de cada etapa
+chega às chamadas ao modelo como timeout e o que uma etapa não gasta passa
+para as seguintes. Esgotado o orçamento da análise usa-se a análise
+determinística em vez de falhar a task.
+"""
+
+import os
+import json
+import time
+import logging
+from typing import Callable, Dict, Any, List, Optional
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Segundos por plano desde o início do processamento; esgotado, a análise passa a
+# determinística, pelo que os planos pagos têm mais tempo e não menos
+DEFAULT_LATENCY_BUDGETS = {"free": 180.0, "premium": 240.0, "enterprise": 300.0}
+# JSON {"plano": segundos} fundido sobre os valores por omissão
+LATENCY_BUDGET_JSON = os.getenv('LATENCY_BUDGET_JSON', '')
+# Abaixo disto não vale a pena chamar o modelo
+MIN_CALL_TIMEOUT = float(os.getenv('LATENCY_MIN_CALL_TIMEOUT', '5'))
+
+# Etapas por ordem e a fração do orçamento de cada uma
+STAGES = ("upload", "extracao", "analise", "renderizacao")
+DEFAULT_STAGE_SHARES = {"upload": 0.1, "extracao": 0.45, "analise": 0.35, "renderizacao": 0.1}
+
+BUDGET_EXCEEDED = Counter(
+    "autofund_latency_budget_exceeded_total", "Etapas que esgotaram o orçamento de latência", ["stage"])
+STAGE_DURATION = Histogram(
+    "autofund_stage_duration_seconds", "Duração das etapas do pipeline", ["stage"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 180, 300))
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"Orçamento de latência esgotado ({stage})")
+        self.stage = stage
+
+
+def load_budgets(raw: str = LATENCY_BUDGET_JSON) -> Dict[str, float]:
+    budgets = dict(DEFAULT_LATENCY_BUDGETS)
+    if raw:
+        budgets.update({tier: float(seconds) for tier, seconds in json.loads(raw).items()})
+    return budgets
+
+
+LATENCY_BUDGETS = load_budgets()
+
+
+def request_options(timeout: Optional[float]) -> Dict[str, Any]:
+    """kwargs por pedido para o SDK (sem timeout mantém o do cliente)"""
+    return {} if timeout is None else {"timeout": timeout}
+
+
+class LatencyBudget:
+    """Prazo de uma task e a parte dele disponível para cada etapa"""
+
+    def __init__(self, total: float, shares: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.total = total
+        self.shares = shares or DEFAULT_STAGE_SHARES
+        self._clock = clock
+        self.deadline = clock() + total
+        self.exceeded: List[str] = []
+
+    @classmethod
+    def for_tier(cls, tier: str) -> "LatencyBudget":
+        return cls(LATENCY_BUDGETS.get(tier, LATENCY_BUDGETS["free"]))
+
+    def remaining(self) -> float:
+        return max(self.deadline - self._clock(), 0.0)
+
+    def stage_timeout(self, stage: str, *following: str) -> float:
+        """Fração do tempo restante proporcional ao peso da etapa entre as que faltam
+
+        Com `following` (etapas seguintes) é o tempo de todas juntas, por exemplo
+        para esperar por trabalho partilhado que faz upload e extração.
+        """
+        pending = STAGES[STAGES.index(stage):]
+        weight = sum(self.shares[s] for s in pending)
+        return self.remaining() * sum(self.shares[s] for s in (stage, *following)) / weight
+
+    def mark_exceeded(self, stage: str):
+        if stage in self.exceeded:
+            return
+        self.exceeded.append(stage)
+        BUDGET_EXCEEDED.labels(stage=stage).inc()
+        logger.warning(f"Orçamento de latência esgotado na etapa {stage} ({self.total:.0f}s no total)")
+
+    def observe(self, stage: str, elapsed: float, allowed: float):
+        """Regista a duração de uma etapa que não pode ser interrompida"""
+        STAGE_DURATION.labels(stage=stage).observe(elapsed)
+        if elapsed > allowed:
+            self.mark_exceeded(stage)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Motor de Regras de Risco
+Regras declarativas (JSON/YAML) compiladas em limites ordenados para
+classificação de risco de uma empresa ou de lotes de empresas.
+
+Formato de uma regra:
+    {"id": "liquidez", "indicador": "liquidez_geral", "limites": [1.0, 1.5], "pontos": [3, 1, 0]}
+
+Um valor abaixo de limites[0] recebe pontos[0]; entre limites[i-1] (inclusive)
+e limites[i] recebe pontos[i]; acima do último limite recebe pontos[-1].
+"""
+
+import os
+import json
+import bisect
+import logging
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Mapping, Union
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field, model_validator
+
+try:
+    import yaml
+except ImportError:  # PyYAML é opcional, só necessário para regras em YAML
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+# Diretório com conjuntos de regras adicionais (um ficheiro por aviso/programa)
+RISK_RULES_DIR = os.getenv('RISK_RULES_DIR')
+# Conjunto de regras usado quando nenhum programa é indicado
+DEFAULT_RULE_SET = os.getenv('RISK_RULE_SET', 'pt2030_default')
+
+# Regras equivalentes à classificação original de FinancialAnalyzer.assess_risk_level
+DEFAULT_RISK_RULES = {
+    "nome": "pt2030_default",
+    "descricao": "Classificação de risco base para candidaturas Portugal 2030",
+    "regras": [
+        {"id": "autonomia_financeira", "indicador": "autonomia_financeira",
+         "limites": [0.20, 0.30, 0.40], "pontos": [3, 2, 1, 0]},
+        {"id": "liquidez_geral", "indicador": "liquidez_geral",
+         "limites": [1.0, 1.5], "pontos": [3, 1, 0]},
+        {"id": "margem_ebitda", "indicador": "margem_ebitda",
+         "limites": [0.05, 0.10], "pontos": [2, 1, 0]},
+        {"id": "rentabilidade_negativa", "indicador": "rentabilidade_ativos",
+         "limites": [0.0], "pontos": [3, 0]},
+    ],
+    "niveis": {
+        "limites": [3, 5, 7],
+        "classes": ["BAIXO", "MÉDIO", "ALTO", "CRÍTICO"]
+    }
+}
+
+
+class RegraRisco(BaseModel):
+    """Definição de uma regra: escada de limites de um indicador"""
+
+    id: str
+    indicador: str
+    limites: List[float] = Field(..., min_length=1)
+    pontos: List[float]
+    descricao: Optional[str] = None
+
+    @model_validator(mode='after')
+    def validate_ladder(self):
+        """Limites estritamente crescentes e um valor de pontos por intervalo"""
+        if any(b <= a for a, b in zip(self.limites, self.limites[1:])):
+            raise ValueError(f"Regra {self.id}: limites devem ser estritamente crescentes")
+        if len(self.pontos) != len(self.limites) + 1:
+            raise ValueError(f"Regra {self.id}: são necessários {len(self.limites) + 1} valores de pontos")
+        return self
+
+    class Config:
+        extra = "forbid"
+
+
+class NiveisRisco(BaseModel):
+    """Conversão da pontuação total em classe de risco"""
+
+    limites: List[float]
+    classes: List[str]
+
+    @model_validator(mode='after')
+    def validate_levels(self):
+        if any(b <= a for a, b in zip(self.limites, self.limites[1:])):
+            raise ValueError("Níveis: limites devem ser estritamente crescentes")
+        if len(self.classes) != len(self.limites) + 1:
+            raise ValueError(f"Níveis: são necessárias {len(self.limites) + 1} classes")
+        return self
+
+    class Config:
+        extra = "forbid"
+
+
+class ConjuntoRegras(BaseModel):
+    """Conjunto de regras de um programa/aviso"""
+
+    nome: str
+    descricao: Optional[str] = None
+    regras: List[RegraRisco] = Field(..., min_length=1)
+    niveis: NiveisRisco
+
+    class Config:
+        extra = "forbid"
+
+
+@dataclass
+class RiskAssessment:
+    """Resultado da avaliação de risco de uma empresa"""
+
+    nivel_risco: str
+    pontuacao: float
+    contribuicoes: Dict[str, float] = field(default_factory=dict)
+    conjunto_regras: str = ""
+
+
+class CompiledRuleSet:
+    """Conjunto de regras compilado em arrays de limites e pontos"""
+
+    def __init__(self, definition: ConjuntoRegras):
+        self.definition = definition
+        self.name = definition.nome
+        self.rule_ids = [r.id for r in definition.regras]
+        self.indicators = [r.indicador for r in definition.regras]
+
+        # Versões numpy para lotes; tuplos para avaliação escalar (bisect evita
+        # o overhead do numpy quando se avalia uma só empresa)
+        self._limits = [np.asarray(r.limites, dtype=float) for r in definition.regras]
+        self._points = [np.asarray(r.pontos, dtype=float) for r in definition.regras]
+        self._limits_t = [tuple(r.limites) for r in definition.regras]
+        self._points_t = [tuple(r.pontos) for r in definition.regras]
+
+        self._level_limits = np.asarray(definition.niveis.limites, dtype=float)
+        self._level_limits_t = tuple(definition.niveis.limites)
+        self._level_classes = np.asarray(definition.niveis.classes, dtype=object)
+        self._level_classes_t = tuple(definition.niveis.classes)
+
+    def score(self, ratios: Mapping[str, float]) -> RiskAssessment:
+        """Avalia uma empresa a partir do dicionário de rácios"""
+        contribuicoes = {}
+        total = 0.0
+
+        for rule_id, indicator, limits, points in zip(
+            self.rule_ids, self.indicators, self._limits_t, self._points_t
+        ):
+            value = ratios.get(indicator)
+            if value is None or value != value:  # ausente ou NaN: não pontua
+                pts = 0.0
+            else:
+                pts = points[bisect.bisect_right(limits, value)]
+            contribuicoes[rule_id] = pts
+            total += pts
+
+        nivel = self._level_classes_t[bisect.bisect_right(self._level_limits_t, total)]
+        return RiskAssessment(
+            nivel_risco=nivel,
+            pontuacao=total,
+            contribuicoes=contribuicoes,
+            conjunto_regras=self.name
+        )
+
+    def score_batch(self, ratios: Union[pd.DataFrame, Mapping[str, Any]]) -> pd.DataFrame:
+        """Avalia um lote de empresas (uma linha por empresa)
+
+        Retorna DataFrame com uma coluna de contribuição por regra,
+        'pontuacao' e 'nivel_risco'.
+        """
+        frame = ratios if isinstance(ratios, pd.DataFrame) else pd.DataFrame(ratios)
+        n = len(frame)
+        total = np.zeros(n, dtype=float)
+        result = {}
+
+        for rule_id, indicator, limits, points in zip(
+            self.rule_ids, self.indicators, self._limits, self._points
+        ):
+            if indicator in frame:
+                values = frame[indicator].to_numpy(dtype=float)
+                pts = points[np.searchsorted(limits, values, side='right')]
+                pts = np.where(np.isnan(values), 0.0, pts)
+            else:
+                pts = np.zeros(n, dtype=float)
+            result[rule_id] = pts
+            total += pts
+
+        result['pontuacao'] = total
+        result['nivel_risco'] = self._level_classes[
+            np.searchsorted(self._level_limits, total, side='right')
+        ]
+        return pd.DataFrame(result, index=frame.index)
+
+
+def load_rule_file(path: Union[str, Path]) -> ConjuntoRegras:
+    """Lê um ficheiro de regras JSON ou YAML"""
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix.lower() in ('.yaml', '.yml'):
+            if yaml is None:
+                raise ImportError("PyYAML necessário para regras em YAML (pip install pyyaml)")
+            raw = yaml.safe_load(f)
+        else:
+            raw = json.load(f)
+    return ConjuntoRegras(**raw)
+
+
+class RiskRuleRegistry:
+    """Registo de conjuntos de regras compilados, indexados por nome"""
+
+    def __init__(self, rules_dir: Optional[str] = None):
+        self._rule_sets: Dict[str, CompiledRuleSet] = {}
+        self.register(ConjuntoRegras(**DEFAULT_RISK_RULES))
+        if rules_dir:
+            self.load_dir(rules_dir)
+
+    def register(self, definition: ConjuntoRegras) -> CompiledRuleSet:
+        compiled = CompiledRuleSet(definition)
+        self._rule_sets[definition.nome] = compiled
+        return compiled
+
+    def load_dir(self, rules_dir: str):
+        """Carrega todos os ficheiros .json/.yaml/.yml de um diretório"""
+        for path in sorted(Path(rules_dir).glob('*')):
+            if path.suffix.lower() not in ('.json', '.yaml', '.yml'):
+                continue
+            try:
+                compiled = self.register(load_rule_file(path))
+                logger.info(f"Regras de risco '{compiled.name}' carregadas de {path}")
+            except Exception as e:
+                logger.error(f"Erro ao carregar regras de risco {path}: {e}")
+
+    def get(self, name: Optional[str] = None) -> CompiledRuleSet:
+        name = name or DEFAULT_RULE_SET
+        if name not in self._rule_sets:
+            raise KeyError(f"Conjunto de regras desconhecido: {name}")
+        return self._rule_sets[name]
+
+    def names(self) -> List[str]:
+        return sorted(self._rule_sets)
+
+
+_registry: Optional[RiskRuleRegistry] = None
+
+
+def get_registry() -> RiskRuleRegistry:
+    """Registo global, compilado uma única vez por processo"""
+    global _registry
+    if _registry is None:
+        _registry = RiskRuleRegistry(RISK_RULES_DIR)
+    return _registry
+
+
+def get_rule_set(name: Optional[str] = None) -> CompiledRuleSet:
+    return get_registry().get(name)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Benchmark Setorial por CAE
+Tabelas de percentis dos rácios por divisão CAE (2 dígitos) e classe de
+dimensão, construídas offline a partir do armazém analítico e carregadas uma
+vez por processo para comparar cada empresa com os seus pares.
+
+Uso:
+    python sector_benchmark.py build [diretorio_armazem] [ficheiro_saida.npz]
+"""
+
+import os
+import re
+import sys
+import bisect
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SECTOR_BENCHMARK_PATH = Path(os.getenv('SECTOR_BENCHMARK_PATH', 'outputs/benchmark_setorial.npz'))
+# Mínimo de empresas para um grupo ter tabela própria
+BENCHMARK_MIN_PEERS = int(os.getenv('BENCHMARK_MIN_PEERS', '20'))
+
+BENCHMARK_METRICS = [
+    "autonomia_financeira", "liquidez_geral", "margem_ebitda",
+    "rentabilidade_ativos", "endividamento"
+]
+PERCENTILES = np.arange(101)
+
+# Classes de dimensão por volume de negócios (limites da Recomendação 2003/361/CE,
+# inclusivos: até 2 M€ é micro, até 10 M€ pequena, até 50 M€ média)
+SIZE_LIMITS = [2_000_000, 10_000_000, 50_000_000]
+SIZE_CLASSES = ["micro", "pequena", "media", "grande"]
+
+ALL = "*"
+
+
+def cae_division(cae: Optional[str]) -> str:
+    """Divisão CAE (2 primeiros dígitos), ou '*' se desconhecida"""
+    if not cae:
+        return ALL
+    match = re.search(r'\d{2}', str(cae))
+    return match.group(0) if match else ALL
+
+
+def size_class(volume_negocios: Optional[float]) -> str:
+    if volume_negocios is None or volume_negocios != volume_negocios:
+        return ALL
+    return SIZE_CLASSES[bisect.bisect_left(SIZE_LIMITS, volume_negocios)]
+
+
+def build_index(df: pd.DataFrame, min_peers: int = BENCHMARK_MIN_PEERS) -> Dict[str, Any]:
+    """Calcula tabelas de percentis por (divisão, dimensão), por divisão e global
+
+    `df` precisa das colunas cae, volume_negocios e BENCHMARK_METRICS.
+    """
+    df = df.copy()
+    df["divisao"] = df["cae"].map(cae_division)
+    df["dimensao"] = df["volume_negocios"].map(size_class)
+
+    groups: List[Tuple[str, str, pd.DataFrame]] = [(ALL, ALL, df)]
+    groups += [(div, ALL, g) for div, g in df.groupby("divisao") if div != ALL]
+    groups += [(div, dim, g) for (div, dim), g in df.groupby(["divisao", "dimensao"])
+               if div != ALL and dim != ALL]
+
+    keys, counts, tables = [], [], []
+    for div, dim, group in groups:
+        if len(group) < min_peers and (div, dim) != (ALL, ALL):
+            continue
+        values = group[BENCHMARK_METRICS].to_numpy(dtype=float)
+        with np.errstate(all='ignore'):
+            table = np.nanpercentile(values, PERCENTILES, axis=0).T  # (métricas, 101)
+        keys.append(f"{div}/{dim}")
+        counts.append(len(group))
+        tables.append(table)
+
+    return {
+        "keys": np.asarray(keys),
+        "counts": np.asarray(counts, dtype=np.int64),
+        "tables": np.asarray(tables, dtype=np.float32),
+        "metrics": np.asarray(BENCHMARK_METRICS),
+    }
+
+
+def save_index(index: Dict[str, Any], path: Path = SECTOR_BENCHMARK_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp.npz")
+    np.savez_compressed(tmp_path, **index)
+    os.replace(tmp_path, path)
+
+
+class SectorBenchmark:
+    """Índice de percentis em memória para comparação instantânea com pares"""
+
+    def __init__(self, index: Dict[str, Any]):
+        self.metrics = [str(m) for m in index["metrics"]]
+        self.counts = index["counts"]
+        # Listas de floats por grupo e métrica: bisect sobre listas é mais
+        # rápido do que np.searchsorted para consultas escalares
+        self.tables = [[row.tolist() for row in table] for table in index["tables"]]
+        self.positions = {str(k): i for i, k in enumerate(index["keys"])}
+
+    @classmethod
+    def load(cls, path: Path = SECTOR_BENCHMARK_PATH) -> "SectorBenchmark":
+        with np.load(path, allow_pickle=False) as data:
+            return cls({k: data[k] for k in data.files})
+
+    def _group(self, divisao: str, dimensao: str) -> Tuple[str, int]:
+        for key in (f"{divisao}/{dimensao}", f"{divisao}/{ALL}", f"{ALL}/{ALL}"):
+            pos = self.positions.get(key)
+            if pos is not None:
+                return key, pos
+        raise KeyError("Índice de benchmark sem grupo global")
+
+    def compare(self, cae: Optional[str], volume_negocios: Optional[float],
+                ratios: Dict[str, float]) -> Dict[str, Any]:
+        """Percentil de cada rácio da empresa face ao grupo de pares mais específico"""
+        key, pos = self._group(cae_division(cae), size_class(volume_negocios))
+        percentis = {}
+        for metric, table in zip(self.metrics, self.tables[pos]):
+            value = ratios.get(metric)
+            if value is None or value != value or table[0] != table[0]:
+                continue
+            # Nº de pontos de percentil <= valor, convertido para 0-100
+            percentis[metric] = float(max(bisect.bisect_right(table, value) - 1, 0))
+        return {
+            "grupo_pares": key,
+            "n_pares": int(self.counts[pos]),
+            "percentis": percentis
+        }
+
+
+_benchmark: Optional[SectorBenchmark] = None
+_benchmark_loaded = False
+_benchmark_lock = threading.Lock()
+
+
+def get_benchmark() -> Optional[SectorBenchmark]:
+    """Índice global do processo, ou None se ainda não foi construído"""
+    global _benchmark, _benchmark_loaded
+    with _benchmark_lock:
+        if not _benchmark_loaded:
+            _benchmark_loaded = True
+            if SECTOR_BENCHMARK_PATH.exists():
+                try:
+                    _benchmark = SectorBenchmark.load(SECTOR_BENCHMARK_PATH)
+                    logger.info(f"Benchmark setorial carregado ({len(_benchmark.positions)} grupos)")
+                except Exception as e:
+                    logger.error(f"Erro ao carregar benchmark setorial: {e}")
+    return _benchmark
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print(__doc__)
+        return
+
+    from analytics_store import AnalyticsStore
+
+    store = AnalyticsStore(Path(sys.argv[2])) if len(sys.argv) > 2 else AnalyticsStore()
+    out_path = Path(sys.argv[3]) if len(sys.argv) > 3 else SECTOR_BENCHMARK_PATH
+
+    df = store.query(columns=["cae", "volume_negocios"] + BENCHMARK_METRICS)
+    if df.empty:
+        print("❌ Armazém analítico vazio: nada para indexar")
+        return
+
+    index = build_index(df)
+    save_index(index, out_path)
+    print(f"✅ Benchmark com {len(index['keys'])} grupos ({len(df)} empresas) salvo em {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+AutoFund AI - Single-flight
+Pedidos concorrentes com a mesma chave (hash do PDF, hash do input da
+análise) esperam por uma única execução em curso em vez de repetirem o
+trabalho. Dentro do processo a partilha é feita com futures; entre workers
+com um lock por chave (ficheiro com flock, ou Redis se configurado) seguido
+de nova consulta à cache em disco. Nenhuma espera é ilimitada: cada chamada
+tem um prazo e um token de cancelamento opcional, verificados enquanto espera.
+"""
+
+import os
+import time
+import uuid
+import fcntl
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Any, Optional, TypeVar
+
+from cancellation import CancelToken, TaskCancelled
+
+logger = logging.getLogger(__name__)
+
+# "file" (flock no diretório de cache) ou "redis" (SET NX com REDIS_URL)
+SINGLE_FLIGHT_BACKEND = os.getenv('SINGLE_FLIGHT_BACKEND', 'file')
+REDIS_URL = os.getenv('REDIS_URL')
+# Validade do lock Redis; protege contra workers que morrem com o lock
+SINGLE_FLIGHT_LOCK_TTL = float(os.getenv('SINGLE_FLIGHT_LOCK_TTL', '600'))
+# Espera máxima por uma execução em curso (ou pelo lock) quando quem chama não indica prazo
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', '600'))
+# Intervalo entre tentativas de lock e verificações do cancelamento
+POLL_INTERVAL = 0.05
+
+T = TypeVar("T")
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Prazo esgotado à espera de uma execução em curso ou do lock da chave"""
+
+    def __init__(self, name: str, key: str):
+        super().__init__(f"Single-flight {name}: prazo esgotado à espera de {key[:12]}")
+        self.name = name
+
+
+def _pause(name: str, key: str, deadline: float, cancel_token: Optional[CancelToken],
+           interval: float = POLL_INTERVAL) -> float:
+    """Verifica cancelamento e prazo; retorna quanto esperar até à próxima tentativa"""
+    if cancel_token is not None:
+        cancel_token.check("à espera de execução em curso")
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise SingleFlightTimeout(name, key)
+    return min(interval, remaining)
+
+
+@contextmanager
+def file_lock(lock_dir: Path, key: str, deadline: Optional[float] = None,
+              cancel_token: Optional[CancelToken] = None):
+    """Lock exclusivo entre processos da mesma máquina (flock)
+
+    O ficheiro do lock é removido ao libertar; quem o abriu antes da remoção
+    deteta que ficou com um inode órfão e volta a abrir o caminho.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_TIMEOUT
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    path = lock_dir / f"{key}.lock"
+    while True:
+        handle = open(path, "a+")
+        try:
+            while True:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    time.sleep(_pause("lock", key, deadline, cancel_token))
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+        except BaseException:
+            handle.close()
+            raise
+        if current == os.fstat(handle.fileno()).st_ino:
+            break
+        handle.close()
+
+    try:
+        yield
+    finally:
+        # Remover antes de libertar: ninguém fica com o lock de um ficheiro já substituído
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        handle.close()
+
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """Lock entre workers de máquinas diferentes (SET NX PX + libertação com token)"""
+
+    def __init__(self, url: str = REDIS_URL, ttl: float = SINGLE_FLIGHT_LOCK_TTL,
+                 poll_interval: float = 0.2):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl_ms = int(ttl * 1000)
+        self.poll_interval = poll_interval
+        self._release = self.client.register_script(_RELEASE_SCRIPT)
+
+    @contextmanager
+    def __call__(self, key: str, deadline: Optional[float] = None,
+                 cancel_token: Optional[CancelToken] = None):
+        if deadline is None:
+            deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_TIMEOUT
+        name = f"autofund:singleflight:{key}"
+        token = uuid.uuid4().hex
+        while not self.client.set(name, token, nx=True, px=self.ttl_ms):
+            time.sleep(_pause("lock", key, deadline, cancel_token, self.poll_interval))
+        try:
+            yield
+        finally:
+            self._release(keys=[name], args=[token])
+
+
+class SingleFlight:
+    """Agrupa chamadas concorrentes com a mesma chave numa única execução"""
+
+    def __init__(self, name: str, lock_dir: Optional[Path] = None):
+        self.name = name
+        self.lock_dir = lock_dir
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._redis_lock: Optional[RedisLock] = None
+        self.stats = {"executions": 0, "shared": 0}
+
+        if SINGLE_FLIGHT_BACKEND == "redis" and REDIS_URL:
+            try:
+                self._redis_lock = RedisLock()
+            except ImportError:
+                logger.warning("redis não instalado: single-flight entre workers usa flock")
+
+    @contextmanager
+    def _cross_worker_lock(self, key: str, deadline: float, cancel_token: Optional[CancelToken]):
+        if self._redis_lock is not None:
+            with self._redis_lock(f"{self.name}:{key}", deadline, cancel_token):
+                yield
+        elif self.lock_dir is not None:
+            with file_lock(self.lock_dir, key, deadline, cancel_token):
+                yield
+        else:
+            yield
+
+    def do(self, key: str, fn: Callable[[], T], timeout: Optional[float] = None,
+           cancel_token: Optional[CancelToken] = None) -> T:
+        """Executa fn uma vez por chave; chamadas concorrentes recebem o mesmo resultado
+
+        fn corre com o lock entre workers adquirido, pelo que deve começar por
+        consultar a cache partilhada (outro worker pode já a ter preenchido).
+        `timeout` limita a espera por uma execução em curso ou pelo lock (não a
+        execução de fn); esgotado levanta SingleFlightTimeout. Com `cancel_token`
+        a espera termina com TaskCancelled assim que a task é cancelada.
+        """
+        timeout = SINGLE_FLIGHT_WAIT_TIMEOUT if timeout is None else timeout
+        return self._do(key, fn, time.monotonic() + timeout, cancel_token)
+
+    def _do(self, key: str, fn: Callable[[], T], deadline: float,
+            cancel_token: Optional[CancelToken]) -> T:
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.stats["executions"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if not leader:
+            logger.info(f"Single-flight {self.name}: a aguardar execução em curso ({key[:12]})")
+            while True:
+                wait = _pause(self.name, key, deadline, cancel_token, 0.2)
+                try:
+                    return future.result(timeout=wait)
+                except (TaskCancelled, SingleFlightTimeout):
+                    # Quem executava foi cancelado ou esgotou o seu prazo; esta
+                    # chamada não: executa de novo com o prazo que lhe resta
+                    return self._do(key, fn, deadline, cancel_token)
+                except FutureTimeout:
+                    # TimeoutError do próprio fn (futuro concluído) propaga-se
+                    if future.done():
+                        raise
+
+        # A chave sai de _inflight antes de o futuro ser resolvido: quem acorda
+        # com a falha do líder e repete _do já não encontra o futuro concluído
+        try:
+            with self._cross_worker_lock(key, deadline, cancel_token):
+                result = fn()
+        except BaseException as e:
+            self._forget(key)
+            future.set_exception(e)
+            raise
+        self._forget(key)
+        future.set_result(result)
+        return result
+
+    def _forget(self, key: str):
+        with self._lock:
+            del self._inflight[key]
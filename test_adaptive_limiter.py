@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Testes do limite adaptativo de concorrência (adaptive_limiter.py)
+"""
+
+import time
+import random
+import threading
+
+import anthropic
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+import autofund_ai_poc_v3 as engine
+from adaptive_limiter import AdaptiveLimiter, ConcurrencyLimitExceeded
+from cancellation import CancelToken, TaskCancelled
+from test_offline import create_mock_data
+
+REQUEST = httpx.Request("POST", "https://api.anthropic.com")
+
+
+def rate_limited():
+    raise anthropic.RateLimitError("429", response=httpx.Response(429, request=REQUEST), body=None)
+
+
+def rejected(operation):
+    return REGISTRY.get_sample_value("autofund_model_limiter_rejected_total", {"operation": operation}) or 0
+
+
+def test_additive_increase_on_healthy_responses():
+    limiter = AdaptiveLimiter(initial=4, max_limit=5)
+    for _ in range(4):
+        limiter.run("analise", lambda: "ok")
+    assert limiter.limit == pytest.approx(5, abs=0.1)
+    for _ in range(20):
+        limiter.run("analise", lambda: "ok")
+    assert limiter.limit == 5
+    assert limiter.inflight == 0
+
+
+def test_multiplicative_decrease_on_429_once_per_generation():
+    limiter = AdaptiveLimiter(initial=8)
+    generations = [limiter.acquire("extracao") for _ in range(3)]
+    error = anthropic.RateLimitError("429", response=httpx.Response(429, request=REQUEST), body=None)
+    # Três 429 do mesmo pico: uma única redução
+    for generation in generations:
+        limiter.release("extracao", generation, 1.0, error)
+    assert limiter.limit == 4
+    assert limiter.stats["decreases"] == 1
+
+    with pytest.raises(anthropic.RateLimitError):
+        limiter.run("extracao", rate_limited)
+    assert limiter.limit == 2
+
+
+def test_client_errors_do_not_change_limit():
+    limiter = AdaptiveLimiter(initial=8)
+    with pytest.raises(ValueError):
+        limiter.run("analise", lambda: int("x"))
+    assert limiter.limit == 8
+
+
+def test_latency_degradation_decreases_limit():
+    limiter = AdaptiveLimiter(initial=10, latency_backoff=0.5, latency_tolerance=2.0)
+    for _ in range(5):
+        limiter.release("analise", limiter.acquire("analise"), 1.0)
+    limit = limiter.limit
+    # Um pico isolado não chega para reduzir
+    limiter.release("analise", limiter.acquire("analise"), 5.0)
+    assert limiter.limit > limit
+    # Respostas lentas seguidas sim
+    limiter.release("analise", limiter.acquire("analise"), 5.0)
+    limit = limiter.limit
+    limiter.release("analise", limiter.acquire("analise"), 5.0)
+    assert limiter.limit == pytest.approx(limit * 0.5)
+
+
+def test_normal_latency_variance_keeps_limit_growing():
+    # Latências log-normais (mediana 8s, cauda até ~4x) como as das respostas do modelo
+    rng = random.Random(42)
+    limiter = AdaptiveLimiter(initial=8, max_limit=64)
+    for _ in range(500):
+        limiter.release("analise", limiter.acquire("analise"), rng.lognormvariate(2.08, 0.5))
+    assert limiter.stats["decreases"] == 0
+    assert limiter.limit > 30
+
+
+def test_wait_is_bounded_by_caller_timeout():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1, queue_timeout=60)
+    limiter.acquire("analise")
+    started = time.monotonic()
+    with pytest.raises(ConcurrencyLimitExceeded):
+        limiter.acquire("analise", timeout=0.05)
+    assert time.monotonic() - started < 1
+
+
+def test_cancel_wakes_waiter():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1, queue_timeout=60)
+    limiter.acquire("analise")
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(TaskCancelled):
+        limiter.acquire("analise", cancel_token=token)
+    assert time.monotonic() - started < 1
+    assert limiter.inflight == 1
+
+
+def test_waiters_are_capped_and_rejected_after_timeout():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1, queue_timeout=0.05)
+    release = threading.Event()
+    peak = []
+
+    def busy():
+        peak.append(limiter.inflight)
+        release.wait(2)
+
+    holder = threading.Thread(target=limiter.run, args=("upload", busy))
+    holder.start()
+    time.sleep(0.02)
+
+    before = rejected("upload")
+    with pytest.raises(ConcurrencyLimitExceeded):
+        limiter.run("upload", lambda: "sem vaga")
+    assert rejected("upload") == before + 1
+
+    release.set()
+    holder.join(2)
+    assert peak == [1]
+    assert limiter.run("upload", lambda: "ok") == "ok"
+
+
+def test_model_calls_go_through_limiter(tmp_path, monkeypatch):
+    limiter = AdaptiveLimiter(initial=2)
+    monkeypatch.setattr(engine, "MODEL_LIMITER", limiter)
+    seen = []
+
+    def fake_create(*args, **kwargs):
+        seen.append(limiter.inflight)
+        rate_limited()
+
+    analyzer = engine.FinancialAnalyzer("sk-test")
+    analyzer.analysis_cache = engine.AnalysisCache(tmp_path / "analises")
+    monkeypatch.setattr(analyzer.client.messages, "create", fake_create)
+    monkeypatch.setattr(engine, "MODEL_BREAKER", engine.CircuitBreaker("teste"))
+
+    analyzer.generate_analysis(engine.ExtracoesFinanceiras(**create_mock_data()))
+
+    assert seen == [1]
+    assert limiter.limit == 1
+    assert engine.is_unavailable(ConcurrencyLimitExceeded("analise", 1))
+
+
+def test_limited_calls_are_not_retried_by_the_sdk():
+    extractor = engine.DataExtractor("sk-test")
+    call, cancel = extractor._extraction_attempt({}, 5)
+    attempt_clients = list(extractor._attempt_clients)
+    cancel()
+    # Um 429 retido pelos retries do SDK seria visto pelo limitador como latência
+    assert extractor.client.max_retries == 0
+    assert [client.max_retries for client in attempt_clients] == [0]
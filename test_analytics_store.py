@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Testes do armazém analítico em Parquet (analytics_store.py)
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from analytics_store import AnalyticsStore, build_row
+from test_offline import create_mock_data, create_mock_analysis
+
+
+def make_row(periodo, nif="516807706", autonomia=0.5, when=None):
+    dados = {**create_mock_data(), "periodo": periodo, "nif": nif}
+    analise = {**create_mock_analysis(), "autonomia_financeira": autonomia}
+    return build_row(dados, analise, data_processamento=when)
+
+
+def test_rows_buffered_until_flush_threshold(tmp_path):
+    store = AnalyticsStore(tmp_path, flush_rows=3, flush_seconds=3600)
+    store.append(make_row("2022"))
+    store.append(make_row("2023"))
+    assert not list(tmp_path.rglob("*.parquet"))
+
+    store.append(make_row("2023", nif="123456789"))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["periodo=2022", "periodo=2023"]
+    assert len(store.query()) == 3
+
+
+def test_query_prunes_periods_and_keeps_latest(tmp_path):
+    store = AnalyticsStore(tmp_path, flush_rows=1000, flush_seconds=3600)
+    now = datetime.now()
+    store.append(make_row("2023", autonomia=0.1, when=now - timedelta(days=1)))
+    store.append(make_row("2023", autonomia=0.6, when=now))
+    store.append(make_row("2022", autonomia=0.3))
+    store.flush()
+
+    df = store.query(columns=["nif", "autonomia_financeira"], periodos=["2023"])
+    assert list(df.columns) == ["nif", "autonomia_financeira"]
+    assert df["autonomia_financeira"].tolist() == [0.6]
+    assert len(store.query(latest_only=False)) == 3
+
+
+def test_compact_merges_partition_files(tmp_path):
+    store = AnalyticsStore(tmp_path, flush_rows=1, flush_seconds=3600)
+    for nif in ("516807706", "123456789", "987654321"):
+        store.append(make_row("2023", nif=nif))
+    assert len(list((tmp_path / "periodo=2023").glob("*.parquet"))) == 3
+
+    store.compact()
+    assert len(list((tmp_path / "periodo=2023").glob("*.parquet"))) == 1
+    assert sorted(store.query()["nif"]) == ["123456789", "516807706", "987654321"]
+
+
+def test_backfill_from_json_reports(tmp_path):
+    outputs = tmp_path / "outputs"
+    outputs.mkdir()
+    report = {
+        "metadata": {"data_processamento": datetime.now().isoformat()},
+        "dados_financeiros": create_mock_data(),
+        "analise": create_mock_analysis(),
+    }
+    (outputs / "analysis_516807706_1.json").write_text(json.dumps(report), encoding="utf-8")
+    (outputs / "analysis_invalido.json").write_text("{}", encoding="utf-8")
+
+    store = AnalyticsStore(tmp_path / "store", flush_rows=1000, flush_seconds=3600)
+    assert store.backfill_from_json(str(outputs)) == 1
+    assert store.query()["periodo"].tolist() == ["2023"]
+
+
+def test_background_flush_without_new_appends(tmp_path):
+    store = AnalyticsStore(tmp_path, flush_rows=1000, flush_seconds=0.05)
+    store.start()
+    store.append(make_row("2023"))
+    try:
+        for _ in range(100):
+            if list(tmp_path.rglob("*.parquet")):
+                break
+            time.sleep(0.01)
+        assert len(store.query()) == 1
+    finally:
+        store.close()
+
+
+def test_pipeline_records_task_id(tmp_path):
+    from autofund_ai_poc_v3 import AutoFundAI, ExtracoesFinanceiras
+
+    store = AnalyticsStore(tmp_path, flush_rows=1000, flush_seconds=3600)
+    autofund = AutoFundAI("sk-test", task_id="task-123")
+    autofund.analytics_store = store
+    autofund._store_analytics(ExtracoesFinanceiras(**create_mock_data()), create_mock_analysis())
+    store.flush()
+    assert store.query(columns=["task_id"])["task_id"].tolist() == ["task-123"]
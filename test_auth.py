@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Testes da verificação de JWT com cache de claims (api/auth.py)
+"""
+
+import time
+import asyncio
+
+import pytest
+from jose import jwt, jwk
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+
+from api.auth import AuthError, ClaimsCache, TokenVerifier, check_auth_config
+
+SECRET = "segredo-de-teste"
+
+
+def make_token(sub="user-1", exp_in=3600, key=SECRET, algorithm="HS256", headers=None, **claims):
+    payload = {"sub": sub, "exp": int(time.time()) + exp_in, **claims}
+    return jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+
+
+def test_valid_token_is_verified_and_cached():
+    verifier = TokenVerifier(secret=SECRET, jwks_url="")
+    token = make_token(email="a@b.pt", tier="premium")
+
+    user = asyncio.run(verifier.authenticate(token))
+    assert user == {"user_id": "user-1", "email": "a@b.pt", "subscription_tier": "premium"}
+    assert verifier.lookup(token) == user
+
+
+@pytest.mark.parametrize("token", [
+    make_token(key="outro-segredo"),
+    make_token(exp_in=-10),
+    "nao.e.jwt",
+])
+def test_invalid_tokens_rejected(token):
+    verifier = TokenVerifier(secret=SECRET, jwks_url="")
+    with pytest.raises(AuthError) as exc:
+        asyncio.run(verifier.authenticate(token))
+    assert exc.value.status_code == 401
+    assert verifier.lookup(token) is None
+
+
+def test_cache_respects_token_expiry_and_size():
+    cache = ClaimsCache(max_size=2, ttl=300)
+    cache.put(b"a", {"user_id": "a"}, expires_at=110, now=100)
+    assert cache.get(b"a", now=105) == {"user_id": "a"}
+    assert cache.get(b"a", now=111) is None
+
+    for key in (b"x", b"y", b"z"):
+        cache.put(key, {}, None, now=100)
+    assert cache.get(b"x", now=100) is None
+    assert cache.get(b"z", now=100) == {}
+
+
+def rsa_jwk(kid):
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    public = jwk.construct(private.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo), "RS256").to_dict()
+    public["kid"] = kid
+    return pem, public
+
+
+def test_jwks_rotation_reloads_on_unknown_kid(monkeypatch):
+    pem_old, jwk_old = rsa_jwk("k1")
+    pem_new, jwk_new = rsa_jwk("k2")
+    published = [[jwk_old]]
+
+    verifier = TokenVerifier(algorithms=["RS256"], jwks_url="https://idp/jwks")
+    monkeypatch.setattr(verifier.jwks, "fetch", lambda: published[0])
+    verifier.jwks.min_refresh_seconds = 0
+
+    old_token = make_token(key=pem_old, algorithm="RS256", headers={"kid": "k1"})
+    assert asyncio.run(verifier.authenticate(old_token))["user_id"] == "user-1"
+
+    # O fornecedor roda as chaves: um kid novo força a recarga do JWKS
+    published[0] = [jwk_new]
+    new_token = make_token(sub="user-2", key=pem_new, algorithm="RS256", headers={"kid": "k2"})
+    assert asyncio.run(verifier.authenticate(new_token))["user_id"] == "user-2"
+
+
+def test_cache_hit_under_50_microseconds():
+    verifier = TokenVerifier(secret=SECRET, jwks_url="")
+    token = make_token()
+    asyncio.run(verifier.authenticate(token))
+
+    n = 20000
+    started = time.perf_counter()
+    for _ in range(n):
+        verifier.lookup(token)
+    per_call = (time.perf_counter() - started) / n
+
+    assert per_call < 50e-6, f"{per_call * 1e6:.1f}µs por autorização em cache"
+
+
+@pytest.mark.parametrize("secret", ["", "your-super-secret-key-change-in-production"])
+def test_refuses_to_verify_without_real_secret(secret):
+    with pytest.raises(RuntimeError):
+        TokenVerifier(secret=secret, jwks_url="")
+    with pytest.raises(RuntimeError):
+        check_auth_config("jwt", secret, "")
+    # Modo MVP ou com JWKS o segredo não é usado
+    check_auth_config("mvp", secret, "")
+    check_auth_config("jwt", secret, "https://idp/jwks")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Testes dos pacotes ZIP em streaming (api/bundles.py e /api/download/.../bundle)
+"""
+
+import io
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+from fastapi.testclient import TestClient
+
+import api.main as api_main
+from api.bundles import ZipEntry, stream_zip
+
+HEADERS = {"Authorization": "Bearer bundle-user-token"}
+
+
+def test_stream_zip_compresses_json_and_stores_xlsx(tmp_path):
+    json_path = tmp_path / "r.json"
+    json_path.write_text('{"a": 1}' * 5000)
+    xlsx_path = tmp_path / "r.xlsx"
+    xlsx_path.write_bytes(os.urandom(200_000))
+
+    chunks = list(stream_zip([ZipEntry("r.json", str(json_path)), ZipEntry("r.xlsx", str(xlsx_path))]))
+
+    # Blocos limitados: nunca o arquivo inteiro de uma vez
+    assert len(chunks) > 2 and max(len(c) for c in chunks) < 200_000
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.getinfo("r.json").compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo("r.xlsx").compress_type == zipfile.ZIP_STORED
+        assert archive.read("r.xlsx") == xlsx_path.read_bytes()
+        assert archive.read("r.json") == json_path.read_bytes()
+
+
+def add_task(tmp_path, task_id, user_id="bundle-u"):
+    excel = tmp_path / f"{task_id}.xlsx"
+    excel.write_bytes(b"PK excel")
+    report = tmp_path / f"{task_id}.json"
+    report.write_text('{"ok": true}')
+    pdf = tmp_path / f"{task_id}_ies.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    api_main.active_tasks[task_id] = {
+        "task_id": task_id, "user_id": user_id, "status": "completed",
+        "file_path": str(pdf), "created_at": datetime.now(),
+        "result": {"metadata": {"nif": task_id}, "ficheiros_gerados": {"excel": str(excel), "json": str(report)}},
+    }
+
+
+@pytest.fixture
+def client(tmp_path):
+    add_task(tmp_path, "t1")
+    add_task(tmp_path, "t2")
+    add_task(tmp_path, "t3", user_id="outro")
+    with TestClient(api_main.app) as test_client:
+        yield test_client
+    for task_id in ("t1", "t2", "t3"):
+        api_main.active_tasks.pop(task_id, None)
+
+
+def names(response):
+    return sorted(zipfile.ZipFile(io.BytesIO(response.content)).namelist())
+
+
+def test_single_task_bundle(client):
+    response = client.get("/api/download/t1/bundle", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    assert names(response) == ["aiparati_t1.json", "aiparati_t1.xlsx"]
+
+    response = client.get("/api/download/t1/bundle?include_pdf=true", headers=HEADERS)
+    assert names(response) == ["aiparati_t1.json", "aiparati_t1.xlsx", "ies.pdf"]
+
+
+def test_multi_task_bundle(client):
+    response = client.get("/api/download/bundle?task_ids=t1,t2", headers=HEADERS)
+    assert response.status_code == 200
+    assert names(response) == ["t1/aiparati_t1.json", "t1/aiparati_t1.xlsx",
+                               "t2/aiparati_t2.json", "t2/aiparati_t2.xlsx"]
+
+    assert client.get("/api/download/bundle?task_ids=t1,t3", headers=HEADERS).status_code == 403
+    assert client.get("/api/download/bundle?task_ids=t1,nao", headers=HEADERS).status_code == 404
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Testes do cancelamento de tasks (cancellation.py e /api/tasks/{id}/cancel)
+"""
+
+import os
+import time
+import asyncio
+import threading
+
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+from fastapi.testclient import TestClient
+
+import api.main as api_main
+from cancellation import CancelToken, TaskCancelled
+from single_flight import SingleFlight
+
+USER = "cancelus"
+
+
+def test_cancel_token_runs_callbacks_once():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: calls.append("cliente"))
+    token.check("extração")
+
+    token.cancel()
+    token.cancel()
+    assert calls == ["cliente"]
+    with pytest.raises(TaskCancelled):
+        token.check("análise")
+
+    # Registado depois do cancelamento: corre de imediato
+    token.on_cancel(lambda: calls.append("tarde"))
+    assert calls == ["cliente", "tarde"]
+
+
+def test_single_flight_follower_reruns_when_leader_cancelled():
+    flight = SingleFlight("teste")
+    leader_started = threading.Event()
+    release_leader = threading.Event()
+    results = {}
+
+    def cancelled_leader():
+        leader_started.set()
+        release_leader.wait(5)
+        raise TaskCancelled()
+
+    def leader():
+        with pytest.raises(TaskCancelled):
+            flight.do("k", cancelled_leader)
+
+    def follower():
+        results["follower"] = flight.do("k", lambda: "extraido")
+
+    first = threading.Thread(target=leader)
+    first.start()
+    leader_started.wait(5)
+    second = threading.Thread(target=follower)
+    second.start()
+    time.sleep(0.05)
+    release_leader.set()
+    first.join(5)
+    second.join(5)
+
+    assert results["follower"] == "extraido"
+    assert flight.stats["executions"] == 2
+
+
+@pytest.fixture
+def client(api_env, monkeypatch):
+    started = []
+
+    async def slow_processing(task_id):
+        started.append(task_id)
+        await asyncio.sleep(60)
+        # Nunca deve chegar aqui numa task cancelada
+        api_main.complete_task(api_main.active_tasks[task_id], {})
+
+    monkeypatch.setattr(api_main, "process_ies_async", slow_processing)
+    with TestClient(api_main.app) as test_client:
+        test_client.started = started
+        yield test_client
+
+
+@pytest.fixture
+def headers(auth_headers):
+    return auth_headers(USER)
+
+
+@pytest.fixture
+def upload_running(upload_ies, make_pdf):
+    def upload(client, pages=1):
+        task_id = upload_ies(client, USER, make_pdf(pages)).json()["task_id"]
+        for _ in range(200):
+            if task_id in api_main.job_scheduler.running:
+                break
+            time.sleep(0.01)
+        assert task_id in api_main.job_scheduler.running
+        return task_id
+    return upload
+
+
+def test_cancel_running_task_frees_slot_and_quota(client, upload_running, headers):
+    task_id = upload_running(client)
+    assert client.get("/api/quota", headers=headers).json()["reserved"] == 1
+
+    response = client.post(f"/api/tasks/{task_id}/cancel", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"task_id": task_id, "status": "cancelled"}
+
+    for _ in range(200):
+        if task_id not in api_main.job_scheduler.running:
+            break
+        time.sleep(0.01)
+    assert task_id not in api_main.job_scheduler.running
+
+    status = client.get(f"/api/status/{task_id}", headers=headers).json()
+    assert status["status"] == "cancelled"
+    assert "completed_at" in status
+    quota = client.get("/api/quota", headers=headers).json()
+    assert (quota["used"], quota["reserved"]) == (0, 0)
+
+    assert client.post(f"/api/tasks/{task_id}/cancel", headers=headers).status_code == 409
+
+
+def test_cancel_requires_owner(client, upload_running, headers):
+    task_id = upload_running(client)
+    other = {"Authorization": "Bearer outroxxx-token"}
+    assert client.post(f"/api/tasks/{task_id}/cancel", headers=other).status_code == 403
+    assert client.post("/api/tasks/inexistente/cancel", headers=headers).status_code == 404
+
+
+def test_delete_stops_processing(client, upload_running, headers):
+    task_id = upload_running(client, pages=2)
+    token = api_main.active_tasks[task_id].setdefault("cancel_token", CancelToken())
+
+    assert client.delete(f"/api/tasks/{task_id}", headers=headers).status_code == 200
+    assert token.cancelled
+    assert task_id not in api_main.active_tasks
+    for _ in range(200):
+        if task_id not in api_main.job_scheduler.running:
+            break
+        time.sleep(0.01)
+    assert task_id not in api_main.job_scheduler.running
+    assert client.get("/api/quota", headers=headers).json()["reserved"] == 0
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Testes do circuit breaker da API do modelo (circuit_breaker.py)
+"""
+
+import os
+import asyncio
+from datetime import datetime
+
+import anthropic
+import httpx
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+import autofund_ai_poc_v3 as engine
+import api.main as api_main
+from autofund_ai_poc_v3 import AutoFundAI, AnalysisCache, ExtractionCache, ExtracoesFinanceiras, FinancialAnalyzer
+from circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, HALF_OPEN, OPEN
+from test_offline import create_mock_data
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail():
+    raise ConnectionError("API indisponível")
+
+
+def make_breaker(clock, **kwargs):
+    options = dict(window=60, min_calls=4, error_rate=0.5, slow_call=10, slow_rate=0.8,
+                   open_seconds=30, probes=2, clock=clock)
+    options.update(kwargs)
+    return CircuitBreaker("teste", **options)
+
+
+def test_trips_on_error_rate_and_short_circuits():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    breaker.call(lambda: "ok")
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+
+    assert breaker.state == OPEN
+    calls = []
+    with pytest.raises(CircuitOpen) as excinfo:
+        breaker.call(lambda: calls.append(1))
+    assert not calls
+    assert excinfo.value.retry_after == pytest.approx(30)
+
+
+def test_trips_on_slow_calls():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+
+    def slow():
+        clock.now += 15
+        return "lento"
+
+    for _ in range(4):
+        breaker.call(slow)
+    assert breaker.state == OPEN
+
+
+def test_half_open_probes_close_or_reopen():
+    clock = FakeClock()
+    breaker = make_breaker(clock, min_calls=1, error_rate=1.0)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.state == OPEN
+
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() and breaker.allow()
+    # Sondas esgotadas: os restantes pedidos continuam recusados
+    assert not breaker.allow()
+    breaker.record(False, 1)
+    breaker.record(False, 1)
+    assert breaker.state == CLOSED
+
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    clock.now += 30
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.state == OPEN
+
+
+def test_ignored_errors_do_not_trip():
+    breaker = make_breaker(FakeClock(), min_calls=1)
+    with pytest.raises(ValueError):
+        breaker.call(lambda: int("x"), is_failure=lambda e: not isinstance(e, ValueError))
+    assert breaker.state == CLOSED
+
+
+def test_model_failures_classification():
+    request = httpx.Request("POST", "https://api.anthropic.com")
+    assert engine.is_model_failure(anthropic.APITimeoutError(request=request))
+    overloaded = anthropic.APIStatusError("sobrecarga", response=httpx.Response(529, request=request), body=None)
+    assert engine.is_model_failure(overloaded)
+    bad_request = anthropic.BadRequestError("inválido", response=httpx.Response(400, request=request), body=None)
+    assert not engine.is_model_failure(bad_request)
+
+
+@pytest.fixture
+def open_breaker(monkeypatch):
+    breaker = CircuitBreaker("teste", min_calls=1, error_rate=1.0, open_seconds=60)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    monkeypatch.setattr(engine, "MODEL_BREAKER", breaker)
+    return breaker
+
+
+def test_open_circuit_uses_deterministic_analysis(tmp_path, monkeypatch, open_breaker):
+    analyzer = FinancialAnalyzer("sk-test")
+    analyzer.analysis_cache = AnalysisCache(tmp_path / "analises")
+
+    def unexpected(*args, **kwargs):
+        raise AssertionError("o modelo não deve ser chamado com o circuito aberto")
+
+    monkeypatch.setattr(analyzer.client.messages, "create", unexpected)
+    analysis = analyzer.generate_analysis(ExtracoesFinanceiras(**create_mock_data()))
+    assert analysis.memoria_descritiva
+
+
+def test_open_circuit_defers_extraction(tmp_path, monkeypatch, open_breaker):
+    autofund = AutoFundAI("sk-test")
+    autofund.extraction_cache = ExtractionCache(tmp_path / "cache")
+    monkeypatch.setattr(autofund.extractor.client.beta.files, "upload", fail)
+    pdf = tmp_path / "ies.pdf"
+    pdf.write_bytes(b"%PDF-1.4 circuito")
+
+    with pytest.raises(CircuitOpen):
+        autofund.extract(str(pdf))
+
+
+def test_deferred_task_is_rescheduled(monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(api_main, "DEFER_MIN_SECONDS", 0.01)
+    monkeypatch.setattr(api_main, "schedule_task", lambda task: scheduled.append(task["task_id"]))
+    task = {"task_id": "adiada", "user_id": "u1", "status": "analyzing", "created_at": datetime.now()}
+    cancelled = {"task_id": "cancelada", "user_id": "u1", "status": "analyzing", "created_at": datetime.now()}
+
+    async def scenario():
+        for t in (task, cancelled):
+            api_main.add_task(t)
+            api_main.defer_task(t, 0)
+        assert api_main.status_head(task)["retry_at"]
+        cancelled["status"] = "cancelled"
+        await asyncio.sleep(0.05)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        api_main.remove_task(task)
+        api_main.remove_task(cancelled)
+
+    assert scheduled == ["adiada"]
+    assert task["status"] == "uploaded"
+
+
+def test_overload_reaches_breaker_on_first_response(tmp_path, monkeypatch):
+    breaker = CircuitBreaker("teste", min_calls=1, error_rate=1.0, open_seconds=60)
+    monkeypatch.setattr(engine, "MODEL_BREAKER", breaker)
+    request = httpx.Request("POST", "https://api.anthropic.com")
+    calls = []
+
+    def overloaded(*args, **kwargs):
+        calls.append(kwargs)
+        raise anthropic.APIStatusError("sobrecarga", response=httpx.Response(529, request=request), body=None)
+
+    analyzer = FinancialAnalyzer("sk-test")
+    analyzer.analysis_cache = AnalysisCache(tmp_path / "analises")
+    monkeypatch.setattr(analyzer.client.messages, "create", overloaded)
+
+    analyzer.generate_analysis(ExtracoesFinanceiras(**create_mock_data()))
+
+    # Sem retries do SDK um pedido é uma chamada e o circuito abre à primeira falha
+    assert analyzer.client.max_retries == 0
+    assert len(calls) == 1
+    assert breaker.state == OPEN
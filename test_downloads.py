@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Testes das respostas de download (ETag, 304, Range, X-Accel-Redirect)
+"""
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import api.downloads as downloads
+from api.downloads import content_etag, file_download_response, parse_range
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def served(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloads, "OUTPUT_ROOT", tmp_path)
+    path = tmp_path / "relatorio.xlsx"
+    path.write_bytes(CONTENT)
+
+    app = FastAPI()
+
+    @app.get("/file")
+    async def get_file(request: Request):
+        return file_download_response(request, str(path), "aiparati_1.xlsx")
+
+    return TestClient(app), path
+
+
+def test_full_download_has_strong_etag_and_mime(served):
+    client, path = served
+    response = client.get("/file")
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["etag"] == content_etag(str(path))
+    assert not response.headers["etag"].startswith("W/")
+    assert response.headers["content-type"].startswith("application/vnd.openxmlformats")
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_if_none_match_returns_304(served):
+    client, _ = served
+    etag = client.get("/file").headers["etag"]
+
+    response = client.get("/file", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    path_changed = served[1]
+    path_changed.write_bytes(CONTENT + b"x")
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_range_requests(served):
+    client, _ = served
+
+    response = client.get("/file", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+
+    assert client.get("/file", headers={"Range": "bytes=-10"}).content == CONTENT[-10:]
+    assert client.get("/file", headers={"Range": "bytes=10000-"}).content == CONTENT[10000:]
+
+    response = client.get("/file", headers={"Range": f"bytes={len(CONTENT)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+    # If-Range com ETag antigo: ficheiro completo
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": '"antigo"'})
+    assert response.status_code == 200 and response.content == CONTENT
+
+
+def test_parse_range_ignores_unsupported_forms():
+    assert parse_range(None, 100) is None
+    assert parse_range("items=0-1", 100) is None
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("bytes=90-500", 100) == (90, 99)
+
+
+def test_accel_redirect_mode(served, monkeypatch):
+    client, path = served
+    monkeypatch.setattr(downloads, "DOWNLOAD_ACCEL_PREFIX", "/_protected/outputs/")
+
+    response = client.get("/file")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == "/_protected/outputs/relatorio.xlsx"
+    assert response.headers["etag"] == content_etag(str(path))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Testes da renderização Excel em pool de processos (excel_pool.py)
+"""
+
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from openpyxl import load_workbook
+
+from autofund_ai_poc_v3 import ExcelGenerator, ExtracoesFinanceiras, AnaliseFinanceira
+from create_template import create_iapmei_template
+from excel_pool import ExcelRenderPool
+from test_offline import create_mock_data, create_mock_analysis
+
+
+@pytest.fixture
+def template_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    create_iapmei_template()
+    return str(tmp_path / "template_iapmei.xlsx")
+
+
+def sheet_values(path):
+    wb = load_workbook(path)
+    return {ws.title: [[c.value for c in row] for row in ws.iter_rows()] for ws in wb.worksheets}
+
+
+def test_cached_template_matches_fresh_scan(template_path, tmp_path):
+    data = ExtracoesFinanceiras(**create_mock_data())
+    analysis = AnaliseFinanceira(**create_mock_analysis())
+    generator = ExcelGenerator(template_path)
+
+    generator.fill_template(data, analysis, str(tmp_path / "a.xlsx"))
+    wb, positions = generator.load_template()
+    assert positions["NIF"] is not None
+
+    generator.fill_template(data, analysis, str(tmp_path / "b.xlsx"))
+    assert sheet_values(tmp_path / "a.xlsx") == sheet_values(tmp_path / "b.xlsx")
+
+
+def test_pool_renders_same_workbook_and_json(template_path, tmp_path):
+    data = ExtracoesFinanceiras(**create_mock_data())
+    analysis = AnaliseFinanceira(**create_mock_analysis())
+    ExcelGenerator(template_path).fill_template(data, analysis, str(tmp_path / "local.xlsx"))
+
+    pool = ExcelRenderPool(template_path, max_workers=1)
+    try:
+        pool.warm_up()
+        report = {"metadata": {"nif": data.nif}}
+        paths = pool.render(
+            data.model_dump(), analysis.model_dump(), report,
+            str(tmp_path / "pool.xlsx"), str(tmp_path / "pool.json"), timeout=60
+        )
+    finally:
+        pool.shutdown()
+
+    assert paths == {"excel": str(tmp_path / "pool.xlsx"), "json": str(tmp_path / "pool.json")}
+    assert os.path.exists(paths["json"])
+    assert sheet_values(tmp_path / "local.xlsx") == sheet_values(paths["excel"])
+
+
+def render_args(tmp_path, name):
+    data = ExtracoesFinanceiras(**create_mock_data())
+    analysis = AnaliseFinanceira(**create_mock_analysis())
+    return (data.model_dump(), analysis.model_dump(), {"metadata": {"nif": data.nif}},
+            str(tmp_path / f"{name}.xlsx"), str(tmp_path / f"{name}.json"))
+
+
+def test_pool_recovers_from_dead_worker_and_timeout(template_path, tmp_path):
+    pool = ExcelRenderPool(template_path, max_workers=1)
+    try:
+        pool.warm_up()
+        # Um worker que morre parte o executor
+        with pytest.raises(BrokenProcessPool):
+            pool._executor.submit(os._exit, 1).result(timeout=60)
+        with pytest.raises(BrokenProcessPool):
+            pool.render(*render_args(tmp_path, "partido"), timeout=60)
+        assert pool.render(*render_args(tmp_path, "recriado"), timeout=60)["excel"].endswith("recriado.xlsx")
+
+        with pytest.raises(TimeoutError):
+            pool.render(*render_args(tmp_path, "lento"), timeout=0)
+        assert os.path.exists(pool.render(*render_args(tmp_path, "depois"), timeout=60)["json"])
+    finally:
+        pool.shutdown()
+
+
+def test_engine_renders_in_process_when_pool_is_broken(template_path, tmp_path, monkeypatch):
+    import autofund_ai_poc_v3 as engine
+
+    class BrokenPool:
+        def render(self, *args, **kwargs):
+            raise BrokenProcessPool("worker morreu")
+
+    monkeypatch.setattr(engine, "OUTPUT_DIR", tmp_path)
+    autofund = engine.AutoFundAI("sk-test", render_pool=BrokenPool())
+    report = autofund._render_outputs(ExtracoesFinanceiras(**create_mock_data()),
+                                      AnaliseFinanceira(**create_mock_analysis()))
+    assert os.path.exists(report["ficheiros_gerados"]["excel"])
+    assert os.path.exists(report["ficheiros_gerados"]["json"])
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Testes dos pedidos de cobertura na extração (hedging.py)
+"""
+
+import json
+import time
+import threading
+
+import pytest
+
+from autofund_ai_poc_v3 import DataExtractor
+from hedging import HedgePolicy
+from test_offline import create_mock_data
+
+
+def warm(policy, latency=0.01, samples=20):
+    for _ in range(samples):
+        policy.record(latency)
+        policy.stats["requests"] += 1
+
+
+def attempt(result, delay=0.0, aborted=None, error=None):
+    cancelled = threading.Event()
+
+    def call():
+        if cancelled.wait(delay):
+            raise ConnectionError("abortado")
+        if error is not None:
+            raise error
+        return result
+
+    def abort():
+        cancelled.set()
+        if aborted is not None:
+            aborted.append(result)
+
+    return call, abort
+
+
+def test_no_hedging_until_threshold_is_known():
+    policy = HedgePolicy("teste", min_samples=5)
+    assert policy.threshold() is None
+    assert policy.run(lambda: attempt("ok")) == "ok"
+    assert policy.stats["hedges"] == 0
+    assert len(policy._latencies) == 1
+
+
+def test_failures_do_not_feed_the_threshold():
+    policy = HedgePolicy("teste", min_samples=5)
+    with pytest.raises(ConnectionError):
+        policy.run(lambda: attempt("x", error=ConnectionError("429")))
+    assert len(policy._latencies) == 0
+
+    warm(policy, samples=5)
+    with pytest.raises(ConnectionError):
+        policy.run(lambda: attempt("x", error=ConnectionError("429")))
+    assert len(policy._latencies) == 5
+
+
+def test_slow_primary_is_hedged_and_aborted():
+    policy = HedgePolicy("teste", budget=0.5)
+    warm(policy)
+    aborted = []
+    attempts = iter([attempt("original", delay=5, aborted=aborted), attempt("duplicado")])
+
+    started = time.monotonic()
+    assert policy.run(lambda: next(attempts)) == "duplicado"
+    assert time.monotonic() - started < 1
+    assert aborted == ["original"]
+    assert policy.stats["hedges"] == 1 and policy.stats["hedge_wins"] == 1
+
+
+def test_fast_primary_is_not_hedged():
+    policy = HedgePolicy("teste", budget=0.5)
+    warm(policy, latency=1.0)
+    assert policy.run(lambda: attempt("original", delay=0.01)) == "original"
+    assert policy.stats["hedges"] == 0
+
+
+def test_hedge_budget_caps_duplicates():
+    policy = HedgePolicy("teste", budget=0.05)
+    warm(policy, latency=0.001, samples=19)
+    made = []
+
+    def make():
+        made.append(1)
+        return attempt("r", delay=0.02)
+
+    for _ in range(2):
+        policy.run(make)
+
+    # 21 pedidos com orçamento de 5%: um único duplicado
+    assert policy.stats["hedges"] == 1
+    assert len(made) == 3
+    assert policy.hedge_rate() == pytest.approx(1 / 21)
+
+
+def test_error_raised_when_every_attempt_fails():
+    policy = HedgePolicy("teste", budget=1.0)
+    warm(policy)
+    attempts = iter([attempt(None, delay=0.05, error=TimeoutError("primeiro")),
+                     attempt(None, error=TimeoutError("duplicado"))])
+    with pytest.raises(TimeoutError):
+        policy.run(lambda: next(attempts))
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.content = [type("Block", (), {"text": text})()]
+
+
+def test_extractor_routes_model_call_through_policy(monkeypatch):
+    policy = HedgePolicy("teste", budget=1.0)
+    extractor = DataExtractor("sk-test", hedging=policy)
+    extractor.file_id = "file-1"
+    requests = []
+
+    def fake_attempt(request, timeout):
+        requests.append((request["model"], timeout))
+        return attempt(FakeMessage(json.dumps(create_mock_data())))
+
+    monkeypatch.setattr(extractor, "_extraction_attempt", fake_attempt)
+
+    data = extractor.extract_financial_data(timeout=30)
+    assert data["nif"] == create_mock_data()["nif"]
+    assert requests and requests[0][1] == 30
+    assert policy.stats["requests"] == 1
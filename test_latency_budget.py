@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Testes do orçamento de latência por etapa (latency_budget.py)
+"""
+
+import hashlib
+import threading
+
+import anthropic
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+import autofund_ai_poc_v3 as engine_module
+from autofund_ai_poc_v3 import AutoFundAI, AnalysisCache, ExtractionCache, ExtracoesFinanceiras, FinancialAnalyzer
+from latency_budget import LatencyBudget, BudgetExceeded, request_options
+from single_flight import SingleFlight, SingleFlightTimeout
+from test_offline import create_mock_data
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stage_timeouts_split_and_roll_forward():
+    clock = FakeClock()
+    budget = LatencyBudget(100, clock=clock)
+
+    assert budget.stage_timeout("upload") == pytest.approx(10)
+    # Upload rápido: o que sobrou é repartido pelas etapas seguintes
+    clock.now += 1
+    assert budget.stage_timeout("extracao") == pytest.approx(99 * 0.45 / 0.9)
+    # Upload e extração juntos (espera por uma extração partilhada)
+    assert budget.stage_timeout("upload", "extracao") == pytest.approx(99 * 0.55)
+    clock.now += 200
+    assert budget.remaining() == 0
+    assert budget.stage_timeout("analise") == 0
+
+
+def test_for_tier_and_request_options():
+    # Planos pagos esperam mais antes de cair na análise determinística
+    assert LatencyBudget.for_tier("free").total < LatencyBudget.for_tier("premium").total \
+        < LatencyBudget.for_tier("enterprise").total
+    assert LatencyBudget.for_tier("desconhecido").total == LatencyBudget.for_tier("free").total
+    assert request_options(None) == {}
+    assert request_options(12.5) == {"timeout": 12.5}
+
+
+def exceeded(stage):
+    return REGISTRY.get_sample_value("autofund_latency_budget_exceeded_total", {"stage": stage}) or 0
+
+
+def test_mark_exceeded_counts_once_per_stage():
+    budget = LatencyBudget(10)
+    before = exceeded("renderizacao")
+    budget.observe("renderizacao", 3.0, 1.0)
+    budget.observe("renderizacao", 3.0, 1.0)
+    assert budget.exceeded == ["renderizacao"]
+    assert exceeded("renderizacao") == before + 1
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    analyzer = FinancialAnalyzer("sk-test")
+    analyzer.analysis_cache = AnalysisCache(tmp_path / "analises")
+    return analyzer
+
+
+def test_exhausted_budget_skips_model_and_falls_back(analyzer, monkeypatch):
+    def unexpected(*args, **kwargs):
+        raise AssertionError("o modelo não deve ser chamado sem orçamento")
+
+    monkeypatch.setattr(analyzer.client.messages, "create", unexpected)
+    clock = FakeClock()
+    budget = LatencyBudget(10, clock=clock)
+    clock.now += 10
+
+    analysis = analyzer.generate_analysis(ExtracoesFinanceiras(**create_mock_data()), budget=budget)
+
+    assert analysis.memoria_descritiva
+    assert budget.exceeded == ["analise"]
+
+
+def test_analysis_timeout_is_propagated_and_degrades(analyzer, monkeypatch):
+    seen = {}
+
+    def slow_model(*args, **kwargs):
+        seen["timeout"] = kwargs.get("timeout")
+        raise anthropic.APITimeoutError(request=httpx.Request("POST", "https://api.anthropic.com"))
+
+    monkeypatch.setattr(analyzer.client.messages, "create", slow_model)
+    budget = LatencyBudget(100)
+
+    analysis = analyzer.generate_analysis(ExtracoesFinanceiras(**create_mock_data()), budget=budget)
+
+    assert 0 < seen["timeout"] <= 100 * 0.35 / 0.45
+    assert analysis.nivel_risco
+    assert budget.exceeded == ["analise"]
+
+
+def test_extraction_timeout_fails_with_budget_error(tmp_path, monkeypatch):
+    engine = AutoFundAI("sk-test", latency_budget=LatencyBudget(100))
+    engine.extraction_cache = ExtractionCache(tmp_path / "cache")
+    timeouts = []
+
+    def upload(pdf_path, timeout=None):
+        timeouts.append(timeout)
+
+    def extract(timeout=None):
+        timeouts.append(timeout)
+        raise anthropic.APITimeoutError(request=httpx.Request("POST", "https://api.anthropic.com"))
+
+    monkeypatch.setattr(engine.extractor, "upload_pdf", upload)
+    monkeypatch.setattr(engine.extractor, "extract_financial_data", extract)
+    pdf = tmp_path / "ies.pdf"
+    pdf.write_bytes(b"%PDF-1.4 orcamento")
+
+    with pytest.raises(BudgetExceeded) as excinfo:
+        engine.extract(str(pdf))
+
+    assert excinfo.value.stage == "extracao"
+    assert timeouts[0] == pytest.approx(10, abs=0.5)
+    # O upload não gastou nada: a extração fica com a parte dele
+    assert timeouts[1] == pytest.approx(50, abs=1)
+
+
+def test_waiting_for_shared_extraction_is_bounded_by_budget(tmp_path, monkeypatch):
+    flight = SingleFlight("extracao", tmp_path / "locks")
+    monkeypatch.setattr(engine_module, "EXTRACTION_FLIGHT", flight)
+    pdf = tmp_path / "ies.pdf"
+    pdf.write_bytes(b"%PDF-1.4 partilhado")
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=(
+        hashlib.sha256(pdf.read_bytes()).hexdigest(), lambda: release.wait(5) and create_mock_data()))
+    leader.start()
+    try:
+        engine = AutoFundAI("sk-test", latency_budget=LatencyBudget(0.2))
+        engine.extraction_cache = ExtractionCache(tmp_path / "cache")
+        with pytest.raises(BudgetExceeded) as excinfo:
+            engine.extract(str(pdf))
+        assert excinfo.value.stage == "extracao"
+        assert engine.latency_budget.exceeded == ["extracao"]
+    finally:
+        release.set()
+        leader.join(5)
+
+
+def test_waiting_for_shared_analysis_uses_stage_timeout(analyzer, monkeypatch):
+    seen = {}
+
+    class BusyFlight:
+        def do(self, key, fn, timeout=None, cancel_token=None):
+            seen["timeout"] = timeout
+            raise SingleFlightTimeout("analise", key)
+
+    monkeypatch.setattr(engine_module, "ANALYSIS_FLIGHT", BusyFlight())
+    budget = LatencyBudget(100)
+
+    analysis = analyzer.generate_analysis(ExtracoesFinanceiras(**create_mock_data()), budget=budget)
+
+    assert 0 < seen["timeout"] <= 100 * 0.35 / 0.45
+    assert analysis.memoria_descritiva
+    assert budget.exceeded == ["analise"]
+
+
+
+def test_sdk_does_not_retry_inside_the_stage_budget(analyzer):
+    # Os 2 retries do SDK (com backoff) triplicavam o tempo de cada etapa
+    assert analyzer.client.max_retries == 0
+    assert AutoFundAI("sk-test").extractor.client.max_retries == 0
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Testes do endpoint de métricas Prometheus (/api/system/metrics)
+"""
+
+import os
+
+os.environ["MOCK_MODE"] = "true"
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api.auth as auth
+import api.main as api_main
+
+client = TestClient(api_main.app)
+
+
+@pytest.fixture
+def metrics_token(monkeypatch):
+    monkeypatch.setattr(auth, "METRICS_TOKEN", "scraper-secret")
+    return {"Authorization": "Bearer scraper-secret"}
+
+
+def test_metrics_require_authentication():
+    assert client.get("/api/system/metrics").status_code in (401, 403)
+
+
+def test_metrics_reject_user_tokens(auth_headers, metrics_token):
+    # Em modo mvp qualquer bearer é um utilizador válido; as métricas não aceitam nenhum
+    assert client.get("/api/system/metrics", headers=auth_headers("metrics")).status_code == 403
+
+
+def test_metrics_closed_without_configured_token(monkeypatch):
+    monkeypatch.setattr(auth, "METRICS_TOKEN", "")
+    response = client.get("/api/system/metrics", headers={"Authorization": "Bearer "})
+    assert response.status_code in (401, 403)
+    assert not auth.is_metrics_token("")
+
+
+def test_metrics_exposition_format(metrics_token):
+    response = client.get("/api/system/metrics", headers=metrics_token)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=")
+    assert "# TYPE autofund_active_tasks gauge" in response.text
+    assert "# HELP autofund_circuit_transitions_total" in response.text
+
+
+def test_metrics_aggregate_worker_files(tmp_path, monkeypatch, metrics_token):
+    import subprocess
+    import sys
+
+    # Outro worker: escreve as suas métricas no diretório partilhado
+    code = "from prometheus_client import Counter; Counter('autofund_worker_probe', 'x').inc(3)"
+    subprocess.run([sys.executable, "-c", code], check=True,
+                   env={**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)})
+    monkeypatch.setattr(api_main, "PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+
+    response = client.get("/api/system/metrics", headers=metrics_token)
+    assert response.status_code == 200
+    assert "autofund_worker_probe_total 3.0" in response.text
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Testes da fila offline (api/offline_queue.py)
+"""
+
+import os
+import time
+import asyncio
+import functools
+from datetime import datetime
+
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+from fastapi.testclient import TestClient
+
+import api.main as api_main
+from api.offline_queue import OfflineStore, OfflineDrainer
+
+USER = "offlineu"
+
+
+def test_store_roundtrip_drops_transient_fields(tmp_path):
+    store = OfflineStore(str(tmp_path / "fila.db"))
+    created = datetime(2024, 5, 1, 10, 30)
+    store.put({"task_id": "t1", "status": "queued_offline", "created_at": created,
+               "status_body": b"{}", "version": 3, "attempts": 1}, "sem_api_key")
+    store.put({"task_id": "t2", "status": "queued_offline", "created_at": created}, "falha_api")
+
+    # Outra ligação ao mesmo ficheiro, como depois de um reinício
+    tasks = OfflineStore(store.path).load()
+    assert [t["task_id"] for t in tasks] == ["t1", "t2"]
+    assert tasks[0]["created_at"] == created
+    assert tasks[0]["attempts"] == 1
+    assert "status_body" not in tasks[0] and "version" not in tasks[0]
+
+    store.remove("t1")
+    assert [t["task_id"] for t in store.load()] == ["t2"]
+
+
+def test_rows_are_claimed_by_a_single_worker(tmp_path):
+    path = str(tmp_path / "fila.db")
+    first, second = OfflineStore(path), OfflineStore(path)
+    first.put({"task_id": "t1", "status": "queued_offline"}, "falha_api")
+
+    # A linha é de quem a criou enquanto a posse for renovada
+    assert second.claim() == []
+    assert [t["task_id"] for t in first.claim()] == ["t1"]
+
+    first.release()
+    assert [t["task_id"] for t in second.claim()] == ["t1"]
+    assert first.claim() == []
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    path = str(tmp_path / "fila.db")
+    dead = OfflineStore(path, lease=0)
+    dead.put({"task_id": "t1", "status": "queued_offline"}, "falha_api")
+    time.sleep(0.01)
+    assert [t["task_id"] for t in OfflineStore(path).claim()] == ["t1"]
+
+
+def test_defer_gives_up_after_max_attempts(api_env):
+    task = {"task_id": "t-defer", "status": "extracting", "attempts": api_main.OFFLINE_MAX_ATTEMPTS}
+    assert api_main.defer_task(task, 1) is False
+    assert task["status"] == "extracting"
+
+
+def test_drainer_waits_for_availability_and_paces():
+    async def scenario():
+        state = {"up": False}
+        resubmitted = []
+
+        def resubmit(task):
+            if task.get("cancelled"):
+                return False
+            resubmitted.append((task["task_id"], time.monotonic()))
+            return True
+
+        drainer = OfflineDrainer(lambda: state["up"], resubmit, rate=20, probe_interval=0.01)
+        runner = asyncio.create_task(drainer.run())
+        for task in ({"task_id": "a"}, {"task_id": "b", "cancelled": True}, {"task_id": "c"}):
+            drainer.add(task)
+        await asyncio.sleep(0.05)
+        assert resubmitted == []
+
+        state["up"] = True
+        await asyncio.sleep(0.2)
+        runner.cancel()
+        return resubmitted
+
+    resubmitted = asyncio.run(scenario())
+    assert [task_id for task_id, _ in resubmitted] == ["a", "c"]
+    # Ritmo controlado: 20/s → pelo menos 50 ms entre reenvios
+    assert resubmitted[1][1] - resubmitted[0][1] >= 0.045
+
+
+@pytest.fixture
+def offline_api(api_env, monkeypatch):
+    state = {"up": False}
+    processed = []
+
+    async def record_processing(task_id):
+        processed.append(task_id)
+        api_main.set_task_status(api_main.active_tasks[task_id], "error")
+
+    monkeypatch.setattr(api_main, "process_ies_async", record_processing)
+    monkeypatch.setattr(api_main, "model_available", lambda: state["up"])
+    monkeypatch.setattr(api_main, "OfflineDrainer",
+                        functools.partial(OfflineDrainer, rate=100, probe_interval=0.01))
+    return state, processed
+
+
+def test_upload_persisted_while_api_down_and_drained_after_restart(offline_api, upload_ies, make_pdf,
+                                                                   auth_headers):
+    state, processed = offline_api
+    with TestClient(api_main.app) as client:
+        response = upload_ies(client, USER, make_pdf(3))
+        assert response.status_code == 200
+        task_id = response.json()["task_id"]
+        status = client.get(f"/api/status/{task_id}", headers=auth_headers(USER)).json()["status"]
+        assert status == "queued_offline"
+    assert processed == []
+
+    # Reinício: a task só existe na fila persistida
+    api_main.remove_task(api_main.active_tasks[task_id])
+    with TestClient(api_main.app) as client:
+        assert api_main.active_tasks[task_id]["status"] == "queued_offline"
+        state["up"] = True
+        for _ in range(200):
+            if processed:
+                break
+            time.sleep(0.01)
+        assert processed == [task_id]
+
+    # Task terminada: deixa de estar persistida
+    assert api_main.offline_store.load() == []
+
+
+def test_attempts_are_persisted_before_processing(api_env):
+    store = api_main.offline_store
+    task = {"task_id": "t-attempts", "status": "queued_offline", "attempts": 1}
+    store.put(task, "falha_api")
+    task["offline_persisted"] = True
+
+    api_main.record_attempt(task)
+    store.submit(lambda: None).result(5)
+    # Outro worker que reclame a linha (p.ex. após um crash a meio) vê a tentativa
+    assert [t["attempts"] for t in OfflineStore(store.path).load()] == [2]
+
+    # Linhas já removidas não são recriadas
+    store.remove("t-attempts")
+    store.update(task)
+    assert store.load() == []
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Testes da contabilização de quotas (api/quota.py)
+"""
+
+import os
+import asyncio
+from datetime import date, datetime, timezone
+
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+from fastapi.testclient import TestClient
+
+import api.main as api_main
+from api.quota import LocalQuotaLedger, QuotaExceeded, QuotaWriteBehind, QuotaStore, current_period
+
+OCTOBER = date(2024, 10, 1)
+
+
+def test_reserve_commit_release():
+    async def scenario():
+        ledger = LocalQuotaLedger(lambda: OCTOBER)
+        await ledger.load([("u1", 3, 5)])
+        await ledger.reserve("u1")
+        await ledger.reserve("u1")
+        with pytest.raises(QuotaExceeded):
+            await ledger.reserve("u1")
+
+        await ledger.release("u1")
+        await ledger.commit("u1")
+        usage = await ledger.usage("u1")
+        assert (usage.used, usage.reserved, usage.limit, usage.available) == (4, 0, 5, 1)
+        assert await ledger.drain_pending() == {(OCTOBER, "u1"): 1}
+        assert await ledger.drain_pending() == {}
+
+    asyncio.run(scenario())
+
+
+class FakeStore:
+    def __init__(self, rows=(), fail=False):
+        self.rows = list(rows)
+        self.fail = fail
+        self.applied = []
+
+    async def load(self, period):
+        return self.rows
+
+    async def apply(self, pending):
+        if self.fail:
+            raise ConnectionError("bd indisponível")
+        self.applied.append(dict(pending))
+
+
+def test_write_behind_batches_and_retries():
+    async def scenario():
+        ledger = LocalQuotaLedger(lambda: OCTOBER)
+        failing = QuotaWriteBehind(ledger, FakeStore(fail=True))
+        for user in ("a", "a", "b"):
+            await ledger.reserve(user)
+            await ledger.commit(user)
+
+        assert await failing.flush() == 0
+        store = FakeStore()
+        assert await QuotaWriteBehind(ledger, store).flush() == 2
+        assert store.applied == [{(OCTOBER, "a"): 2, (OCTOBER, "b"): 1}]
+
+    asyncio.run(scenario())
+
+
+def test_reconcile_keeps_unflushed_usage():
+    async def scenario():
+        ledger = LocalQuotaLedger()
+        await ledger.reserve("a")
+        await ledger.commit("a")
+        # A BD ainda não tem o consumo pendente
+        await QuotaWriteBehind(ledger, FakeStore(rows=[("a", 10, 20)])).reconcile()
+        usage = await ledger.usage("a")
+        assert (usage.used, usage.limit) == (11, 20)
+
+    asyncio.run(scenario())
+
+
+def test_usage_resets_each_month():
+    async def scenario():
+        period = [OCTOBER]
+        ledger = LocalQuotaLedger(lambda: period[0])
+        await ledger.load([("u1", 4, 5)])
+        await ledger.reserve("u1")
+        with pytest.raises(QuotaExceeded):
+            await ledger.reserve("u1")
+
+        period[0] = date(2024, 11, 1)
+        await ledger.commit("u1")
+        usage = await ledger.usage("u1")
+        assert (usage.used, usage.reserved, usage.limit) == (1, 0, 5)
+        assert await ledger.drain_pending() == {(date(2024, 11, 1), "u1"): 1}
+        # Reconciliação com dados de outro mês não repõe consumo antigo
+        await ledger.load([("u1", 4, 5)], OCTOBER)
+        assert (await ledger.usage("u1")).used == 1
+
+    asyncio.run(scenario())
+
+
+def test_current_period_is_utc_calendar_month():
+    assert current_period(datetime(2024, 10, 31, 23, 59, tzinfo=timezone.utc)) == OCTOBER
+
+
+def test_store_skips_ids_that_are_not_uuids():
+    class Conn:
+        executed = []
+
+        async def executemany(self, sql, records):
+            self.executed.extend(records)
+
+        def transaction(self):
+            return self
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+    class Pool:
+        conn = Conn()
+
+        def acquire(self):
+            return self.conn
+
+    async def scenario():
+        store = QuotaStore("postgresql://test")
+        store._pool = Pool()
+        user = "5f0c6c7e-2f3e-4a8b-9d0e-1a2b3c4d5e6f"
+        await store.apply({(OCTOBER, user): 2, (OCTOBER, "mockuser"): 1})
+        assert [(str(u), n, p) for u, n, p in Conn.executed] == [(user, 2, OCTOBER)]
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def client(api_env, monkeypatch):
+    async def no_processing(task_id):
+        return None
+
+    monkeypatch.setattr(api_main, "process_ies_async", no_processing)
+    with TestClient(api_main.app) as test_client:
+        yield test_client
+
+
+def test_upload_rejected_when_quota_exhausted(client, upload_ies, make_pdf, auth_headers):
+    asyncio.run(api_main.quota_ledger.load([("quotaus1", 4, 5)]))
+
+    assert upload_ies(client, "quotaus1", make_pdf(1)).status_code == 200
+    assert upload_ies(client, "quotaus1", make_pdf(2)).status_code == 402
+
+    assert client.get("/api/quota", headers=auth_headers("quotaus1")).json() == {
+        "used": 4, "reserved": 1, "limit": 5, "available": 0, "period": current_period().isoformat()}
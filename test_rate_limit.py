@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Testes da limitação de pedidos por utilizador (api/rate_limit.py)
+"""
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.rate_limit import LocalTokenBuckets, RateLimitMiddleware, endpoint_class
+
+LIMITS = {
+    "status": {"anonymous": (2, 1), "free": (3, 1), "premium": (10, 1)},
+    "upload": {"free": (1, 0.01)},
+}
+
+
+def test_token_bucket_refills_over_time():
+    buckets = LocalTokenBuckets()
+    assert buckets.acquire("k", 2, 1, now=0) == (True, 1, 0.0)
+    assert buckets.acquire("k", 2, 1, now=0)[0]
+    allowed, remaining, retry_after = buckets.acquire("k", 2, 1, now=0)
+    assert not allowed and remaining == 0 and retry_after == 1
+    assert buckets.acquire("k", 2, 1, now=1.0)[0]
+
+
+def test_endpoint_classes():
+    assert endpoint_class("/api/upload/multi") == "upload"
+    assert endpoint_class("/api/status/abc") == "status"
+    assert endpoint_class("/api/download/abc/excel") == "download"
+    assert endpoint_class("/health") == "default"
+    assert endpoint_class("/docs") is None
+
+
+def make_client():
+    app = FastAPI()
+
+    @app.get("/api/status/x")
+    async def status():
+        return {"ok": True}
+
+    @app.post("/api/upload")
+    async def upload():
+        return {"ok": True}
+
+    app.add_middleware(RateLimitMiddleware, limits=LIMITS, backend="local")
+    return TestClient(app)
+
+
+def test_per_user_limits_headers_and_429(monkeypatch):
+    import api.rate_limit as rate_limit
+    rate_limit.LOCAL_BUCKETS.clear()
+    client = make_client()
+    alice = {"Authorization": "Bearer alice-token"}
+
+    remaining = [client.get("/api/status/x", headers=alice).headers["x-rate-limit-remaining"]
+                 for _ in range(3)]
+    assert remaining == ["2", "1", "0"]
+
+    response = client.get("/api/status/x", headers=alice)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+    # Outro utilizador e outra classe de endpoint têm buckets próprios
+    assert client.get("/api/status/x", headers={"Authorization": "Bearer bobbytoken"}).status_code == 200
+    assert client.post("/api/upload", headers=alice).status_code == 200
+    assert client.post("/api/upload", headers=alice).status_code == 429
+
+
+def test_tier_from_authenticated_user(monkeypatch):
+    import api.rate_limit as rate_limit
+    rate_limit.LOCAL_BUCKETS.clear()
+
+    async def premium_user(token):
+        return {"user_id": token, "subscription_tier": "premium"}
+
+    monkeypatch.setattr(rate_limit, "authenticate", premium_user)
+    client = make_client()
+    headers = {"Authorization": "Bearer premium"}
+    assert client.get("/api/status/x", headers=headers).headers["x-rate-limit-remaining"] == "9"
+    # Sem token: limite anónimo por IP
+    assert client.get("/api/status/x").headers["x-rate-limit-remaining"] == "1"
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Testes do motor de regras de risco (risk_rules.py)
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from risk_rules import (
+    CompiledRuleSet, ConjuntoRegras, RiskRuleRegistry, DEFAULT_RISK_RULES, load_rule_file
+)
+
+
+def legacy_risk_level(ratios):
+    """Classificação original (escadas if/elif) usada como referência"""
+    risk_score = 0
+    if ratios['autonomia_financeira'] < 0.20:
+        risk_score += 3
+    elif ratios['autonomia_financeira'] < 0.30:
+        risk_score += 2
+    elif ratios['autonomia_financeira'] < 0.40:
+        risk_score += 1
+    if ratios['liquidez_geral'] < 1:
+        risk_score += 3
+    elif ratios['liquidez_geral'] < 1.5:
+        risk_score += 1
+    if ratios['margem_ebitda'] < 0.05:
+        risk_score += 2
+    elif ratios['margem_ebitda'] < 0.10:
+        risk_score += 1
+    if ratios['rentabilidade_ativos'] < 0:
+        risk_score += 3
+    if risk_score >= 7:
+        return "CRÍTICO"
+    elif risk_score >= 5:
+        return "ALTO"
+    elif risk_score >= 3:
+        return "MÉDIO"
+    return "BAIXO"
+
+
+@pytest.fixture
+def default_rules():
+    return CompiledRuleSet(ConjuntoRegras(**DEFAULT_RISK_RULES))
+
+
+@pytest.fixture
+def sample_ratios():
+    rng = np.random.default_rng(42)
+    n = 2000
+    frame = pd.DataFrame({
+        "autonomia_financeira": rng.uniform(-0.2, 0.8, n),
+        "liquidez_geral": rng.uniform(0, 3, n),
+        "margem_ebitda": rng.uniform(-0.1, 0.3, n),
+        "rentabilidade_ativos": rng.uniform(-0.1, 0.2, n),
+    })
+    # Valores exatamente nos limites
+    frame.loc[0] = [0.20, 1.0, 0.05, 0.0]
+    frame.loc[1] = [0.40, 1.5, 0.10, -0.0001]
+    return frame
+
+
+def test_default_rules_match_legacy_ladder(default_rules, sample_ratios):
+    for row in sample_ratios.to_dict(orient="records"):
+        assert default_rules.score(row).nivel_risco == legacy_risk_level(row)
+
+
+def test_batch_matches_single(default_rules, sample_ratios):
+    batch = default_rules.score_batch(sample_ratios)
+    for i, row in enumerate(sample_ratios.to_dict(orient="records")):
+        single = default_rules.score(row)
+        assert batch["nivel_risco"].iloc[i] == single.nivel_risco
+        assert batch["pontuacao"].iloc[i] == single.pontuacao
+        for rule_id, pts in single.contribuicoes.items():
+            assert batch[rule_id].iloc[i] == pts
+
+
+def test_contributions_sum_to_score(default_rules):
+    ratios = {
+        "autonomia_financeira": 0.25,
+        "liquidez_geral": 0.9,
+        "margem_ebitda": 0.07,
+        "rentabilidade_ativos": -0.01,
+    }
+    risk = default_rules.score(ratios)
+    assert risk.contribuicoes == {
+        "autonomia_financeira": 2,
+        "liquidez_geral": 3,
+        "margem_ebitda": 1,
+        "rentabilidade_negativa": 3,
+    }
+    assert risk.pontuacao == 9
+    assert risk.nivel_risco == "CRÍTICO"
+    assert risk.conjunto_regras == "pt2030_default"
+
+
+def test_missing_indicator_scores_zero(default_rules):
+    risk = default_rules.score({"autonomia_financeira": 0.1})
+    assert risk.contribuicoes["liquidez_geral"] == 0
+    assert risk.pontuacao == 3
+
+
+def test_invalid_ladder_rejected():
+    bad = json.loads(json.dumps(DEFAULT_RISK_RULES))
+    bad["regras"][0]["limites"] = [0.3, 0.2]
+    with pytest.raises(ValueError):
+        ConjuntoRegras(**bad)
+
+    bad = json.loads(json.dumps(DEFAULT_RISK_RULES))
+    bad["regras"][0]["pontos"] = [1, 0]
+    with pytest.raises(ValueError):
+        ConjuntoRegras(**bad)
+
+
+def test_registry_loads_programme_rule_sets(tmp_path):
+    aviso = {
+        "nome": "aviso_inovacao",
+        "regras": [
+            {"id": "autonomia", "indicador": "autonomia_financeira",
+             "limites": [0.15], "pontos": [5, 0]},
+        ],
+        "niveis": {"limites": [5], "classes": ["BAIXO", "ALTO"]},
+    }
+    (tmp_path / "aviso_inovacao.json").write_text(json.dumps(aviso), encoding="utf-8")
+    (tmp_path / "notas.txt").write_text("ignorado", encoding="utf-8")
+
+    registry = RiskRuleRegistry(str(tmp_path))
+    assert registry.names() == ["aviso_inovacao", "pt2030_default"]
+    assert registry.get("aviso_inovacao").score({"autonomia_financeira": 0.1}).nivel_risco == "ALTO"
+    assert registry.get().name == "pt2030_default"
+    with pytest.raises(KeyError):
+        registry.get("inexistente")
+
+
+def test_yaml_rule_file(tmp_path):
+    yaml = pytest.importorskip("yaml")
+    path = tmp_path / "aviso.yaml"
+    path.write_text(yaml.safe_dump(DEFAULT_RISK_RULES, allow_unicode=True), encoding="utf-8")
+    assert load_rule_file(path).nome == "pt2030_default"
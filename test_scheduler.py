@@ -0,0 +1,95 @@
+"""
+Testes do escalonador de tasks (weighted fair queueing por utilizador)
+"""
+
+import asyncio
+
+from api.scheduler import FairScheduler
+
+
+async def _noop():
+    pass
+
+
+def drain(scheduler, now=0.0):
+    order = []
+    while True:
+        job = scheduler._pop_next(now)
+        if job is None:
+            return order
+        order.append(job.task_id)
+
+
+def test_isolated_upload_not_stuck_behind_batch():
+    scheduler = FairScheduler(max_wait=1e9)
+    for i in range(50):
+        scheduler.submit(f"lote-{i}", "batch", "free", _noop)
+    scheduler.submit("sozinho", "interactive", "free", _noop)
+
+    order = drain(scheduler)
+    assert order.index("sozinho") <= 1
+    assert len(order) == 51
+
+
+def test_premium_gets_larger_share():
+    scheduler = FairScheduler(max_wait=1e9)
+    for i in range(10):
+        scheduler.submit(f"free-{i}", "u-free", "free", _noop)
+        scheduler.submit(f"premium-{i}", "u-premium", "premium", _noop)
+
+    first = drain(scheduler)[:9]
+    assert sum(t.startswith("premium") for t in first) == 6
+
+
+def test_aging_dispatches_oldest_job():
+    scheduler = FairScheduler(max_wait=10)
+    old = scheduler.submit("antiga", "u-free", "free", _noop)
+    for i in range(10):
+        scheduler.submit(f"ent-{i}", "u-enterprise", "enterprise", _noop)
+
+    # Sem exceder a espera máxima a etiqueta decide
+    assert scheduler._pop_next(old.enqueued_at + 1).task_id == "ent-0"
+    # Excedida, a task mais antiga passa à frente
+    assert scheduler._pop_next(old.enqueued_at + 10).task_id == "antiga"
+    assert len(scheduler) == 9
+
+
+def test_cancel_removes_queued_job():
+    scheduler = FairScheduler(max_wait=1e9)
+    scheduler.submit("a", "u1", "free", _noop)
+    scheduler.submit("b", "u2", "free", _noop)
+
+    assert scheduler.cancel("a") is True
+    assert scheduler.cancel("a") is False
+    assert drain(scheduler) == ["b"]
+    assert len(scheduler) == 0
+
+
+def test_workers_respect_concurrency_limit():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrent=2, max_wait=1e9)
+        scheduler.start()
+        active, peak, finished = 0, 0, []
+
+        def job(task_id):
+            async def run():
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+                finished.append(task_id)
+            return run
+
+        for i in range(6):
+            scheduler.submit(f"t{i}", f"u{i % 3}", "free", job(f"t{i}"))
+        for _ in range(200):
+            if len(finished) == 6:
+                break
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+        return peak, finished
+
+    peak, finished = asyncio.run(scenario())
+    assert peak == 2
+    assert sorted(finished) == [f"t{i}" for i in range(6)]
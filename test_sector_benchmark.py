@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Testes do benchmark setorial por CAE (sector_benchmark.py)
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sector_benchmark import SectorBenchmark, build_index, save_index, cae_division, size_class
+
+
+@pytest.fixture
+def peers_frame():
+    rng = np.random.default_rng(7)
+    n = 400
+    return pd.DataFrame({
+        "cae": rng.choice(["71120 - Engenharia", "47111 - Comércio"], n),
+        "volume_negocios": rng.choice([500_000.0, 5_000_000.0], n),
+        "autonomia_financeira": rng.uniform(0, 1, n),
+        "liquidez_geral": rng.uniform(0, 3, n),
+        "margem_ebitda": rng.uniform(-0.1, 0.3, n),
+        "rentabilidade_ativos": rng.uniform(-0.1, 0.2, n),
+        "endividamento": rng.uniform(0, 1, n),
+    })
+
+
+def test_group_keys():
+    assert cae_division("71120 - Engenharia e técnicas afins") == "71"
+    assert cae_division(None) == "*"
+    assert size_class(89_200) == "micro"
+    # Limites inclusivos: o valor exato do limite fica na classe inferior
+    assert size_class(2_000_000) == "micro"
+    assert size_class(2_000_000.01) == "pequena"
+    assert size_class(10_000_000) == "pequena"
+    assert size_class(50_000_000) == "media"
+    assert size_class(50_000_001) == "grande"
+    assert size_class(60_000_000) == "grande"
+
+
+def test_percentiles_match_group_distribution(peers_frame, tmp_path):
+    path = tmp_path / "benchmark.npz"
+    save_index(build_index(peers_frame, min_peers=20), path)
+    benchmark = SectorBenchmark.load(path)
+
+    group = peers_frame[(peers_frame["cae"].str.startswith("71")) &
+                        (peers_frame["volume_negocios"] < 2_000_000)]
+    value = float(group["autonomia_financeira"].median())
+    result = benchmark.compare("71120", 89_200, {"autonomia_financeira": value})
+
+    assert result["grupo_pares"] == "71/micro"
+    assert result["n_pares"] == len(group)
+    assert result["percentis"]["autonomia_financeira"] == pytest.approx(50, abs=2)
+    assert benchmark.compare("71120", 89_200, {"liquidez_geral": 99.0})["percentis"]["liquidez_geral"] == 100
+    assert benchmark.compare("71120", 89_200, {"liquidez_geral": -1.0})["percentis"]["liquidez_geral"] == 0
+
+
+def test_small_groups_fall_back_to_broader_peers(peers_frame):
+    benchmark = SectorBenchmark(build_index(peers_frame, min_peers=20))
+    assert benchmark.compare("71120", 80_000_000, {})["grupo_pares"] == "71/*"
+    assert benchmark.compare("01110", 89_200, {})["grupo_pares"] == "*/*"
+    assert benchmark.compare(None, None, {})["grupo_pares"] == "*/*"
+
+
+def test_lookup_is_fast(peers_frame):
+    benchmark = SectorBenchmark(build_index(peers_frame, min_peers=20))
+    ratios = {m: 0.5 for m in benchmark.metrics}
+    n = 10_000
+    start = time.perf_counter()
+    for _ in range(n):
+        benchmark.compare("71120", 89_200, ratios)
+    per_call_us = (time.perf_counter() - start) / n * 1e6
+    assert per_call_us < 50
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Testes dos links de download assinados (api/signed_downloads.py)
+"""
+
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api.downloads as downloads
+import api.signed_downloads as signed
+from api.signed_downloads import sign_download, verify_download
+
+SECRET = "segredo-de-teste"
+
+
+@pytest.fixture
+def output_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloads, "OUTPUT_ROOT", tmp_path)
+    monkeypatch.setattr(signed, "OUTPUT_ROOT", tmp_path)
+    monkeypatch.setattr(signed, "DOWNLOAD_SIGNING_SECRET", SECRET)
+    path = tmp_path / "sub" / "relatorio.json"
+    path.parent.mkdir()
+    path.write_bytes(b'{"ok": true}')
+    return path
+
+
+def test_signed_url_is_served_without_auth(output_file):
+    url = sign_download(str(output_file), "aiparati_1.json")
+    client = TestClient(signed.app)
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == b'{"ok": true}'
+    assert response.headers["content-type"] == "application/json"
+    assert 'filename="aiparati_1.json"' in response.headers["content-disposition"]
+
+
+def test_tampered_or_expired_links_are_rejected(output_file):
+    client = TestClient(signed.app)
+    url = sign_download(str(output_file), "a.json")
+
+    assert client.get(url.replace("relatorio", "outro")).status_code == 403
+    assert client.get(url.replace("name=a.json", "name=b.json")).status_code == 403
+
+    expired = sign_download(str(output_file), "a.json", ttl=-1)
+    assert client.get(expired).status_code == 403
+
+
+def test_verify_download_checks_secret_and_time(output_file):
+    url = sign_download(str(output_file), "a.json", ttl=60, now=1000)
+    query = {k: v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+    args = ("sub/relatorio.json", query["expires"], "a.json", query["sig"])
+
+    assert verify_download(*args, now=1000)
+    assert not verify_download(*args, now=1061)
+    assert not verify_download(*args, secret="outro", now=1000)
+
+
+def test_no_url_without_secret_or_outside_outputs(output_file, tmp_path, monkeypatch):
+    assert sign_download("/etc/passwd", "x") is None
+    monkeypatch.setattr(signed, "DOWNLOAD_SIGNING_SECRET", "")
+    assert sign_download(str(output_file), "a.json") is None
+
+
+@pytest.mark.parametrize("secret", ["", "change-me-download-secret"])
+def test_file_service_refuses_to_start_without_real_secret(monkeypatch, secret):
+    monkeypatch.setattr(signed, "DOWNLOAD_SIGNING_SECRET", secret)
+    with pytest.raises(RuntimeError):
+        with TestClient(signed.app):
+            pass
+
+
+def test_placeholder_secret_never_signs_or_verifies(output_file):
+    placeholder = "change-me-download-secret"
+    assert sign_download(str(output_file), "a.json", secret=placeholder) is None
+    signature = signed._signature(placeholder, "sub/relatorio.json", 2000, "a.json")
+    assert not verify_download("sub/relatorio.json", "2000", "a.json", signature, secret=placeholder, now=1000)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Testes do single-flight (single_flight.py) e da sua integração no motor
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+import autofund_ai_poc_v3 as engine_module
+from autofund_ai_poc_v3 import AutoFundAI, AnalysisCache, ExtractionCache, ExtracoesFinanceiras
+from cancellation import CancelToken, TaskCancelled
+from single_flight import SingleFlight, SingleFlightTimeout, file_lock
+from test_offline import create_mock_data
+
+
+def run_concurrently(fn, n=8):
+    barrier = threading.Barrier(n)
+    results, errors = [], []
+
+    def worker():
+        barrier.wait()
+        try:
+            results.append(fn())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution(tmp_path):
+    flight = SingleFlight("teste", lock_dir=tmp_path)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"ok": True}
+
+    results, errors = run_concurrently(lambda: flight.do("abc", slow))
+
+    assert not errors
+    assert len(calls) == 1
+    assert results == [{"ok": True}] * 8
+    assert flight.stats == {"executions": 1, "shared": 7}
+
+
+def test_exception_propagates_to_followers_and_is_not_cached():
+    flight = SingleFlight("teste")
+
+    def failing():
+        time.sleep(0.2)
+        raise RuntimeError("falhou")
+
+    results, errors = run_concurrently(lambda: flight.do("abc", failing), n=4)
+    assert not results and len(errors) == 4
+    # Depois de falhar, a chave volta a poder ser executada
+    assert flight.do("abc", lambda: 42) == 42
+
+
+def test_follower_retries_after_cancelled_leader():
+    flight = SingleFlight("teste")
+    leader_started = threading.Event()
+    cancel = threading.Event()
+    key_still_inflight = []
+
+    def cancelled_leader():
+        leader_started.set()
+        cancel.wait(5)
+        raise TaskCancelled("extração")
+
+    def run_leader():
+        with pytest.raises(TaskCancelled):
+            flight.do("k", cancelled_leader)
+
+    leader = threading.Thread(target=run_leader)
+    leader.start()
+    leader_started.wait(5)
+    # Quando o futuro é resolvido a chave já saiu de _inflight; senão o
+    # seguidor acordado reencontrava o futuro falhado e repetia em ciclo
+    flight._inflight["k"].add_done_callback(lambda _: key_still_inflight.append("k" in flight._inflight))
+    threading.Timer(0.05, cancel.set).start()
+
+    assert flight.do("k", lambda: "ok", timeout=5) == "ok"
+    leader.join(5)
+    assert key_still_inflight == [False]
+    assert flight.stats == {"executions": 2, "shared": 1}
+
+
+def _hold_lock(lock_dir, started, release):
+    with file_lock(lock_dir, "abc"):
+        started.set()
+        release.wait(5)
+
+
+def test_file_lock_excludes_other_processes(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    started, release = ctx.Event(), ctx.Event()
+    proc = ctx.Process(target=_hold_lock, args=(tmp_path, started, release))
+    proc.start()
+    try:
+        assert started.wait(10)
+        acquired = threading.Event()
+
+        def acquire():
+            with file_lock(tmp_path, "abc"):
+                acquired.set()
+
+        t = threading.Thread(target=acquire)
+        t.start()
+        assert not acquired.wait(0.3)
+        release.set()
+        assert acquired.wait(5)
+        t.join()
+    finally:
+        release.set()
+        proc.join(5)
+
+
+def test_lock_files_removed_after_release(tmp_path):
+    flight = SingleFlight("teste", lock_dir=tmp_path)
+    for key in ("a", "b", "c"):
+        assert flight.do(key, lambda: key) == key
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_lock_wait_is_bounded_and_cancellable(tmp_path):
+    with file_lock(tmp_path, "abc"):
+        started = time.monotonic()
+        with pytest.raises(SingleFlightTimeout):
+            with file_lock(tmp_path, "abc", deadline=time.monotonic() + 0.1):
+                pass
+        assert time.monotonic() - started < 1
+
+        token = CancelToken()
+        threading.Timer(0.05, token.cancel).start()
+        with pytest.raises(TaskCancelled):
+            with file_lock(tmp_path, "abc", cancel_token=token):
+                pass
+    # Libertado: o mesmo caminho volta a poder ser usado
+    with file_lock(tmp_path, "abc", deadline=time.monotonic() + 0.1):
+        pass
+
+
+def test_follower_gives_up_on_stuck_leader():
+    flight = SingleFlight("teste")
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=("k", lambda: release.wait(5)))
+    leader.start()
+    time.sleep(0.02)
+    try:
+        started = time.monotonic()
+        with pytest.raises(SingleFlightTimeout):
+            flight.do("k", lambda: "nunca", timeout=0.1)
+        assert time.monotonic() - started < 1
+
+        token = CancelToken()
+        threading.Timer(0.05, token.cancel).start()
+        with pytest.raises(TaskCancelled):
+            flight.do("k", lambda: "nunca", cancel_token=token)
+    finally:
+        release.set()
+        leader.join(5)
+
+
+def test_analysis_cache_entries_expire(tmp_path):
+    cache = AnalysisCache(tmp_path, ttl=60)
+    cache.put("a", {"memoria_descritiva": "m"})
+    assert cache.get("a") == {"memoria_descritiva": "m"}
+
+    old = time.time() - 120
+    os.utime(tmp_path / "a.json", (old, old))
+    cache.put("b", {})
+    assert not (tmp_path / "a.json").exists()
+    assert cache.get("a") is None and cache.get("b") == {}
+
+
+@pytest.fixture
+def autofund(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine_module, "EXTRACTION_FLIGHT", SingleFlight("extracao", tmp_path / "locks_e"))
+    monkeypatch.setattr(engine_module, "ANALYSIS_FLIGHT", SingleFlight("analise", tmp_path / "locks_a"))
+    engine = AutoFundAI("sk-test")
+    engine.extraction_cache = ExtractionCache(tmp_path / "extracoes")
+    engine.analyzer.analysis_cache = AnalysisCache(tmp_path / "analises")
+    engine.analytics_store = None
+    return engine
+
+
+def test_identical_pdfs_extracted_once(tmp_path, autofund, monkeypatch):
+    pdf = tmp_path / "ies.pdf"
+    pdf.write_bytes(b"%PDF-1.4 teste")
+    calls = []
+
+    def slow_extract(timeout=None):
+        calls.append(1)
+        time.sleep(0.2)
+        return create_mock_data()
+
+    monkeypatch.setattr(autofund.extractor, "upload_pdf", lambda *a, **kw: "file-1")
+    monkeypatch.setattr(autofund.extractor, "extract_financial_data", slow_extract)
+
+    results, errors = run_concurrently(lambda: autofund.extract(str(pdf)), n=5)
+
+    assert not errors and len(calls) == 1
+    assert all(isinstance(r, ExtracoesFinanceiras) for r in results)
+    assert engine_module.EXTRACTION_FLIGHT.stats == {"executions": 1, "shared": 4}
+
+
+def test_identical_analyses_call_model_once(autofund, monkeypatch):
+    calls = []
+
+    def slow_create(**kwargs):
+        calls.append(kwargs)
+        time.sleep(0.2)
+        text = '{"pontos_fortes": ["a"], "pontos_fracos": [], "recomendacoes": [], "memoria_descritiva": "m"}'
+        return SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+    monkeypatch.setattr(autofund.analyzer.client.messages, "create", slow_create)
+    data = ExtracoesFinanceiras(**create_mock_data())
+
+    results, errors = run_concurrently(lambda: autofund.analyzer.generate_analysis(data), n=4)
+
+    assert not errors and len(calls) == 1
+    assert all(r.memoria_descritiva == "m" for r in results)
+    # Pedido repetido depois é servido pela cache em disco
+    assert autofund.analyzer.generate_analysis(data).pontos_fortes == ["a"]
+    assert len(calls) == 1
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Testes de GET condicional e long-polling em /api/status
+"""
+
+import os
+import time
+import threading
+from datetime import datetime
+
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+from fastapi.testclient import TestClient
+
+import api.main as api_main
+
+HEADERS = {"Authorization": "Bearer polluser-token"}
+
+
+@pytest.fixture
+def client():
+    task = {"task_id": "poll-t", "user_id": "polluser", "status": "uploaded", "created_at": datetime.now()}
+    api_main.add_task(task)
+    with TestClient(api_main.app) as test_client:
+        yield test_client, task
+    api_main.remove_task(task)
+    # Cada TestClient tem o seu event loop
+    api_main.status_conditions.pop("poll-t", None)
+
+
+def get_status(client, etag=None, query=""):
+    headers = dict(HEADERS, **({"If-None-Match": etag} if etag else {}))
+    return client.get(f"/api/status/poll-t{query}", headers=headers)
+
+
+def test_etag_and_304(client):
+    client, task = client
+    first = get_status(client)
+    etag = first.headers["etag"]
+
+    response = get_status(client, etag)
+    assert response.status_code == 304 and response.headers["etag"] == etag
+
+    api_main.set_task_status(task, "extracting")
+    response = get_status(client, etag)
+    assert response.status_code == 200
+    assert response.json()["status"] == "extracting"
+    assert response.headers["etag"] != etag
+
+    # Projeções diferentes têm ETags diferentes
+    assert get_status(client, query="?fields=analise").headers["etag"] != response.headers["etag"]
+
+
+def test_long_poll_returns_on_stage_transition(client):
+    client, task = client
+    etag = get_status(client).headers["etag"]
+    threading.Timer(0.3, api_main.set_task_status, (task, "analyzing")).start()
+
+    started = time.monotonic()
+    response = get_status(client, etag, "?wait=10")
+    elapsed = time.monotonic() - started
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "analyzing"
+    assert 0.2 < elapsed < 5
+
+
+def test_long_poll_times_out_with_304(client):
+    client, _ = client
+    etag = get_status(client).headers["etag"]
+
+    started = time.monotonic()
+    response = get_status(client, etag, "?wait=0.3")
+    assert response.status_code == 304
+    assert time.monotonic() - started >= 0.3
+
+    assert get_status(client, etag, "?wait=1000").status_code == 422
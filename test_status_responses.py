@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Testes das respostas pré-serializadas de /api/status e /api/result
+"""
+
+import os
+import json
+from datetime import datetime
+
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+from fastapi.testclient import TestClient
+
+import api.main as api_main
+import api.signed_downloads as signed
+from api.responses import project, with_raw_fields, json_bytes
+
+HEADERS = {"Authorization": "Bearer statususer-token"}
+
+RESULT = {
+    "metadata": {"nif": "516807706", "ano_exercicio": "2023"},
+    "dados_financeiros": {"volume_negocios": 1000000.0, "ebitda": 150000.0},
+    "analise": {"nivel_risco": "BAIXO", "recomendacoes": ["a", "b"]},
+    "download_urls": {"excel": "/api/download/t/excel", "json": "/api/download/t/json"},
+    "ficheiros_gerados": {"excel": "outputs/x.xlsx", "json": "outputs/x.json"},
+}
+
+
+def test_project_and_raw_fields():
+    assert project(RESULT, [["analise", "nivel_risco"], ["metadata"], ["nao", "existe"]]) == {
+        "analise": {"nivel_risco": "BAIXO"}, "metadata": RESULT["metadata"]}
+    # Caminhos aninhados inexistentes não deixam dicts vazios na resposta
+    assert project(RESULT, [["analise", "nao", "existe"], ["dados_financeiros", "ebitda", "x"]]) == {}
+    assert project(RESULT, [["analise", "nivel_risco"], ["analise", "nao"]]) == {"analise": {"nivel_risco": "BAIXO"}}
+    assert json.loads(with_raw_fields(json_bytes({"a": 1}), b=b"[1,2]")) == {"a": 1, "b": [1, 2]}
+    assert json.loads(with_raw_fields(b"{}", b=b"null")) == {"b": None}
+
+
+@pytest.fixture
+def client():
+    task = {"task_id": "status-t", "user_id": "statusus", "status": "analyzing",
+            "created_at": datetime.now()}
+    api_main.add_task(task)
+    with TestClient(api_main.app) as test_client:
+        yield test_client, task
+    api_main.remove_task(task)
+
+
+def test_status_body_cached_per_stage(client):
+    client, task = client
+    response = client.get("/api/status/status-t", headers=HEADERS)
+    assert response.json()["status"] == "analyzing"
+    cached = task["status_body"]
+    assert client.get("/api/status/status-t", headers=HEADERS).content == cached
+
+    api_main.complete_task(task, dict(RESULT))
+    body = client.get("/api/status/status-t", headers=HEADERS).json()
+    assert body["status"] == "completed"
+    assert body["result"]["analise"]["nivel_risco"] == "BAIXO"
+    assert task["status_body"] is not cached
+
+
+def test_status_and_result_field_projection(client):
+    client, task = client
+    api_main.complete_task(task, dict(RESULT))
+
+    body = client.get("/api/status/status-t?fields=analise.nivel_risco", headers=HEADERS).json()
+    assert body["status"] == "completed"
+    assert body["result"] == {"analise": {"nivel_risco": "BAIXO"}}
+
+    body = client.get("/api/result/status-t?fields=dados_financeiros,ficheiros_gerados",
+                      headers=HEADERS).json()
+    assert body == {"dados_financeiros": RESULT["dados_financeiros"]}
+
+    assert client.get("/api/result/status-t?fields=a..b", headers=HEADERS).status_code == 400
+
+
+def test_result_served_from_bytes_with_fresh_signed_urls(client, monkeypatch, tmp_path):
+    client, task = client
+    api_main.complete_task(task, dict(RESULT))
+
+    body = client.get("/api/result/status-t", headers=HEADERS).json()
+    assert set(body) == {"metadata", "dados_financeiros", "analise", "download_urls", "signed_download_urls"}
+    assert body["signed_download_urls"] is None
+
+    monkeypatch.setattr(signed, "DOWNLOAD_SIGNING_SECRET", "s")
+    monkeypatch.setattr(signed, "OUTPUT_ROOT", api_main.OUTPUT_DIR)
+    body = client.get("/api/result/status-t", headers=HEADERS).json()
+    assert body["signed_download_urls"]["excel"].startswith("/files/x.xlsx?")
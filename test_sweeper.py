@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Testes da limpeza de tasks expiradas (api/sweeper.py)
+"""
+
+import os
+import gzip
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+from prometheus_client import REGISTRY
+
+from api.sweeper import TaskSweeper, load_retention
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def make_task(tmp_path, task_id, status="completed", age_hours=48, tier="free"):
+    upload = tmp_path / f"{task_id}_ies.pdf"
+    upload.write_bytes(b"%PDF" + b"0" * 1000)
+    output = tmp_path / f"{task_id}.json"
+    output.write_text('{"a": 1}' * 200)
+    return {
+        "task_id": task_id, "user_id": "u", "status": status, "subscription_tier": tier,
+        "file_path": str(upload), "created_at": NOW - timedelta(hours=age_hours),
+        "completed_at": NOW - timedelta(hours=age_hours),
+        "result": {"ficheiros_gerados": {"json": str(output)}} if status == "completed" else None,
+    }
+
+
+def make_sweeper(tasks, **kwargs):
+    return TaskSweeper(tasks, lambda task: tasks.pop(task["task_id"]), retention=load_retention(""), **kwargs)
+
+
+def test_retention_by_status_and_tier(tmp_path):
+    tasks = {t["task_id"]: t for t in [
+        make_task(tmp_path, "old-free"),
+        make_task(tmp_path, "old-premium", tier="premium"),
+        make_task(tmp_path, "recent", age_hours=2),
+        make_task(tmp_path, "running", status="analyzing", age_hours=500),
+        make_task(tmp_path, "old-error", status="error"),
+    ]}
+    stats = asyncio.run(make_sweeper(tasks).sweep(NOW))
+
+    assert sorted(tasks) == ["old-premium", "recent", "running"]
+    assert stats["tasks"] == 2 and stats["files"] == 3
+    assert not (tmp_path / "old-free_ies.pdf").exists()
+    assert not (tmp_path / "old-free.json").exists()
+    assert (tmp_path / "old-premium.json").exists()
+
+
+def reclaimed(action):
+    return REGISTRY.get_sample_value("autofund_sweeper_bytes_reclaimed_total", {"action": action}) or 0
+
+
+def test_archive_compresses_files_and_counts_bytes(tmp_path):
+    archive_dir = tmp_path / "archive"
+    tasks = {"t": make_task(tmp_path, "t")}
+    before = reclaimed("archive")
+
+    stats = asyncio.run(make_sweeper(tasks, action="archive", archive_dir=archive_dir).sweep(NOW))
+
+    assert stats["files"] == 2 and stats["bytes"] > 0
+    assert reclaimed("archive") - before == stats["bytes"]
+    assert gzip.decompress((archive_dir / "t" / "t.json.gz").read_bytes()) == ('{"a": 1}' * 200).encode()
+
+
+def test_orphan_files_removed_by_age(tmp_path):
+    live = make_task(tmp_path, "live")
+    live["status"] = "analyzing"
+    old_orphan = tmp_path / "orfao.xlsx"
+    old_orphan.write_bytes(b"x")
+    keep = tmp_path / "benchmark.npz"
+    keep.write_bytes(b"x")
+    for path in (old_orphan, keep, tmp_path / "live.json", tmp_path / "live_ies.pdf"):
+        os.utime(path, (time.time() - 10 * 3600,) * 2)
+
+    sweeper = make_sweeper({"live": live}, orphan_dirs=[tmp_path], orphan_hours=5)
+    asyncio.run(sweeper.sweep(datetime.now()))
+
+    assert not old_orphan.exists()
+    assert keep.exists()
+    assert (tmp_path / "live.json").exists() and (tmp_path / "live_ies.pdf").exists()
+
+
+def test_orphan_sweep_spares_tasks_held_elsewhere(tmp_path):
+    # Task de outro worker, adiada na fila offline partilhada
+    deferred = make_task(tmp_path, "deferred", status="uploaded")
+    stray = tmp_path / "stray_ies.pdf"
+    stray.write_bytes(b"x")
+    for path in (tmp_path / "deferred_ies.pdf", stray):
+        os.utime(path, (time.time() - 10 * 3600,) * 2)
+
+    sweeper = make_sweeper({}, orphan_dirs=[tmp_path], orphan_hours=5, held_tasks=lambda: [deferred])
+    asyncio.run(sweeper.sweep(datetime.now()))
+    assert (tmp_path / "deferred_ies.pdf").exists()
+    assert not stray.exists()
+
+    def unavailable():
+        raise OSError("database is locked")
+
+    stray.write_bytes(b"x")
+    os.utime(stray, (time.time() - 10 * 3600,) * 2)
+    sweeper = make_sweeper({}, orphan_dirs=[tmp_path], orphan_hours=5, held_tasks=unavailable)
+    asyncio.run(sweeper.sweep(datetime.now()))
+    assert stray.exists()
+
+
+def test_orphan_age_outlasts_longest_retention():
+    sweeper = make_sweeper({}, orphan_hours=None)
+    assert sweeper.orphan_hours > 720
+    sweeper = TaskSweeper({}, lambda task: None, retention=load_retention('{"completed": {"enterprise": 2000}}'),
+                          orphan_hours=None)
+    assert sweeper.orphan_hours > 2000
+
+
+def test_archives_of_different_tasks_do_not_collide(tmp_path):
+    archive_dir = tmp_path / "archive"
+    tasks = {}
+    for task_id in ("a", "b"):
+        task_dir = tmp_path / task_id
+        task_dir.mkdir()
+        task = make_task(task_dir, task_id)
+        # Outputs com o mesmo nome (mesmo NIF e instante) em tasks diferentes
+        same_name = task_dir / "analysis_516807706.json"
+        same_name.write_text(task_id)
+        task["result"]["ficheiros_gerados"] = {"json": str(same_name)}
+        tasks[task_id] = task
+
+    asyncio.run(make_sweeper(tasks, action="archive", archive_dir=archive_dir).sweep(NOW))
+
+    for task_id in ("a", "b"):
+        assert gzip.decompress((archive_dir / task_id / "analysis_516807706.json.gz").read_bytes()) == task_id.encode()
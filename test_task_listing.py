@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Testes do índice de tasks por utilizador e da paginação de /api/tasks
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+from fastapi.testclient import TestClient
+
+import api.main as api_main
+from api.task_index import TaskIndex
+
+HEADERS = {"Authorization": "Bearer listuser-token"}
+BASE = datetime(2024, 1, 1)
+
+
+def make_task(i, user_id="listuser", status="completed"):
+    return {"task_id": f"task-{i:03d}", "user_id": user_id, "status": status,
+            "created_at": BASE + timedelta(minutes=i)}
+
+
+def test_index_pages_newest_first_and_counts():
+    index = TaskIndex()
+    for i in range(7):
+        index.add(make_task(i, status="error" if i % 3 == 0 else "completed"))
+    index.add(make_task(99, user_id="outro"))
+
+    ids, cursor = index.page("listuser", 3)
+    assert ids == ["task-006", "task-005", "task-004"]
+    ids, cursor = index.page("listuser", 3, cursor)
+    assert ids == ["task-003", "task-002", "task-001"]
+    ids, cursor = index.page("listuser", 3, cursor)
+    assert ids == ["task-000"] and cursor is None
+
+    assert index.count("listuser") == 7
+    assert index.count("listuser", ["error"]) == 3
+    assert index.page("listuser", 10, statuses=["error"])[0] == ["task-006", "task-003", "task-000"]
+
+
+def test_index_tracks_status_changes_and_removal():
+    index = TaskIndex()
+    task = make_task(1, status="uploaded")
+    index.add(task)
+    index.set_status(task, "completed")
+    assert index.count("listuser", ["completed"]) == 1
+    assert index.count("listuser", ["uploaded"]) == 0
+
+    index.remove(task)
+    assert index.count("listuser") == 0
+    assert index.page("listuser", 10) == ([], None)
+
+
+def test_out_of_order_insert_keeps_order():
+    index = TaskIndex()
+    for i in (3, 1, 2):
+        index.add(make_task(i))
+    assert index.page("listuser", 10)[0] == ["task-003", "task-002", "task-001"]
+
+
+@pytest.fixture
+def client():
+    tasks = [make_task(i, status="processing" if i % 2 else "completed") for i in range(5)]
+    for task in tasks:
+        api_main.add_task(task)
+    with TestClient(api_main.app) as test_client:
+        yield test_client
+    for task in tasks:
+        api_main.remove_task(task)
+
+
+def test_api_pagination_and_total_header(client):
+    response = client.get("/api/tasks?limit=2", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.headers["x-total-count"] == "5"
+    body = response.json()
+    assert [t["task_id"] for t in body["tasks"]] == ["task-004", "task-003"]
+
+    response = client.get(f"/api/tasks?limit=2&cursor={body['next_cursor']}", headers=HEADERS)
+    assert [t["task_id"] for t in response.json()["tasks"]] == ["task-002", "task-001"]
+
+    response = client.get("/api/tasks?status=processing", headers=HEADERS)
+    assert response.headers["x-total-count"] == "2"
+    assert all(t["status"] == "processing" for t in response.json()["tasks"])
+
+
+def test_api_rejects_bad_cursor_and_limit(client):
+    assert client.get("/api/tasks?cursor=xx", headers=HEADERS).status_code == 400
+    assert client.get("/api/tasks?limit=1000", headers=HEADERS).status_code == 422
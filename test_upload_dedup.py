@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Testes de idempotência e deduplicação de uploads (/api/upload)
+"""
+
+import os
+import functools
+
+import pytest
+
+os.environ["MOCK_MODE"] = "true"
+
+from fastapi.testclient import TestClient
+
+import api.main as api_main
+
+
+@pytest.fixture
+def client(api_env, monkeypatch):
+    # Sem processamento em background: só interessa o registo das tasks
+    async def no_processing(task_id):
+        return None
+
+    monkeypatch.setattr(api_main, "process_ies_async", no_processing)
+    with TestClient(api_main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def upload(upload_ies):
+    return functools.partial(upload_ies, user="dedup-user")
+
+
+def test_identical_submission_returns_existing_task(client, upload, make_pdf):
+    first = upload(client, content=make_pdf(2))
+    second = upload(client, content=make_pdf(2))
+
+    assert first.status_code == second.status_code == 200
+    assert second.json()["task_id"] == first.json()["task_id"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert sum(t["user_id"] == "dedup-us" for t in api_main.active_tasks.values()) == 1
+
+
+def test_different_metadata_creates_new_task(client, upload, make_pdf):
+    first = upload(client, content=make_pdf(2))
+    second = upload(client, content=make_pdf(2), context="Outro contexto")
+    assert second.json()["task_id"] != first.json()["task_id"]
+
+
+def test_idempotency_key_replay_and_conflict(client, upload, make_pdf):
+    first = upload(client, content=make_pdf(2), headers={"Idempotency-Key": "abc-1"})
+    replay = upload(client, content=make_pdf(2), headers={"Idempotency-Key": "abc-1"})
+    assert replay.json()["task_id"] == first.json()["task_id"]
+
+    conflict = upload(client, content=make_pdf(3), headers={"Idempotency-Key": "abc-1"})
+    assert conflict.status_code == 422
+
+
+def test_failed_task_is_not_reused(client, upload, make_pdf):
+    first = upload(client, content=make_pdf(2))
+    api_main.active_tasks[first.json()["task_id"]]["status"] = "error"
+    second = upload(client, content=make_pdf(2))
+    assert second.json()["task_id"] != first.json()["task_id"]
+
+
+def test_deleted_task_is_forgotten(client, upload, make_pdf, auth_headers):
+    first = upload(client, content=make_pdf(2), headers={"Idempotency-Key": "abc-2"})
+    client.delete(f"/api/tasks/{first.json()['task_id']}", headers=auth_headers("dedup-user"))
+    second = upload(client, content=make_pdf(2), headers={"Idempotency-Key": "abc-2"})
+    assert second.json()["task_id"] != first.json()["task_id"]
+
+
+def test_concurrent_identical_submissions_create_one_task(api_env, monkeypatch, make_pdf, auth_headers):
+    import asyncio
+    import httpx
+    from conftest import UPLOAD_FORM
+    from api.quota import LocalQuotaLedger
+
+    class SlowLedger(LocalQuotaLedger):
+        # A reserva cede o event loop como faria um round-trip ao Redis
+        async def reserve(self, *args, **kwargs):
+            await super().reserve(*args, **kwargs)
+            await asyncio.sleep(0.01)
+
+    async def no_processing(task_id):
+        return None
+
+    ledger = SlowLedger()
+    monkeypatch.setattr(api_main, "quota_ledger", ledger)
+    monkeypatch.setattr(api_main, "process_ies_async", no_processing)
+
+    async def double_click():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            send = lambda: client.post(
+                "/api/upload",
+                headers=auth_headers("dedup-user"),
+                files={"file": ("ies.pdf", make_pdf(2), "application/pdf")},
+                data=UPLOAD_FORM,
+            )
+            return await asyncio.gather(send(), send())
+
+    first, second = asyncio.run(double_click())
+    assert first.status_code == second.status_code == 200
+    assert first.json()["task_id"] == second.json()["task_id"]
+    # A reserva do pedido repetido foi devolvida
+    assert asyncio.run(ledger.usage("dedup-us")).reserved == 1
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Testes da ingestão de uploads em blocos (api/ingest.py)
+"""
+
+import asyncio
+import hashlib
+import io
+
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile as StarletteUploadFile
+
+from api.ingest import ingest_upload, UploadSizeLimitMiddleware, UploadTooLarge, InvalidPDF, CHUNK_SIZE
+
+
+def as_upload(content: bytes, filename: str = "ies.pdf") -> StarletteUploadFile:
+    return StarletteUploadFile(file=io.BytesIO(content), filename=filename)
+
+
+def test_ingest_hashes_counts_pages_and_writes(tmp_path, make_pdf):
+    content = make_pdf(3)
+    upload = asyncio.run(ingest_upload(as_upload(content), tmp_path / "ies.pdf"))
+
+    assert upload.sha256 == hashlib.sha256(content).hexdigest()
+    assert upload.size == len(content)
+    assert upload.pages == 3
+    assert (tmp_path / "ies.pdf").read_bytes() == content
+
+
+def test_page_objects_split_across_chunks(tmp_path):
+    # Coloca "/Type /Page" a atravessar a fronteira entre blocos
+    prefix = b"%PDF-1.4\n"
+    marker = b"<< /Type /Page >>"
+    filler = b"x" * (CHUNK_SIZE - len(prefix) - 5)
+    content = prefix + filler + marker + b" << /Type /Pages >> " + marker
+    upload = asyncio.run(ingest_upload(as_upload(content), tmp_path / "ies.pdf"))
+    assert upload.pages == 2
+
+
+def test_ingest_enforces_size_limit_mid_stream(tmp_path, make_pdf):
+    content = make_pdf(1, padding=3 * CHUNK_SIZE)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(ingest_upload(as_upload(content), tmp_path / "ies.pdf", max_bytes=2 * CHUNK_SIZE))
+    assert not (tmp_path / "ies.pdf").exists()
+
+
+def test_ingest_enforces_page_limit(tmp_path, make_pdf):
+    with pytest.raises(InvalidPDF) as excinfo:
+        asyncio.run(ingest_upload(as_upload(make_pdf(5)), tmp_path / "ies.pdf", max_pages=4))
+    assert "páginas" in excinfo.value.detail
+    assert not (tmp_path / "ies.pdf").exists()
+
+    upload = asyncio.run(ingest_upload(as_upload(make_pdf(4)), tmp_path / "ies.pdf", max_pages=4))
+    assert upload.pages == 4
+
+
+def test_compressed_page_objects_use_page_tree(tmp_path, monkeypatch):
+    import api.ingest as ingest
+
+    # Páginas em object streams: nenhum "/Type /Page" legível no ficheiro
+    content = b"%PDF-1.5\n1 0 obj << /Type /ObjStm /Filter /FlateDecode >> stream\nxx\nendstream\n%%EOF"
+
+    class FakeReader:
+        def __init__(self, path):
+            self.pages = [object()] * 7
+
+    monkeypatch.setattr(ingest, "PdfReader", FakeReader)
+    upload = asyncio.run(ingest_upload(as_upload(content), tmp_path / "ies.pdf"))
+    assert upload.pages == 7
+    with pytest.raises(InvalidPDF):
+        asyncio.run(ingest_upload(as_upload(content), tmp_path / "ies.pdf", max_pages=6))
+
+    # Sem pypdf o número de páginas fica desconhecido e o PDF é recusado
+    monkeypatch.setattr(ingest, "PdfReader", None)
+    with pytest.raises(InvalidPDF) as excinfo:
+        asyncio.run(ingest_upload(as_upload(content), tmp_path / "ies.pdf"))
+    assert "páginas" in excinfo.value.detail
+    assert not (tmp_path / "ies.pdf").exists()
+
+
+def test_ingest_rejects_non_pdf(tmp_path):
+    with pytest.raises(InvalidPDF):
+        asyncio.run(ingest_upload(as_upload(b"PK\x03\x04 not a pdf"), tmp_path / "ies.pdf"))
+    assert not (tmp_path / "ies.pdf").exists()
+
+
+def test_middleware_rejects_oversized_body():
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, max_body_bytes=1024)
+
+    @app.post("/api/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"ok": True}
+
+    client = TestClient(app)
+    small = client.post("/api/upload", files={"file": ("a.pdf", b"%PDF-1.4", "application/pdf")})
+    assert small.status_code == 200
+
+    big = client.post("/api/upload", files={"file": ("a.pdf", b"%PDF-" + b"x" * 4096, "application/pdf")})
+    assert big.status_code == 413
+
+    # Corpo sem Content-Length (chunked): cortado a meio da leitura
+    boundary = "----autofund"
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.pdf\"\r\n"
+            f"Content-Type: application/pdf\r\n\r\n").encode() + b"%PDF-" + b"x" * 5000 \
+        + f"\r\n--{boundary}--\r\n".encode()
+
+    def chunked():
+        for i in range(0, len(body), 500):
+            yield body[i:i + 500]
+
+    streamed = client.post("/api/upload", content=chunked(),
+                           headers={"content-type": f"multipart/form-data; boundary={boundary}"})
+    assert streamed.status_code == 413
+
+
+def test_app_413_carries_cors_headers(api_env):
+    client = TestClient(api_env.app)
+    origin = "http://localhost:3000"
+    too_big = "9" * 12
+    response = client.post("/api/upload", content=b"x",
+                           headers={"Origin": origin, "content-length": too_big,
+                                    "content-type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == origin